@@ -0,0 +1,330 @@
+"""Análisis de los movimientos de toda la billetera en columnas NumPy.
+
+Carga todos los ``data/movimientos_*.csv`` (o el diario ``movimientos.txt`` de
+la consola, o un segmento binario de ``segmentos.py``) en columnas tipadas:
+montos y saldos en centavos ``int64``, fechas ``datetime64`` y usuario, tipo y
+descripción como códigos de categoría. Las consultas se resuelven con operaciones vectorizadas en lugar de recorrer
+diccionarios, de modo que un reporte de toda la billetera sobre millones de
+movimientos tarda segundos.
+
+Requiere ``numpy``, que no es necesario para el resto de la aplicación.
+
+Uso: python analitica.py [--txt movimientos.txt | --segmento movimientos.kwm] [--top 5]
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence
+
+from io_archivos import DATA_DIR
+from registros import tipo_y_descripcion
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - dependencia opcional
+    np = None
+
+CAMPOS = ("usuario", "fecha", "tipo", "descripcion", "monto", "saldo")
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+TAMANIO_BLOQUE = 4 * 1024 * 1024
+
+
+def _requerir_numpy() -> None:
+    if np is None:
+        raise ImportError("El módulo analitica necesita numpy (pip install numpy).")
+
+
+def _a_centavos(valores: Sequence[str]) -> Any:
+    try:
+        numeros = np.fromiter(map(float, valores), np.float64, len(valores))
+    except ValueError:
+        # Algún valor no es numérico: se convierte uno por uno y se toma como 0.
+        numeros = np.fromiter(map(_a_float, valores), np.float64, len(valores))
+    return np.rint(numeros * 100).astype(np.int64)
+
+
+def _a_float(valor: str) -> float:
+    try:
+        return float(valor)
+    except ValueError:
+        return 0.0
+
+
+def _a_fechas(valores: Sequence[str]) -> Any:
+    try:
+        return np.asarray(valores, dtype="datetime64[s]")
+    except ValueError:
+        fechas = np.empty(len(valores), dtype="datetime64[s]")
+        for indice, valor in enumerate(valores):
+            try:
+                fechas[indice] = np.datetime64(valor, "s")
+            except ValueError:
+                fechas[indice] = np.datetime64("NaT")
+        return fechas
+
+
+@dataclass
+class TablaMovimientos:
+    """Movements of every user stored column by column."""
+
+    usuario: Any
+    usuarios: Any
+    fecha: Any
+    tipo: Any
+    tipos: Any
+    descripcion: Any
+    descripciones: Any
+    monto: Any
+    saldo: Any
+
+    def __len__(self) -> int:
+        return len(self.monto)
+
+    def _por_tipo(self, *claves: str) -> Any:
+        """Boolean mask of the rows whose type contains any of *claves*."""
+        coincide = np.array([any(clave in tipo.lower() for clave in claves) for tipo in self.tipos], dtype=bool)
+        return coincide[self.tipo] if len(coincide) else np.zeros(len(self), dtype=bool)
+
+    def ingresos_gastos_mensuales(self) -> List[Dict[str, Any]]:
+        """Return income and expenses per user and month, grouped by user and sorted by month."""
+        if not len(self):
+            return []
+        meses, mes = np.unique(self.fecha.astype("datetime64[M]"), return_inverse=True)
+        clave = self.usuario.astype(np.int64) * len(meses) + mes
+        total = len(self.usuarios) * len(meses)
+        ingresos = np.bincount(clave, weights=np.where(self._por_tipo("ingreso", "recarga"), self.monto, 0), minlength=total)
+        gastos = np.bincount(clave, weights=np.where(self._por_tipo("pago"), self.monto, 0), minlength=total)
+        presentes = np.flatnonzero(np.bincount(clave, minlength=total))
+        return [
+            {
+                "usuario": str(self.usuarios[indice // len(meses)]),
+                "mes": str(meses[indice % len(meses)]),
+                "ingresos": round(ingresos[indice]) / 100,
+                "gastos": round(gastos[indice]) / 100,
+            }
+            for indice in presentes
+        ]
+
+    def servicios_mas_pagados(self, cantidad: int = 10) -> List[Dict[str, Any]]:
+        """Return the *cantidad* services with the highest total paid."""
+        pagos = self._por_tipo("servicio")
+        codigos = self.descripcion[pagos]
+        totales = np.bincount(codigos, weights=self.monto[pagos], minlength=len(self.descripciones))
+        veces = np.bincount(codigos, minlength=len(self.descripciones))
+        orden = np.argsort(-totales, kind="stable")[:cantidad]
+        return [
+            {"servicio": str(self.descripciones[indice]), "total": round(totales[indice]) / 100, "pagos": int(veces[indice])}
+            for indice in orden
+            if veces[indice]
+        ]
+
+    def saldos_actuales(self) -> Any:
+        """Return each user's latest balance in cents, indexed by user code."""
+        orden = np.lexsort((np.arange(len(self)), self.fecha, self.usuario))
+        usuarios_ordenados = self.usuario[orden]
+        ultimos = np.flatnonzero(np.append(usuarios_ordenados[1:] != usuarios_ordenados[:-1], True))
+        return self.saldo[orden[ultimos]]
+
+    def percentiles_saldo(self, percentiles: Iterable[float] = PERCENTILES) -> Dict[float, float]:
+        """Return the given percentiles of the users' latest balances."""
+        percentiles = list(percentiles)
+        if not len(self):
+            return {percentil: 0.0 for percentil in percentiles}
+        valores = np.percentile(self.saldos_actuales(), percentiles)
+        return {percentil: round(float(valor)) / 100 for percentil, valor in zip(percentiles, valores)}
+
+
+class ConstructorTabla:
+    """Accumulate typed column blocks while the movement files are read.
+
+    Each block is converted as soon as it is added, so millions of Python
+    strings never coexist in memory (nor get scanned by the garbage collector).
+    Categories are numbered in order of first appearance.
+    """
+
+    def __init__(self) -> None:
+        _requerir_numpy()
+        self._categorias: Dict[str, Dict[str, int]] = {"usuario": {}, "tipo": {}, "descripcion": {}}
+        self._bloques: Dict[str, List[Any]] = {campo: [] for campo in CAMPOS}
+
+    def _codificar(self, campo: str, valores: Sequence[str]) -> Any:
+        categorias = self._categorias[campo]
+        return np.fromiter((categorias.setdefault(valor, len(categorias)) for valor in valores), np.int32, len(valores))
+
+    def agregar(
+        self,
+        usuarios: Sequence[str],
+        fechas: Sequence[str],
+        tipos: Sequence[str],
+        descripciones: Sequence[str],
+        montos: Sequence[str],
+        saldos: Sequence[str],
+    ) -> None:
+        """Add parallel text columns (ISO dates, plain decimal amounts)."""
+        bloque = {
+            "usuario": self._codificar("usuario", usuarios),
+            "fecha": _a_fechas(fechas),
+            "tipo": self._codificar("tipo", tipos),
+            "descripcion": self._codificar("descripcion", descripciones),
+            "monto": _a_centavos(montos),
+            "saldo": _a_centavos(saldos),
+        }
+        for campo, valores in bloque.items():
+            self._bloques[campo].append(valores)
+
+    def tabla(self) -> TablaMovimientos:
+        vacias = {"usuario": np.int32, "fecha": "datetime64[s]", "tipo": np.int32, "descripcion": np.int32}
+        columnas = {
+            campo: np.concatenate(bloques) if bloques else np.array([], dtype=vacias.get(campo, np.int64))
+            for campo, bloques in self._bloques.items()
+        }
+        categorias = {campo: np.array(list(valores), dtype=str) for campo, valores in self._categorias.items()}
+        return TablaMovimientos(
+            usuarios=categorias["usuario"],
+            tipos=categorias["tipo"],
+            descripciones=categorias["descripcion"],
+            **columnas,
+        )
+
+
+def cargar_csv(directorio: Path = DATA_DIR) -> TablaMovimientos:
+    """Load every ``movimientos_{usuario}.csv`` found in *directorio*."""
+    constructor = ConstructorTabla()
+    for ruta in sorted(directorio.glob("movimientos_*.csv")):
+        with ruta.open("r", encoding="utf-8", newline="") as archivo:
+            lector = csv.reader(archivo)
+            encabezado = next(lector, None)
+            if encabezado is None:
+                continue
+            posiciones = [encabezado.index(campo) for campo in ("fecha", "tipo", "descripcion", "monto", "saldo_resultante")]
+            filas = [fila for fila in lector if len(fila) == len(encabezado)]
+        if not filas:
+            continue
+        columnas = list(zip(*filas))
+        usuario = ruta.stem[len("movimientos_") :]
+        constructor.agregar([usuario] * len(filas), *(columnas[posicion] for posicion in posiciones))
+    return constructor.tabla()
+
+
+def _agregar_lineas_txt(constructor: ConstructorTabla, lineas: List[str]) -> None:
+    columnas: List[List[str]] = [[], [], [], [], [], []]
+    usuarios, fechas, tipos, descripciones, montos, saldos = columnas
+    for linea in lineas:
+        partes = linea.rstrip("\n").split(";")
+        if len(partes) < 5:
+            continue
+        usuario, fecha, concepto, monto, saldo = partes[:5]
+        usuarios.append(usuario)
+        fechas.append(f"{fecha[6:10]}-{fecha[3:5]}-{fecha[0:2]}")
+        tipo, descripcion = tipo_y_descripcion(concepto)
+        tipos.append(tipo)
+        descripciones.append(descripcion)
+        montos.append(monto.lstrip("$"))
+        saldos.append(saldo.lstrip("$"))
+    constructor.agregar(*columnas)
+
+
+def cargar_txt(ruta: Path = Path("movimientos.txt"), tamanio_bloque: int = TAMANIO_BLOQUE) -> TablaMovimientos:
+    """Load the console journal ``usuario;DD/MM/AAAA;concepto;$monto;$saldo``."""
+    constructor = ConstructorTabla()
+    if ruta.exists():
+        with ruta.open("r", encoding="utf-8") as archivo:
+            while True:
+                lineas = archivo.readlines(tamanio_bloque)
+                if not lineas:
+                    break
+                _agregar_lineas_txt(constructor, lineas)
+    return constructor.tabla()
+
+
+def cargar_segmento(ruta: Path) -> TablaMovimientos:
+    """Load a binary segment written by :mod:`segmentos`.
+
+    The numeric columns are read straight from the mapped records with
+    ``numpy.frombuffer``; only the string table is decoded. Movements without
+    a type (imported from the console journal) get it from the concept, as in
+    :func:`cargar_txt`.
+    """
+    _requerir_numpy()
+    from segmentos import FECHA_TEXTO, SegmentoMovimientos
+
+    # Mismo diseño que segmentos.REGISTRO.
+    registro = np.dtype(
+        {
+            "names": ["usuario", "fecha", "tipo", "concepto", "monto", "saldo", "marcas"],
+            "formats": ["<u4", "<i8", "<u4", "<u4", "<i8", "<i8", "<u2"],
+            "offsets": [0, 4, 12, 16, 20, 28, 36],
+            "itemsize": 40,
+        }
+    )
+    with SegmentoMovimientos(ruta) as segmento:
+        datos = np.frombuffer(segmento.vista_registros(), dtype=registro)
+        numeros_usuario, usuario = np.unique(datos["usuario"], return_inverse=True)
+        numeros_tipo, tipo_original = np.unique(datos["tipo"], return_inverse=True)
+        numeros_concepto, concepto = np.unique(datos["concepto"], return_inverse=True)
+        usuarios = [segmento.cadena(int(numero)) for numero in numeros_usuario]
+        textos_tipo = [segmento.cadena(int(numero)) for numero in numeros_tipo]
+        textos_concepto = [segmento.cadena(int(numero)) for numero in numeros_concepto]
+        fecha = datos["fecha"].astype("datetime64[s]")
+        fecha[(datos["marcas"] & FECHA_TEXTO) != 0] = np.datetime64("NaT")
+        monto = datos["monto"].astype(np.int64)
+        saldo = datos["saldo"].astype(np.int64)
+        del datos
+    # Los códigos se traducen por categoría y luego se aplican a todas las filas.
+    categorias: Dict[str, Dict[str, int]] = {"tipo": {}, "descripcion": {}}
+
+    def codigos(campo: str, textos: Iterable[str]) -> Any:
+        numeros = categorias[campo]
+        return np.array([numeros.setdefault(texto, len(numeros)) for texto in textos], dtype=np.int32)
+
+    derivados = [tipo_y_descripcion(texto) for texto in textos_concepto]
+    sin_tipo = np.array([not texto for texto in textos_tipo], dtype=bool)[tipo_original]
+    tipos_vistos = categorias["tipo"]
+    tipo_propio = np.array(
+        [tipos_vistos.setdefault(texto, len(tipos_vistos)) if texto else -1 for texto in textos_tipo], dtype=np.int32
+    )[tipo_original]
+    tipo_derivado = codigos("tipo", (par[0] for par in derivados))[concepto]
+    descripcion_propia = codigos("descripcion", textos_concepto)[concepto]
+    descripcion_derivada = codigos("descripcion", (par[1] for par in derivados))[concepto]
+    return TablaMovimientos(
+        usuario=usuario.astype(np.int32),
+        usuarios=np.array(usuarios, dtype=str),
+        fecha=fecha,
+        tipo=np.where(sin_tipo, tipo_derivado, tipo_propio),
+        tipos=np.array(list(categorias["tipo"]), dtype=str),
+        descripcion=np.where(sin_tipo, descripcion_derivada, descripcion_propia),
+        descripciones=np.array(list(categorias["descripcion"]), dtype=str),
+        monto=monto,
+        saldo=saldo,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reportes de toda la billetera sobre columnas NumPy.")
+    parser.add_argument("--txt", type=Path, help="leer el diario de la consola en lugar de data/movimientos_*.csv")
+    parser.add_argument("--segmento", type=Path, help="leer un segmento binario generado con segmentos.py")
+    parser.add_argument("--top", type=int, default=5, help="cantidad de servicios a listar")
+    argumentos = parser.parse_args()
+    if argumentos.segmento:
+        tabla = cargar_segmento(argumentos.segmento)
+    elif argumentos.txt:
+        tabla = cargar_txt(argumentos.txt)
+    else:
+        tabla = cargar_csv()
+    print(f"Movimientos: {len(tabla)} | Usuarios: {len(tabla.usuarios)}")
+    print("\nIngresos y gastos por mes:")
+    for fila in tabla.ingresos_gastos_mensuales():
+        print(f"  {fila['usuario']:<20} {fila['mes']}  +{fila['ingresos']:>12.2f}  -{fila['gastos']:>12.2f}")
+    print("\nServicios más pagados:")
+    for fila in tabla.servicios_mas_pagados(argumentos.top):
+        print(f"  {fila['servicio']:<20} {fila['total']:>12.2f} ({fila['pagos']} pagos)")
+    print("\nPercentiles del saldo actual:")
+    for percentil, valor in tabla.percentiles_saldo().items():
+        print(f"  p{percentil:<3} {valor:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Tiempo hasta la primera pantalla de la consola.
+
+Lanza ``python main.py`` ``--repeticiones`` veces en un directorio con datos de
+prueba (``--usuarios`` cuentas con ``--movimientos`` movimientos cada una) y
+mide cuánto tarda en aparecer el primer ``Seleccione:``, que es lo que espera
+un script que invoca la billetera. Informa el mínimo, la mediana y el máximo.
+
+Uso: python benchmarks/arranque.py --usuarios 1000 --movimientos 20
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List
+
+RAIZ = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(RAIZ))
+
+import helpers  # noqa: E402
+import registros  # noqa: E402
+
+PROMPT = b"Seleccione: "
+
+
+def preparar_datos(usuarios: int, movimientos: int) -> None:
+    """Seed the txt files of the current directory."""
+    helpers.inicializar_archivos()
+    nombres = [f"usuario{numero}" for numero in range(usuarios)]
+    helpers.guardar_usuarios({nombre: {"clave": "x", "saldo": float(movimientos)} for nombre in nombres})
+    helpers.guardar_tarjetas(
+        {
+            nombre: {"visa": {"alias": "visa", "numero": "4111111111111111", "tipo": "credito", "vencimiento": "12/30"}}
+            for nombre in nombres
+        }
+    )
+    helpers.agregar_movimientos(
+        [
+            (nombre, registros.Movimiento(registros.fecha_desde_texto("01/01/2024"), "Ingreso de dinero", 100, (indice + 1) * 100))
+            for indice in range(movimientos)
+            for nombre in nombres
+        ]
+    )
+
+
+def medir_arranque(argumentos_main: List[str]) -> float:
+    """Start the console once and return the seconds until the first prompt."""
+    inicio = time.perf_counter()
+    proceso = subprocess.Popen(
+        [sys.executable, str(RAIZ / "main.py"), *argumentos_main],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    leido = b""
+    while not leido.endswith(PROMPT):
+        parte = os.read(proceso.stdout.fileno(), 4096)
+        if not parte:
+            raise RuntimeError("La consola terminó antes de mostrar el menú.")
+        leido += parte
+    duracion = time.perf_counter() - inicio
+    proceso.communicate(b"3\n")
+    return duracion
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--movimientos", type=int, default=20, help="movimientos por usuario")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--sqlite", action="store_true", help="importar los datos a SQLite y arrancar con --sqlite")
+    argumentos = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directorio:
+        anterior = os.getcwd()
+        os.chdir(directorio)
+        try:
+            preparar_datos(argumentos.usuarios, argumentos.movimientos)
+            argumentos_main: List[str] = []
+            if argumentos.sqlite:
+                from repositorio import RepositorioSQLite
+
+                repositorio = RepositorioSQLite("kiwillet.db")
+                repositorio.importar_archivos()
+                repositorio.cerrar()
+                argumentos_main = ["--sqlite", "kiwillet.db"]
+            tiempos = [medir_arranque(argumentos_main) for _ in range(argumentos.repeticiones)]
+        finally:
+            os.chdir(anterior)
+    print(
+        f"Primera pantalla ({argumentos.usuarios} usuarios): "
+        f"mín {min(tiempos) * 1000:.1f} ms | mediana {statistics.median(tiempos) * 1000:.1f} ms | "
+        f"máx {max(tiempos) * 1000:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
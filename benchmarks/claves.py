@@ -0,0 +1,103 @@
+"""Logins por segundo con cada costo del hash de contraseñas.
+
+Para cada costo de ``--costos`` (``algoritmo:parametro=valor,...``, o
+``sha256`` para el hash sin sal anterior) calcula un hash y lo verifica
+``--logins`` veces: primero de a uno en el hilo que llama, como el login de la
+consola, y después en un ``seguridad.PoolClaves`` de ``--hilos`` hilos, como
+el servidor o un lote de logins. Informa milisegundos por login y logins por
+segundo de cada forma; con más de un núcleo el pool debería escalar, porque
+hashlib libera el GIL mientras deriva la clave.
+
+Uso: python benchmarks/claves.py --costos scrypt:n=16384 pbkdf2_sha256:i=600000 --logins 50
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import seguridad  # noqa: E402
+
+CLAVE = "clave123"
+COSTOS = [
+    "sha256",
+    "pbkdf2_sha256:i=100000",
+    "pbkdf2_sha256:i=310000",
+    "pbkdf2_sha256:i=600000",
+    "scrypt:n=8192",
+    "scrypt:n=16384",
+    "scrypt:n=32768",
+]
+
+
+def leer_costo(texto: str) -> Tuple[str, Dict[str, int]]:
+    """Parse ``algoritmo:parametro=valor,...`` into the algorithm and its parameters."""
+    algoritmo, _, parametros = texto.partition(":")
+    if algoritmo != "sha256" and algoritmo not in seguridad.COSTOS:
+        raise argparse.ArgumentTypeError(f"algoritmo desconocido: {algoritmo}")
+    costo = {}
+    for par in filter(None, parametros.split(",")):
+        nombre, _, valor = par.partition("=")
+        if nombre not in seguridad.COSTOS.get(algoritmo, {}):
+            raise argparse.ArgumentTypeError(f"parámetro desconocido: {nombre}")
+        costo[nombre] = int(valor)
+    return algoritmo, costo
+
+
+def calcular_hash(algoritmo: str, costo: Dict[str, int]) -> str:
+    if algoritmo == "sha256":
+        return hashlib.sha256(CLAVE.encode("utf-8")).hexdigest()
+    return seguridad.hash_password(CLAVE, algoritmo, **costo)
+
+
+def cronometrar(funcion: Callable[[], None]) -> float:
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def medir(texto: str, logins: int, pool: seguridad.PoolClaves) -> Tuple[float, float]:
+    """Return the seconds taken by *logins* verifications in this thread and in *pool*."""
+    password_hash = calcular_hash(*leer_costo(texto))
+
+    def en_serie() -> None:
+        for _ in range(logins):
+            assert seguridad.verificar_password(CLAVE, password_hash)
+
+    def en_pool() -> None:
+        assert all(pool.verificar_lote((CLAVE, password_hash) for _ in range(logins)))
+
+    return cronometrar(en_serie), cronometrar(en_pool)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--costos", nargs="+", default=COSTOS, help="por ejemplo scrypt:n=16384,r=8 o pbkdf2_sha256:i=600000")
+    parser.add_argument("--logins", type=int, default=20, help="verificaciones por costo")
+    parser.add_argument("--hilos", type=int, default=os.cpu_count() or 1, help="hilos del pool")
+    argumentos = parser.parse_args()
+    for texto in argumentos.costos:
+        try:
+            leer_costo(texto)
+        except (argparse.ArgumentTypeError, ValueError) as error:
+            parser.error(f"costo inválido {texto!r}: {error}")
+    logins = max(1, argumentos.logins)
+    pool = seguridad.PoolClaves(argumentos.hilos)
+    print(f"{'costo':<26} {'ms/login':>9} {'logins/s':>9} {'pool logins/s':>14}")
+    try:
+        for texto in argumentos.costos:
+            serie, paralelo = medir(texto, logins, pool)
+            print(f"{texto:<26} {serie * 1000 / logins:>9.2f} {logins / serie:>9.1f} {logins / paralelo:>14.1f}", flush=True)
+    finally:
+        pool.cerrar()
+    print(f"\n{argumentos.hilos} hilos en el pool, {os.cpu_count()} núcleos.")
+
+
+if __name__ == "__main__":
+    main()
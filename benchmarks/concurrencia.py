@@ -0,0 +1,86 @@
+"""Escalabilidad de la billetera con varios procesos sobre cuentas distintas.
+
+Cada proceso hace ``--operaciones`` ingresos sobre su propio grupo de usuarios
+usando el mismo camino que la consola (bloqueo del usuario, relectura del saldo
+y commit agrupado). Se mide el total de operaciones por segundo para 1, 2, 4...
+procesos y al final se verifica que no se haya perdido ningún ingreso.
+
+Uso: python benchmarks/concurrencia.py --procesos 1 2 4 8
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers  # noqa: E402
+import transacciones  # noqa: E402
+
+USUARIOS_POR_PROCESO = 8
+
+
+def _trabajar(indice: int, operaciones: int, barrera) -> None:
+    usuarios = helpers.leer_usuarios()
+    propios = [f"p{indice}_u{numero}" for numero in range(USUARIOS_POR_PROCESO)]
+    confirmador = transacciones.CommitGrupal(helpers)
+    movimientos: dict = {}
+    barrera.wait()
+    for numero in range(operaciones):
+        usuario = propios[numero % len(propios)]
+        transacciones.mover_saldo(helpers, confirmador, usuarios, movimientos, usuario, 1.0, "Ingreso", "01/01/2024")
+    confirmador.cerrar()
+
+
+def medir(procesos: int, operaciones: int) -> float:
+    """Run *procesos* workers on disjoint users in a fresh directory and return ops/sec."""
+    with tempfile.TemporaryDirectory() as directorio:
+        anterior = os.getcwd()
+        os.chdir(directorio)
+        try:
+            helpers.inicializar_archivos()
+            helpers.guardar_usuarios(
+                {
+                    f"p{indice}_u{numero}": {"clave": "x", "saldo": 0.0}
+                    for indice in range(procesos)
+                    for numero in range(USUARIOS_POR_PROCESO)
+                }
+            )
+            barrera = multiprocessing.Barrier(procesos + 1)
+            trabajadores = [
+                multiprocessing.Process(target=_trabajar, args=(indice, operaciones, barrera)) for indice in range(procesos)
+            ]
+            for trabajador in trabajadores:
+                trabajador.start()
+            barrera.wait()
+            inicio = time.perf_counter()
+            for trabajador in trabajadores:
+                trabajador.join()
+            duracion = time.perf_counter() - inicio
+            total = sum(datos["saldo"] for datos in helpers.leer_usuarios().values())
+            if total != procesos * operaciones:
+                raise RuntimeError(f"Se perdieron ingresos: {total} de {procesos * operaciones}")
+        finally:
+            os.chdir(anterior)
+    return procesos * operaciones / duracion
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--procesos", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--operaciones", type=int, default=500, help="ingresos por proceso")
+    argumentos = parser.parse_args()
+    base = None
+    for procesos in argumentos.procesos:
+        por_segundo = medir(procesos, argumentos.operaciones)
+        base = base or por_segundo / procesos
+        print(f"{procesos:>3} procesos: {por_segundo:>10.0f} op/s  (x{por_segundo / base:.2f})")
+
+
+if __name__ == "__main__":
+    main()
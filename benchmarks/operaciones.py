@@ -0,0 +1,408 @@
+"""Tiempo de cada operación de la billetera a medida que crecen los datos.
+
+Genera datos sintéticos deterministas (``--usuarios`` cuentas con
+``--movimientos`` movimientos y ``--tarjetas`` tarjetas cada una y un catálogo
+de ``--servicios`` servicios) en un directorio temporal y mide, llamando a las
+funciones directamente en lugar de pasar por ``input()``:
+
+* ``carga``: leer usuarios, tarjetas y catálogo como al arrancar;
+* ``login``, ``deposito``, ``pago``, ``movimientos`` (última página),
+  ``tarjeta`` (alta y baja) y ``reporte``.
+
+Lo hace con los dos formatos: ``consola`` (``helpers.py`` y los txt, por el
+mismo camino que ``main.py``) y ``servicios`` (``usuarios.py``,
+``tarjetas.py``, ``movimientos.py`` y ``servicios.py``, como ``servidor.py``).
+La consola no tiene reporte: ahí ``reporte`` calcula las mismas estadísticas
+sobre las líneas del usuario en el diario.
+
+El resultado es un JSON (``--salida``) que incluye, por escenario, los
+contadores de ``metricas`` (llamadas, bytes y filas de cada lectura y
+escritura); con ``--comparar anterior.json`` se muestra además cuánto cambió la
+mediana de cada operación.
+
+Uso: python benchmarks/operaciones.py --usuarios 1000 --movimientos 100 --salida hoy.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers  # noqa: E402
+import io_archivos  # noqa: E402
+import logger  # noqa: E402
+import metricas  # noqa: E402
+import movimientos  # noqa: E402
+import seguridad  # noqa: E402
+import servicios  # noqa: E402
+import tarjetas  # noqa: E402
+import transacciones  # noqa: E402
+import usuarios  # noqa: E402
+from registros import Movimiento, concepto_consola, tipo_y_descripcion  # noqa: E402
+
+CLAVE = "clave123"
+NOMBRES_SERVICIOS = ["Luz", "Agua", "Gas", "Internet", "Telefonía", "Cable", "Seguro", "Gimnasio", "Colegio", "Expensas"]
+CATEGORIAS = ["Hogar", "Comunicación", "Salud", "Educación"]
+OPERACIONES = ["carga", "login", "deposito", "pago", "movimientos", "tarjeta", "reporte"]
+POR_PAGINA = 10
+MONTO_OPERACION = 1.0
+
+
+@dataclass
+class Parametros:
+    usuarios: int
+    movimientos: int
+    tarjetas: int
+    servicios: int
+    semilla: int
+
+
+# ---------------- Generación de datos ----------------
+
+
+def generar_servicios(parametros: Parametros) -> List[Dict[str, str]]:
+    azar = random.Random(parametros.semilla)
+    return [
+        {
+            "codigo": f"s{numero:05d}",
+            "nombre": f"{NOMBRES_SERVICIOS[numero % len(NOMBRES_SERVICIOS)]} {numero // len(NOMBRES_SERVICIOS) + 1}",
+            "categoria": CATEGORIAS[numero % len(CATEGORIAS)],
+            "monto": str(azar.randint(500, 9000)),
+        }
+        for numero in range(parametros.servicios)
+    ]
+
+
+def nombre_usuario(numero: int) -> str:
+    return f"u{numero:06d}"
+
+
+def generar_cuentas(
+    parametros: Parametros, catalogo: List[Dict[str, str]]
+) -> Iterator[Tuple[str, int, List[Dict[str, str]], List[Movimiento]]]:
+    """Yield ``(usuario, saldo_centavos, tarjetas, movimientos)`` for every account, in order.
+
+    Movements use the service layout (date and time, type and description).
+    """
+    azar = random.Random(parametros.semilla + 1)
+    inicio = datetime(2024, 1, 1, 8, 0, 0)
+    paso = timedelta(days=366) / max(parametros.movimientos, 1)
+    for numero in range(parametros.usuarios):
+        lista_tarjetas = [
+            {
+                "alias": f"tarjeta{indice}",
+                "numero": "".join(str(azar.randint(0, 9)) for _ in range(16)),
+                "tipo": azar.choice(["credito", "debito"]),
+                "vencimiento": f"{azar.randint(1, 12):02d}/{azar.randint(27, 32)}",
+            }
+            for indice in range(parametros.tarjetas)
+        ]
+        saldo = 0
+        lista: List[Movimiento] = []
+        for indice in range(parametros.movimientos):
+            fecha = (inicio + paso * indice).replace(microsecond=0)
+            if not catalogo or saldo < 10_000_00 or azar.random() < 0.5:
+                centavos = azar.randint(1_000_00, 50_000_00)
+                saldo += centavos
+                lista.append(Movimiento(fecha, "Ingreso de dinero", centavos, saldo, "Ingreso"))
+            else:
+                servicio = azar.choice(catalogo)
+                centavos = int(servicio["monto"]) * 100
+                saldo -= centavos
+                lista.append(Movimiento(fecha, servicio["nombre"], centavos, saldo, "Pago servicio"))
+        yield nombre_usuario(numero), saldo, lista_tarjetas, lista
+
+
+# ---------------- Escenarios ----------------
+
+
+class EscenarioConsola:
+    """The txt files of ``helpers.py``, driven the way ``main.py`` does."""
+
+    nombre = "consola"
+
+    def preparar(self, parametros: Parametros, directorio: Path) -> None:
+        os.chdir(directorio)
+        helpers.inicializar_archivos()
+        catalogo = generar_servicios(parametros)
+        with open(helpers.SERVICIOS_ARCHIVO, "w", encoding="utf-8") as archivo:
+            for servicio in catalogo:
+                archivo.write(f"{servicio['codigo']};{servicio['nombre']};{servicio['monto']};{servicio['categoria']}\n")
+        cuentas: Dict[str, Dict[str, Any]] = {}
+        por_usuario: Dict[str, Dict[str, Dict[str, str]]] = {}
+        pendientes: List[Tuple[str, Movimiento]] = []
+        # Todas las cuentas comparten la clave: se calcula el hash una vez.
+        hash_clave = seguridad.hash_password(CLAVE)
+        for usuario, saldo, lista_tarjetas, lista in generar_cuentas(parametros, catalogo):
+            cuentas[usuario] = {"clave": hash_clave, "saldo": saldo / 100}
+            por_usuario[usuario] = {tarjeta["alias"]: tarjeta for tarjeta in lista_tarjetas}
+            for movimiento in lista:
+                concepto = concepto_consola(movimiento.tipo, movimiento.concepto)
+                pendientes.append(
+                    (usuario, Movimiento(movimiento.fecha.date(), concepto, movimiento.centavos, movimiento.saldo_centavos))
+                )
+            if len(pendientes) >= 50_000:
+                helpers.agregar_movimientos(pendientes)
+                pendientes = []
+        helpers.agregar_movimientos(pendientes)
+        helpers.guardar_usuarios(cuentas)
+        helpers.guardar_tarjetas(por_usuario)
+        self.codigos = [servicio["codigo"] for servicio in catalogo]
+        self.hoy = datetime.now().strftime("%d/%m/%Y")
+        self.confirmador = transacciones.CommitGrupal(helpers)
+        self.movimientos: Dict[str, List[Movimiento]] = {}
+        self.carga(nombre_usuario(0))
+
+    def cerrar(self) -> None:
+        self.confirmador.cerrar()
+
+    def _mover(self, usuario: str, monto: float, concepto: str) -> None:
+        transacciones.mover_saldo(
+            helpers, self.confirmador, self.usuarios, self.movimientos, usuario, monto, concepto, self.hoy
+        )
+
+    def carga(self, usuario: str) -> None:
+        self.usuarios = helpers.leer_usuarios()
+        self.tarjetas = helpers.leer_tarjetas()
+        self.servicios = helpers.leer_servicios()
+        len(self.servicios)
+
+    def login(self, usuario: str) -> bool:
+        helpers.refrescar_usuario(self.usuarios, usuario)
+        return helpers.clave_correcta(self.usuarios[usuario], CLAVE)
+
+    def deposito(self, usuario: str) -> None:
+        self._mover(usuario, MONTO_OPERACION, "Ingreso de dinero")
+
+    def pago(self, usuario: str, codigo: str) -> None:
+        helpers.obtener_tarjeta(self.tarjetas, usuario, "tarjeta0")
+        servicio = helpers.buscar_servicio(self.servicios, codigo)
+        self._mover(usuario, -MONTO_OPERACION, f"Pago {servicio['nombre']}")
+
+    def ultimos_movimientos(self, usuario: str) -> None:
+        helpers.leer_pagina_movimientos(usuario, 0, POR_PAGINA)
+
+    def tarjeta(self, usuario: str) -> None:
+        helpers.agregar_tarjeta(self.tarjetas, usuario, "nueva", "4111111111111111", "credito", "12/30")
+        helpers.eliminar_tarjeta(self.tarjetas, usuario, "nueva")
+
+    def reporte(self, usuario: str) -> None:
+        lista = []
+        for movimiento in helpers.leer_movimientos_usuario(usuario):
+            tipo, descripcion = tipo_y_descripcion(movimiento.concepto)
+            lista.append(Movimiento(movimiento.fecha, descripcion, movimiento.centavos, movimiento.saldo_centavos, tipo))
+        movimientos.calcular_estadisticas(lista)
+
+
+def apuntar_datos(directorio: Path) -> None:
+    """Point the JSON/CSV modules at *directorio* instead of the repository's folders."""
+    io_archivos.DATA_DIR = directorio / "data"
+    io_archivos.LOG_DIR = directorio / "logs"
+    io_archivos.REPORTS_DIR = directorio / "reports"
+    usuarios.USUARIOS_PATH = io_archivos.ruta_datos("usuarios.json")
+    usuarios.USUARIOS_WAL_PATH = io_archivos.ruta_datos("usuarios.wal")
+    servicios.SERVICIOS_PATH = io_archivos.ruta_datos("servicios.csv")
+    logger.configurar_bitacora()
+    logger.BITACORA = io_archivos.ruta_log("bitacora.log")
+
+
+class EscenarioServicios:
+    """``data/usuarios.json`` and the per-user CSVs, driven the way ``servidor.py`` does."""
+
+    nombre = "servicios"
+
+    def preparar(self, parametros: Parametros, directorio: Path) -> None:
+        apuntar_datos(directorio)
+        catalogo = generar_servicios(parametros)
+        io_archivos.escribir_csv(
+            servicios.SERVICIOS_PATH,
+            servicios.CAMPOS_SERVICIO,
+            ({"id": s["codigo"], "nombre": s["nombre"], "categoria": s["categoria"], "monto": s["monto"]} for s in catalogo),
+        )
+        # Todas las cuentas comparten la clave: se calcula el hash una vez.
+        hash_clave = seguridad.hash_password(CLAVE)
+        cuentas: Dict[str, usuarios.Usuario] = {}
+        for usuario, saldo, lista_tarjetas, lista in generar_cuentas(parametros, catalogo):
+            cuentas[usuario] = usuarios.Usuario(usuario, hash_clave, saldo / 100)
+            filas = [
+                {"id": t["alias"], "tipo": t["tipo"], "entidad": "", "numero": t["numero"], "vencimiento": t["vencimiento"]}
+                for t in lista_tarjetas
+            ]
+            tarjetas.guardar_tarjetas(usuario, filas)
+            movimientos.guardar_movimientos(usuario, lista)
+        usuarios.guardar_usuarios(cuentas)
+        self.codigos = [servicio["codigo"] for servicio in catalogo]
+        self.movimientos: Dict[str, List[Movimiento]] = {}
+        self.carga(nombre_usuario(0))
+
+    def cerrar(self) -> None:
+        logger.vaciar_bitacora()
+
+    def _movimientos_de(self, usuario: str) -> List[Movimiento]:
+        if usuario not in self.movimientos:
+            self.movimientos[usuario] = movimientos.cargar_movimientos(usuario)
+        return self.movimientos[usuario]
+
+    def _aplicar(self, usuario: str, tipo: str, descripcion: str, monto: float) -> None:
+        saldo = self.usuarios[usuario].saldo + monto
+        usuarios.actualizar_saldo(self.usuarios, usuario, saldo)
+        movimientos.registrar_movimiento(usuario, self._movimientos_de(usuario), tipo, descripcion, abs(monto), saldo)
+
+    def carga(self, usuario: str) -> None:
+        self.usuarios = usuarios.cargar_usuarios()
+        self.servicios = servicios.catalogo_servicios()
+        len(self.servicios)
+
+    def login(self, usuario: str) -> bool:
+        return usuarios.autenticar_usuario(self.usuarios, usuario, CLAVE) is not None
+
+    def deposito(self, usuario: str) -> None:
+        self._aplicar(usuario, "Ingreso", "Ingreso de dinero", MONTO_OPERACION)
+
+    def pago(self, usuario: str, codigo: str) -> None:
+        tarjetas.obtener_tarjeta(tarjetas.cargar_tarjetas(usuario), "tarjeta0")
+        servicio = servicios.obtener_servicio(self.servicios, codigo)
+        self._aplicar(usuario, "Pago servicio", servicio["nombre"], -MONTO_OPERACION)
+
+    def ultimos_movimientos(self, usuario: str) -> None:
+        movimientos.cargar_movimientos(usuario)[-POR_PAGINA:]
+
+    def tarjeta(self, usuario: str) -> None:
+        lista = tarjetas.cargar_tarjetas(usuario)
+        tarjetas.agregar_tarjeta(usuario, lista, {"id": "nueva", "tipo": "credito", "numero": "4111111111111111"})
+        tarjetas.eliminar_tarjeta(usuario, lista, "nueva")
+
+    def reporte(self, usuario: str) -> None:
+        movimientos.generar_reporte(usuario, self._movimientos_de(usuario))
+
+
+# ---------------- Medición ----------------
+
+
+def resumir(tiempos: List[float]) -> Dict[str, float]:
+    ordenados = sorted(tiempos)
+    return {
+        "repeticiones": len(ordenados),
+        "media_ms": statistics.fmean(ordenados) * 1000,
+        "mediana_ms": statistics.median(ordenados) * 1000,
+        "p95_ms": ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.95))] * 1000,
+        "min_ms": ordenados[0] * 1000,
+        "max_ms": ordenados[-1] * 1000,
+        "por_segundo": len(ordenados) / sum(ordenados) if sum(ordenados) else 0.0,
+    }
+
+
+def medir(escenario: Any, parametros: Parametros, repeticiones: int, repeticiones_carga: int) -> Dict[str, Any]:
+    """Seed a fresh directory for *escenario* and time every operation."""
+    anterior = os.getcwd()
+    with tempfile.TemporaryDirectory() as directorio:
+        try:
+            inicio = time.perf_counter()
+            escenario.preparar(parametros, Path(directorio))
+            generacion = time.perf_counter() - inicio
+            azar = random.Random(parametros.semilla + 2)
+            elegidos = [nombre_usuario(azar.randrange(parametros.usuarios)) for _ in range(repeticiones)]
+            codigos = [azar.choice(escenario.codigos) for _ in range(repeticiones)] if escenario.codigos else []
+            pasos: Dict[str, Callable[[int], object]] = {
+                "carga": lambda indice: escenario.carga(elegidos[indice]),
+                "login": lambda indice: escenario.login(elegidos[indice]),
+                "deposito": lambda indice: escenario.deposito(elegidos[indice]),
+                "pago": lambda indice: escenario.pago(elegidos[indice], codigos[indice]),
+                "movimientos": lambda indice: escenario.ultimos_movimientos(elegidos[indice]),
+                "tarjeta": lambda indice: escenario.tarjeta(elegidos[indice]),
+                "reporte": lambda indice: escenario.reporte(elegidos[indice]),
+            }
+            resultados: Dict[str, Any] = {"generacion_s": generacion}
+            metricas.reiniciar()
+            for nombre in OPERACIONES:
+                if nombre == "pago" and not codigos:
+                    continue
+                if nombre in ("pago", "tarjeta") and not parametros.tarjetas:
+                    continue
+                tiempos = []
+                for indice in range(repeticiones_carga if nombre == "carga" else repeticiones):
+                    comienzo = time.perf_counter()
+                    pasos[nombre](indice)
+                    tiempos.append(time.perf_counter() - comienzo)
+                resultados[nombre] = resumir(tiempos)
+            escenario.cerrar()
+            # Qué hizo cada operación con los archivos: llamadas, bytes y filas.
+            resultados["metricas"] = metricas.instantanea()
+        finally:
+            os.chdir(anterior)
+    return resultados
+
+
+def comparar(actual: Dict[str, Any], anterior: Dict[str, Any]) -> None:
+    """Print how the median of each operation changed against a previous run."""
+    print("\nComparación de medianas con la corrida anterior:")
+    for escenario, operaciones in actual["resultados"].items():
+        previas = anterior.get("resultados", {}).get(escenario, {})
+        for nombre in OPERACIONES:
+            if nombre not in operaciones or nombre not in previas:
+                continue
+            ahora = operaciones[nombre]["mediana_ms"]
+            antes = previas[nombre]["mediana_ms"]
+            print(f"  {escenario:<10} {nombre:<12} {antes:>10.3f} ms -> {ahora:>10.3f} ms  (x{ahora / antes:.2f})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=1000)
+    parser.add_argument("--movimientos", type=int, default=50, help="movimientos por usuario")
+    parser.add_argument("--tarjetas", type=int, default=2, help="tarjetas por usuario")
+    parser.add_argument("--servicios", type=int, default=200, help="tamaño del catálogo")
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--repeticiones", type=int, default=100, help="veces que se mide cada operación")
+    parser.add_argument("--repeticiones-carga", type=int, default=5)
+    parser.add_argument("--escenarios", nargs="+", choices=["consola", "servicios"], default=["consola", "servicios"])
+    parser.add_argument("--salida", type=Path, help="archivo JSON con los resultados")
+    parser.add_argument("--comparar", type=Path, help="JSON de una corrida anterior")
+    argumentos = parser.parse_args()
+    parametros = Parametros(
+        max(1, argumentos.usuarios),
+        max(0, argumentos.movimientos),
+        max(0, argumentos.tarjetas),
+        max(0, argumentos.servicios),
+        argumentos.semilla,
+    )
+    escenarios = {"consola": EscenarioConsola, "servicios": EscenarioServicios}
+    informe: Dict[str, Any] = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": asdict(parametros),
+        "resultados": {},
+    }
+    for nombre in argumentos.escenarios:
+        repeticiones = max(1, argumentos.repeticiones)
+        resultados = medir(escenarios[nombre](), parametros, repeticiones, max(1, argumentos.repeticiones_carga))
+        informe["resultados"][nombre] = resultados
+        print(f"{nombre} (datos generados en {resultados['generacion_s']:.1f} s)")
+        for operacion in OPERACIONES:
+            if operacion in resultados:
+                datos = resultados[operacion]
+                print(
+                    f"  {operacion:<12} mediana {datos['mediana_ms']:>9.3f} ms | p95 {datos['p95_ms']:>9.3f} ms | "
+                    f"{datos['por_segundo']:>9.0f} op/s"
+                )
+    if argumentos.salida:
+        argumentos.salida.write_text(json.dumps(informe, indent=2, ensure_ascii=False), encoding="utf-8")
+    if argumentos.comparar:
+        comparar(informe, json.loads(argumentos.comparar.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
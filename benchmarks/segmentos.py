@@ -0,0 +1,92 @@
+"""Lectura del historial: diario de texto contra segmento binario.
+
+Genera un ``movimientos.txt`` con ``--usuarios`` cuentas y ``--movimientos``
+movimientos cada una, lo convierte con ``segmentos.importar_txt`` y compara el
+tiempo de leer todo el historial, el de leer la cuenta completa de
+``--consultas`` usuarios al azar y el de pedir la primera página de cada uno.
+
+Uso: python benchmarks/segmentos.py --usuarios 2000 --movimientos 100
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import helpers  # noqa: E402
+import segmentos  # noqa: E402
+
+
+def preparar_diario(usuarios: int, movimientos: int) -> None:
+    """Write a journal with interleaved movements of every user."""
+    azar = random.Random(7)
+    with open(helpers.MOVIMIENTOS_ARCHIVO, "w", encoding="utf-8") as archivo:
+        for indice in range(movimientos):
+            for numero in range(usuarios):
+                monto = azar.randint(100, 50000)
+                concepto = "Ingreso de dinero" if indice % 2 == 0 else "Pago Agua corriente"
+                archivo.write(
+                    f"u{numero};{indice % 28 + 1:02d}/01/2024;{concepto};${monto // 100}.{monto % 100:02d};$1000.00\n"
+                )
+
+
+def cronometrar(funcion: Callable[[], object]) -> float:
+    inicio = time.perf_counter()
+    funcion()
+    return time.perf_counter() - inicio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=2000)
+    parser.add_argument("--movimientos", type=int, default=100, help="movimientos por usuario")
+    parser.add_argument("--consultas", type=int, default=200, help="usuarios consultados al azar")
+    argumentos = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directorio:
+        anterior = os.getcwd()
+        os.chdir(directorio)
+        try:
+            preparar_diario(argumentos.usuarios, argumentos.movimientos)
+            helpers.reconstruir_indice_movimientos()
+            ruta = Path("movimientos.kwm")
+            conversion = cronometrar(lambda: segmentos.importar_txt(Path(helpers.MOVIMIENTOS_ARCHIVO), ruta))
+            elegidos = random.Random(3).sample(
+                [f"u{numero}" for numero in range(argumentos.usuarios)], min(argumentos.consultas, argumentos.usuarios)
+            )
+            with segmentos.SegmentoMovimientos(ruta) as segmento:
+                filas = [
+                    (
+                        "Historial completo",
+                        cronometrar(lambda: sum(1 for _ in helpers.iterar_movimientos())),
+                        cronometrar(lambda: sum(1 for _ in segmento.recorrer())),
+                    ),
+                    (
+                        f"Cuenta completa x{len(elegidos)}",
+                        cronometrar(lambda: [helpers.leer_movimientos_usuario(usuario) for usuario in elegidos]),
+                        cronometrar(lambda: [segmento.movimientos_usuario(usuario) for usuario in elegidos]),
+                    ),
+                    (
+                        f"Primera página x{len(elegidos)}",
+                        cronometrar(lambda: [helpers.leer_pagina_movimientos(usuario, 0, 10) for usuario in elegidos]),
+                        cronometrar(lambda: [segmento.pagina(usuario, 0, 10) for usuario in elegidos]),
+                    ),
+                ]
+            tamanio_txt = os.path.getsize(helpers.MOVIMIENTOS_ARCHIVO)
+            tamanio_segmento = ruta.stat().st_size
+        finally:
+            os.chdir(anterior)
+    total = argumentos.usuarios * argumentos.movimientos
+    print(f"{total} movimientos | txt {tamanio_txt} bytes | segmento {tamanio_segmento} bytes (conversión {conversion:.2f} s)")
+    for nombre, texto, binario in filas:
+        print(f"  {nombre:<24} txt {texto * 1000:>9.1f} ms | segmento {binario * 1000:>9.1f} ms  (x{texto / binario:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Bloqueos entre procesos para los archivos de la billetera.
+
+Se usan ``fcntl.flock`` sobre archivos vacíos dentro de ``DIRECTORIO_BLOQUEOS``.
+Los usuarios se reparten en ``CANTIDAD_FRAGMENTOS`` fragmentos, de modo que dos
+terminales que operan sobre cuentas distintas casi nunca se esperan entre sí.
+Como ``flock`` se aplica a cada apertura del archivo, los bloqueos también
+excluyen a los hilos de un mismo proceso. En sistemas sin ``fcntl`` los
+bloqueos no hacen nada.
+"""
+from __future__ import annotations
+
+import os
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+DIRECTORIO_BLOQUEOS = "bloqueos"
+CANTIDAD_FRAGMENTOS = 64
+
+
+def fragmento_usuario(usuario: str) -> int:
+    """Return the lock shard assigned to *usuario*."""
+    return zlib.crc32(usuario.encode("utf-8")) % CANTIDAD_FRAGMENTOS
+
+
+@contextmanager
+def bloquear(
+    nombre: str, exclusivo: bool = True, esperar: bool = True, directorio: str = DIRECTORIO_BLOQUEOS
+) -> Iterator[bool]:
+    """Hold the lock *nombre*; yield ``False`` if ``esperar`` is off and it was busy.
+
+    The lock file lives in *directorio* (``DIRECTORIO_BLOQUEOS``, relative to
+    the working directory, unless a file elsewhere needs its own).
+    """
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, f"{nombre}.lock"), "a") as archivo:
+        modo = fcntl.LOCK_EX if exclusivo else fcntl.LOCK_SH
+        if not esperar:
+            modo |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(archivo.fileno(), modo)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def bloquear_usuario(usuario: str) -> Iterator[None]:
+    """Hold the exclusive lock of the shard that contains *usuario*."""
+    with bloquear(f"usuarios_{fragmento_usuario(usuario):02d}"):
+        yield
+
+
+@contextmanager
+def bloquear_usuarios(usuarios: Iterable[str]) -> Iterator[None]:
+    """Hold the shard locks of every user in *usuarios*, always taken in the same order."""
+    with ExitStack() as pila:
+        for fragmento in sorted({fragmento_usuario(usuario) for usuario in usuarios}):
+            pila.enter_context(bloquear(f"usuarios_{fragmento:02d}"))
+        yield
@@ -0,0 +1,159 @@
+"""Catálogo de servicios indexado que se recarga cuando cambia su archivo.
+
+:class:`CatalogoServicios` envuelve cualquiera de los dos catálogos de la
+billetera (``servicios.txt`` de la consola o ``data/servicios.csv`` de los
+servicios) y arma, al leerlo, un índice por código, uno por categoría y la
+lista ordenada de nombres normalizados (sin mayúsculas ni acentos). Buscar
+por código es una consulta a un diccionario y buscar por nombre es una
+bisección para los prefijos más un ``str.find`` sobre todos los nombres
+unidos para los que solo contienen el texto.
+
+Antes de cada consulta se compara la fecha de modificación y el tamaño del
+archivo con los de la última lectura; si cambiaron, se vuelve a leer. Así un
+operador puede editar el catálogo sin reiniciar la consola ni el servidor.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import unicodedata
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import metricas
+
+Servicio = Dict[str, str]
+LIMITE_BUSQUEDA = 20
+
+
+def normalizar(texto: str) -> str:
+    """Lowercase *texto* and drop accents so ``Telefonía`` matches ``telefonia``."""
+    descompuesto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(caracter for caracter in descompuesto if not unicodedata.combining(caracter))
+
+
+def _firma(ruta: Path) -> Optional[Tuple[int, int]]:
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+class _Indices:
+    """Immutable lookup tables built from one reading of the catalog."""
+
+    def __init__(self, servicios: List[Servicio], clave: str) -> None:
+        self.servicios = servicios
+        self.por_clave: Dict[str, Servicio] = {}
+        self.por_categoria: Dict[str, List[Servicio]] = {}
+        self.categorias = [normalizar(servicio.get("categoria", "")) for servicio in servicios]
+        for servicio, categoria in zip(servicios, self.categorias):
+            # Ante códigos repetidos vale el primero, como en la búsqueda lineal.
+            self.por_clave.setdefault(servicio.get(clave, ""), servicio)
+            self.por_categoria.setdefault(categoria, []).append(servicio)
+        self.nombres = [normalizar(servicio.get("nombre", "")) for servicio in servicios]
+        self.ordenados = sorted((nombre, posicion) for posicion, nombre in enumerate(self.nombres))
+        # Todos los nombres en un solo texto: buscar una subcadena es un
+        # str.find por coincidencia en lugar de una comparación por servicio.
+        self.texto = "\n".join(self.nombres)
+        self.inicios: List[int] = []
+        inicio = 0
+        for nombre in self.nombres:
+            self.inicios.append(inicio)
+            inicio += len(nombre) + 1
+
+
+class CatalogoServicios:
+    """Service catalog with O(1) lookups that reloads when its file changes.
+
+    *leer* receives the path and returns the list of services (dicts);
+    *clave* is the field used as code (``codigo`` in ``servicios.txt``,
+    ``id`` in ``servicios.csv``). Iterating yields the services in file order.
+    """
+
+    def __init__(self, ruta: Path, leer: Callable[[Path], List[Servicio]], clave: str = "codigo") -> None:
+        self.ruta = Path(ruta)
+        self.clave = clave
+        self.recargas = 0
+        self._leer = leer
+        self._firma: Optional[Tuple[int, int]] = None
+        self._indices = _Indices([], clave)
+        self._bloqueo = threading.Lock()
+
+    def _actuales(self) -> _Indices:
+        firma = _firma(self.ruta)
+        if firma != self._firma:
+            with self._bloqueo:
+                if firma != self._firma:
+                    with metricas.medir("catalogo.recargar") as medicion:
+                        servicios = self._leer(self.ruta) if firma is not None else []
+                        # Se reemplaza el juego de índices completo: quien ya tenía
+                        # el anterior termina su consulta con datos coherentes.
+                        self._indices = _Indices(servicios, self.clave)
+                        medicion.filas = len(servicios)
+                        medicion.bytes = firma[1] if firma is not None else 0
+                    self._firma = firma
+                    self.recargas += 1
+        return self._indices
+
+    def __len__(self) -> int:
+        return len(self._actuales().servicios)
+
+    def __iter__(self) -> Iterator[Servicio]:
+        return iter(self._actuales().servicios)
+
+    def todos(self) -> List[Servicio]:
+        return list(self._actuales().servicios)
+
+    def obtener(self, codigo: str) -> Optional[Servicio]:
+        """Return the service whose code is *codigo*, or ``None``."""
+        return self._actuales().por_clave.get(codigo)
+
+    def categorias(self) -> List[str]:
+        """Return the category names as written in the file, in order of first appearance."""
+        return [lista[0].get("categoria", "") for lista in self._actuales().por_categoria.values()]
+
+    def por_categoria(self, categoria: str) -> List[Servicio]:
+        """Return the services of *categoria* (case and accents are ignored)."""
+        return list(self._actuales().por_categoria.get(normalizar(categoria), []))
+
+    @metricas.instrumentar("catalogo.buscar")
+    def buscar(self, texto: str, limite: int = LIMITE_BUSQUEDA, categoria: Optional[str] = None) -> List[Servicio]:
+        """Return up to *limite* services whose name contains *texto*.
+
+        Names that start with *texto* come first (alphabetically), then the
+        rest in catalog order. An empty *texto* matches every service.
+        """
+        indices = self._actuales()
+        buscado = normalizar(texto.strip())
+        filtro = normalizar(categoria) if categoria is not None else None
+        elegidos: List[int] = []
+        vistos = set()
+
+        def aceptar(posicion: int) -> bool:
+            if posicion in vistos:
+                return False
+            if filtro is not None and indices.categorias[posicion] != filtro:
+                return False
+            vistos.add(posicion)
+            elegidos.append(posicion)
+            return len(elegidos) >= limite
+
+        ordenados = indices.ordenados
+        for indice in range(bisect_left(ordenados, (buscado, -1)), len(ordenados)):
+            nombre, posicion = ordenados[indice]
+            if not nombre.startswith(buscado) or aceptar(posicion):
+                break
+        desde = 0
+        while len(elegidos) < limite and "\n" not in buscado:
+            encontrado = indices.texto.find(buscado, desde)
+            if encontrado < 0:
+                break
+            posicion = bisect_right(indices.inicios, encontrado) - 1
+            if aceptar(posicion):
+                break
+            # Se sigue desde el nombre siguiente: cada servicio aparece una vez.
+            desde = indices.inicios[posicion] + len(indices.nombres[posicion]) + 1
+        return [indices.servicios[posicion] for posicion in elegidos]
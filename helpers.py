@@ -1,14 +1,43 @@
 """Funciones de apoyo para el programa de la billetera."""
 
+import bisect
+import datetime
+import itertools
+import math
 import os
+import time
+import zlib
+
+import bloqueos
+import catalogo
+import metricas
+import registros
+import seguridad
 
 USUARIOS_ARCHIVO = "usuarios.txt"
+USUARIOS_WAL = "usuarios.wal"
 TARJETAS_ARCHIVO = "tarjetas.txt"
+TARJETAS_WAL = "tarjetas.wal"
 MOVIMIENTOS_ARCHIVO = "movimientos.txt"
+MOVIMIENTOS_INDICE = "movimientos_idx"
 SERVICIOS_ARCHIVO = "servicios.txt"
 
+# Si es True cada movimiento se fuerza a disco con fsync (más lento, más seguro).
+SINCRONIZAR_MOVIMIENTOS = False
+# Tamaño (en bytes) del WAL de usuarios a partir del cual se toma una nueva instantánea.
+USUARIOS_WAL_MAXIMO = 256 * 1024
+# Lo mismo para el WAL de tarjetas.
+TARJETAS_WAL_MAXIMO = 256 * 1024
+
 # ---------------- Archivos ----------------
 
+# Cada lectura y escritura se registra en metricas (llamadas, tiempo, bytes y
+# filas); python main.py --profile muestra el resumen al salir.
+
+def _tamanio(ruta):
+    return os.path.getsize(ruta) if os.path.exists(ruta) else 0
+
+
 def inicializar_archivos():
     if not os.path.exists(USUARIOS_ARCHIVO):
         open(USUARIOS_ARCHIVO, "w", encoding="utf-8").close()
@@ -25,103 +54,350 @@ def inicializar_archivos():
 
 # ---------------- Usuarios ----------------
 
-def leer_usuarios():
-    usuarios = {}
-    if not os.path.exists(USUARIOS_ARCHIVO):
-        return usuarios
-    with open(USUARIOS_ARCHIVO, "r", encoding="utf-8") as archivo:
+# usuarios.txt es la última instantánea completa y usuarios.wal registra, en
+# el mismo formato, cada usuario modificado después de ella. Al leer se aplica
+# la instantánea y luego el WAL, de modo que la última línea de cada usuario gana.
+
+def _parsear_usuario(linea):
+    linea = linea.strip()
+    if not linea:
+        return None
+    partes = linea.split(";")
+    if len(partes) < 3:
+        return None
+    try:
+        saldo = float(partes[2])
+    except ValueError:
+        saldo = 0.0
+    return partes[0], {"clave": partes[1], "saldo": saldo}
+
+
+def _linea_usuario(nombre, datos):
+    return f"{nombre};{datos['clave']};{datos['saldo']}\n"
+
+
+def iterar_usuarios(ruta, solo_completas=False):
+    # Recorre un archivo con el formato de usuarios.txt (o su WAL) devolviendo
+    # pares (nombre, datos) en orden. Con solo_completas se detiene en una
+    # última línea sin salto, que en el WAL es una escritura a medias.
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, "r", encoding="utf-8") as archivo:
         for linea in archivo:
-            linea = linea.strip()
-            if not linea:
-                continue
-            partes = linea.split(";")
-            if len(partes) < 3:
-                continue
-            nombre = partes[0]
-            clave = partes[1]
-            try:
-                saldo = float(partes[2])
-            except ValueError:
-                saldo = 0.0
-            usuarios[nombre] = {"clave": clave, "saldo": saldo}
+            if solo_completas and not linea.endswith("\n"):
+                break
+            registro = _parsear_usuario(linea)
+            if registro is not None:
+                yield registro
+
+
+def clave_correcta(datos, clave):
+    # La clave se guarda como hash (seguridad.hash_password); las cuentas
+    # anteriores pueden tenerla todavía en texto plano hasta su próximo login.
+    guardada = datos.get("clave", "")
+    if seguridad.parece_hash(guardada):
+        return seguridad.verificar_password(clave, guardada)
+    return guardada == clave
+
+
+# Qué instantánea y hasta qué byte del WAL leyó este proceso, para que
+# refrescar_usuario solo tenga que leer lo que otros procesos agregaron después.
+_lectura_usuarios = {"firma": None, "posicion": 0}
+
+
+def _firma(ruta):
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return estado.st_ino, estado.st_mtime_ns
+
+
+def _aplicar_wal(usuarios, desde):
+    if not os.path.exists(USUARIOS_WAL):
+        return 0
+    posicion = desde
+    with open(USUARIOS_WAL, "rb") as archivo:
+        archivo.seek(desde)
+        for linea in archivo:
+            if not linea.endswith(b"\n"):
+                break
+            registro = _parsear_usuario(linea.decode("utf-8", "replace"))
+            if registro is not None:
+                nombre, datos = registro
+                usuarios[nombre] = datos
+            posicion += len(linea)
+    return posicion
+
+
+def _cargar_usuarios(usuarios):
+    with metricas.medir("helpers.leer_usuarios") as medicion:
+        usuarios.clear()
+        for nombre, datos in iterar_usuarios(USUARIOS_ARCHIVO):
+            usuarios[nombre] = datos
+        _lectura_usuarios["firma"] = _firma(USUARIOS_ARCHIVO)
+        _lectura_usuarios["posicion"] = _aplicar_wal(usuarios, 0)
+        medicion.filas = len(usuarios)
+        medicion.bytes = _tamanio(USUARIOS_ARCHIVO) + _lectura_usuarios["posicion"]
     return usuarios
 
 
+def leer_usuarios():
+    with bloqueos.bloquear("usuarios", exclusivo=False):
+        return _cargar_usuarios({})
+
+
+def refrescar_usuario(usuarios, nombre):
+    # Incorpora lo que otros procesos escribieron desde la última lectura. Se
+    # llama con el bloqueo del usuario tomado, antes de modificarlo, para que
+    # el cambio se haga sobre el dato más reciente y no sobre uno viejo.
+    with metricas.medir("helpers.refrescar_usuario"), bloqueos.bloquear("usuarios", exclusivo=False):
+        posicion = _lectura_usuarios["posicion"]
+        tamanio = os.path.getsize(USUARIOS_WAL) if os.path.exists(USUARIOS_WAL) else 0
+        if _firma(USUARIOS_ARCHIVO) != _lectura_usuarios["firma"] or tamanio < posicion:
+            _cargar_usuarios(usuarios)
+        else:
+            _lectura_usuarios["posicion"] = _aplicar_wal(usuarios, posicion)
+
+
+def _escribir_instantanea(usuarios):
+    with metricas.medir("helpers.guardar_usuarios") as medicion:
+        temporal = USUARIOS_ARCHIVO + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            for nombre, datos in usuarios.items():
+                archivo.write(_linea_usuario(nombre, datos))
+            medicion.bytes = archivo.tell()
+        os.replace(temporal, USUARIOS_ARCHIVO)
+        open(USUARIOS_WAL, "w", encoding="utf-8").close()
+        medicion.filas = len(usuarios)
+
+
 def guardar_usuarios(usuarios):
-    with open(USUARIOS_ARCHIVO, "w", encoding="utf-8") as archivo:
-        for nombre, datos in usuarios.items():
-            linea = f"{nombre};{datos['clave']};{datos['saldo']}\n"
-            archivo.write(linea)
+    # Toma una instantánea completa y vacía el WAL.
+    with bloqueos.bloquear("usuarios"):
+        _escribir_instantanea(usuarios)
+
+
+def guardar_usuario(usuarios, nombre):
+    agregar_usuarios([(nombre, usuarios[nombre])])
+
+
+def agregar_usuarios(registros, sincronizar=False):
+    # Agrega al WAL una lista de (nombre, datos) con una sola escritura.
+    with metricas.medir("helpers.agregar_usuarios") as medicion, bloqueos.bloquear("usuarios", exclusivo=False):
+        texto = "".join(_linea_usuario(nombre, datos) for nombre, datos in registros)
+        with open(USUARIOS_WAL, "a", encoding="utf-8") as archivo:
+            archivo.write(texto)
+            if sincronizar:
+                archivo.flush()
+                os.fsync(archivo.fileno())
+        medicion.bytes = len(texto)
+        medicion.filas = len(registros)
+    if os.path.getsize(USUARIOS_WAL) > USUARIOS_WAL_MAXIMO:
+        compactar_usuarios()
+
+
+def compactar_usuarios():
+    # La instantánea se arma desde disco para no pisar cambios ajenos. Si otro
+    # proceso está usando el WAL se deja para la próxima escritura.
+    with bloqueos.bloquear("usuarios", esperar=False) as obtenido:
+        if not obtenido:
+            return None
+        usuarios = _cargar_usuarios({})
+        _escribir_instantanea(usuarios)
+        return usuarios
 
 
 # ---------------- Tarjetas ----------------
 
-def leer_tarjetas():
-    tarjetas = {}
-    if not os.path.exists(TARJETAS_ARCHIVO):
-        return tarjetas
-    with open(TARJETAS_ARCHIVO, "r", encoding="utf-8") as archivo:
+# Las tarjetas se guardan como los usuarios: tarjetas.txt es la última
+# instantánea (usuario;alias;numero;tipo;vencimiento) y tarjetas.wal registra
+# cada alta ("alta;usuario;alias;numero;tipo;vencimiento") o baja
+# ("baja;usuario;alias") posterior. En memoria quedan indexadas por usuario y
+# alias, así que una alta o una baja agrega una línea al WAL sin reescribir
+# las tarjetas de los demás.
+
+_lectura_tarjetas = {"firma": None, "posicion": 0}
+
+
+def _tarjeta(alias, numero, tipo, vencimiento):
+    return {"alias": alias, "numero": numero, "tipo": tipo, "vencimiento": vencimiento}
+
+
+def _aplicar_cambio_tarjeta(tarjetas, partes):
+    if partes[0] == "alta" and len(partes) >= 6:
+        tarjetas.setdefault(partes[1], {})[partes[2]] = _tarjeta(*partes[2:6])
+    elif partes[0] == "baja" and len(partes) >= 3:
+        tarjetas.get(partes[1], {}).pop(partes[2], None)
+
+
+def _aplicar_wal_tarjetas(tarjetas, desde, ruta=TARJETAS_WAL):
+    if not os.path.exists(ruta):
+        return 0
+    posicion = desde
+    with open(ruta, "rb") as archivo:
+        archivo.seek(desde)
         for linea in archivo:
-            linea = linea.strip()
-            if not linea:
-                continue
-            partes = linea.split(";")
+            if not linea.endswith(b"\n"):
+                break
+            _aplicar_cambio_tarjeta(tarjetas, linea.decode("utf-8", "replace").strip().split(";"))
+            posicion += len(linea)
+    return posicion
+
+
+def _aplicar_instantanea_tarjetas(tarjetas, ruta):
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, "r", encoding="utf-8") as archivo:
+        for linea in archivo:
+            partes = linea.strip().split(";")
             if len(partes) < 5:
                 continue
             usuario, alias, numero, tipo, vencimiento = partes[:5]
-            tarjetas.setdefault(usuario, []).append(
-                {
-                    "alias": alias,
-                    "numero": numero,
-                    "tipo": tipo,
-                    "vencimiento": vencimiento,
-                }
-            )
+            tarjetas.setdefault(usuario, {})[alias] = _tarjeta(alias, numero, tipo, vencimiento)
+
+
+def _cargar_tarjetas(tarjetas):
+    with metricas.medir("helpers.leer_tarjetas") as medicion:
+        tarjetas.clear()
+        _aplicar_instantanea_tarjetas(tarjetas, TARJETAS_ARCHIVO)
+        _lectura_tarjetas["firma"] = _firma(TARJETAS_ARCHIVO)
+        _lectura_tarjetas["posicion"] = _aplicar_wal_tarjetas(tarjetas, 0)
+        medicion.filas = sum(len(por_alias) for por_alias in tarjetas.values())
+        medicion.bytes = _tamanio(TARJETAS_ARCHIVO) + _lectura_tarjetas["posicion"]
     return tarjetas
 
 
+def leer_tarjetas():
+    # Devuelve {usuario: {alias: tarjeta}}.
+    with bloqueos.bloquear("tarjetas", exclusivo=False):
+        return _cargar_tarjetas({})
+
+
+def leer_tarjetas_de(archivo, wal):
+    # Como leer_tarjetas pero desde otra instantánea y otro WAL, sin tomar
+    # bloqueos ni tocar el estado de lectura de este proceso (migracion.py).
+    tarjetas = {}
+    _aplicar_instantanea_tarjetas(tarjetas, archivo)
+    _aplicar_wal_tarjetas(tarjetas, 0, wal)
+    return tarjetas
+
+
+def refrescar_tarjetas(tarjetas):
+    # Incorpora solo lo que otros procesos agregaron al WAL desde la última
+    # lectura; si mientras tanto se tomó una instantánea nueva, relee todo.
+    with metricas.medir("helpers.refrescar_tarjetas"), bloqueos.bloquear("tarjetas", exclusivo=False):
+        posicion = _lectura_tarjetas["posicion"]
+        tamanio = os.path.getsize(TARJETAS_WAL) if os.path.exists(TARJETAS_WAL) else 0
+        if _firma(TARJETAS_ARCHIVO) != _lectura_tarjetas["firma"] or tamanio < posicion:
+            _cargar_tarjetas(tarjetas)
+        else:
+            _lectura_tarjetas["posicion"] = _aplicar_wal_tarjetas(tarjetas, posicion)
+
+
+def refrescar_tarjetas_usuario(tarjetas, usuario):
+    # Misma interfaz que RepositorioSQLite.refrescar_tarjetas_usuario. El WAL
+    # trae los cambios de todas las cuentas juntos, así que se incorporan todos;
+    # después de la primera lectura cada llamada solo lee lo nuevo.
+    refrescar_tarjetas(tarjetas)
+
+
+def _escribir_instantanea_tarjetas(tarjetas):
+    with metricas.medir("helpers.guardar_tarjetas") as medicion:
+        temporal = TARJETAS_ARCHIVO + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            for usuario, por_alias in tarjetas.items():
+                for tarjeta in por_alias.values():
+                    archivo.write(
+                        "{};{};{};{};{}\n".format(
+                            usuario,
+                            tarjeta.get("alias", ""),
+                            tarjeta.get("numero", ""),
+                            tarjeta.get("tipo", ""),
+                            tarjeta.get("vencimiento", ""),
+                        )
+                    )
+                    medicion.filas += 1
+            medicion.bytes = archivo.tell()
+        os.replace(temporal, TARJETAS_ARCHIVO)
+        open(TARJETAS_WAL, "w", encoding="utf-8").close()
+
+
 def guardar_tarjetas(tarjetas):
-    with open(TARJETAS_ARCHIVO, "w", encoding="utf-8") as archivo:
-        for usuario, lista in tarjetas.items():
-            for tarjeta in lista:
-                linea = "{};{};{};{};{}\n".format(
-                    usuario,
-                    tarjeta.get("alias", ""),
-                    tarjeta.get("numero", ""),
-                    tarjeta.get("tipo", ""),
-                    tarjeta.get("vencimiento", ""),
-                )
-                archivo.write(linea)
+    # Toma una instantánea completa y vacía el WAL.
+    with bloqueos.bloquear("tarjetas"):
+        _escribir_instantanea_tarjetas(tarjetas)
+
+
+def linea_alta_tarjeta(usuario, tarjeta):
+    return "alta;{};{};{};{};{}\n".format(
+        usuario,
+        tarjeta.get("alias", ""),
+        tarjeta.get("numero", ""),
+        tarjeta.get("tipo", ""),
+        tarjeta.get("vencimiento", ""),
+    )
+
+
+def linea_baja_tarjeta(usuario, alias):
+    return f"baja;{usuario};{alias}\n"
+
+
+def agregar_cambios_tarjetas(lineas):
+    # Agrega al WAL las líneas de alta y baja con una sola escritura. Quien
+    # llama debe tener tomados los bloqueos de esos usuarios.
+    if not lineas:
+        return
+    with metricas.medir("helpers.agregar_cambios_tarjetas") as medicion, bloqueos.bloquear("tarjetas", exclusivo=False):
+        texto = "".join(lineas)
+        with open(TARJETAS_WAL, "a", encoding="utf-8") as archivo:
+            archivo.write(texto)
+        medicion.bytes = len(texto)
+        medicion.filas = len(lineas)
+    if os.path.getsize(TARJETAS_WAL) > TARJETAS_WAL_MAXIMO:
+        compactar_tarjetas()
+
+
+def compactar_tarjetas():
+    with bloqueos.bloquear("tarjetas", esperar=False) as obtenido:
+        if not obtenido:
+            return None
+        tarjetas = _cargar_tarjetas({})
+        _escribir_instantanea_tarjetas(tarjetas)
+        return tarjetas
 
 
 def obtener_tarjetas_usuario(tarjetas, usuario):
-    return tarjetas.get(usuario, [])
+    return list(tarjetas.get(usuario, {}).values())
 
 
+def obtener_tarjeta(tarjetas, usuario, alias):
+    return tarjetas.get(usuario, {}).get(alias)
+
+
+# Las altas y bajas toman el bloqueo del usuario y primero incorporan lo que
+# otros procesos registraron, para no duplicar un alias ni borrar uno viejo.
+
 def agregar_tarjeta(tarjetas, usuario, alias, numero, tipo, vencimiento):
-    lista = tarjetas.setdefault(usuario, [])
-    for tarjeta in lista:
-        if tarjeta.get("alias") == alias:
+    with bloqueos.bloquear_usuario(usuario):
+        refrescar_tarjetas(tarjetas)
+        por_alias = tarjetas.setdefault(usuario, {})
+        if alias in por_alias:
             return False
-    lista.append(
-        {
-            "alias": alias,
-            "numero": numero,
-            "tipo": tipo,
-            "vencimiento": vencimiento,
-        }
-    )
-    guardar_tarjetas(tarjetas)
+        tarjeta = _tarjeta(alias, numero, tipo, vencimiento)
+        agregar_cambios_tarjetas([linea_alta_tarjeta(usuario, tarjeta)])
+        por_alias[alias] = tarjeta
     return True
 
 
 def eliminar_tarjeta(tarjetas, usuario, alias):
-    lista = tarjetas.get(usuario, [])
-    nueva_lista = [tarjeta for tarjeta in lista if tarjeta.get("alias") != alias]
-    if len(nueva_lista) == len(lista):
-        return False
-    tarjetas[usuario] = nueva_lista
-    guardar_tarjetas(tarjetas)
+    with bloqueos.bloquear_usuario(usuario):
+        refrescar_tarjetas(tarjetas)
+        por_alias = tarjetas.get(usuario, {})
+        if alias not in por_alias:
+            return False
+        agregar_cambios_tarjetas([linea_baja_tarjeta(usuario, alias)])
+        del por_alias[alias]
     return True
 
 
@@ -134,89 +410,527 @@ def mascara_tarjeta(numero):
 
 # ---------------- Movimientos ----------------
 
+# En memoria cada movimiento es un registros.Movimiento (fecha interpretada y
+# montos en centavos); el texto "$123.45" solo se arma al escribir la línea.
+
+def _partes_movimiento(linea):
+    linea = linea.strip()
+    if not linea:
+        return None
+    partes = linea.split(";")
+    if len(partes) < 5:
+        return None
+    return partes
+
+
+def _parsear_movimiento(linea):
+    partes = _partes_movimiento(linea)
+    if partes is None:
+        return None
+    usuario, fecha, concepto, monto, saldo = partes[:5]
+    return usuario, registros.desde_texto(fecha, concepto, monto, saldo)
+
+
+def iterar_movimientos(ruta=None):
+    # Recorre el diario (u otro archivo con el mismo formato) devolviendo
+    # pares (usuario, movimiento) sin cargarlo entero en memoria.
+    ruta = ruta or MOVIMIENTOS_ARCHIVO
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, "r", encoding="utf-8") as archivo:
+        for linea in archivo:
+            registro = _parsear_movimiento(linea)
+            if registro is not None:
+                yield registro
+
+
 def leer_movimientos():
     movimientos = {}
-    if not os.path.exists(MOVIMIENTOS_ARCHIVO):
-        return movimientos
-    with open(MOVIMIENTOS_ARCHIVO, "r", encoding="utf-8") as archivo:
-        for linea in archivo:
-            linea = linea.strip()
-            if not linea:
-                continue
-            partes = linea.split(";")
-            if len(partes) < 5:
-                continue
-            usuario, fecha, concepto, monto, saldo = partes[:5]
-            movimientos.setdefault(usuario, []).append(
-                {
-                    "fecha": fecha,
-                    "concepto": concepto,
-                    "monto": monto,
-                    "saldo": saldo,
-                }
-            )
+    with metricas.medir("helpers.leer_movimientos") as medicion:
+        for usuario, movimiento in iterar_movimientos():
+            movimientos.setdefault(usuario, []).append(movimiento)
+            medicion.filas += 1
+        medicion.bytes = _tamanio(MOVIMIENTOS_ARCHIVO)
     return movimientos
 
 
+def leer_movimientos_usuario(usuario):
+    # Usa el índice para leer solo las líneas del usuario, sin recorrer
+    # el historial del resto de la billetera.
+    lista = []
+    if not os.path.exists(MOVIMIENTOS_ARCHIVO):
+        return lista
+    _preparar_lectura()
+    with metricas.medir("helpers.leer_movimientos_usuario") as medicion, bloqueos.bloquear("diario", exclusivo=False):
+        with open(MOVIMIENTOS_ARCHIVO, "rb") as archivo:
+            for inicio, longitud in _leer_rangos(usuario):
+                archivo.seek(inicio)
+                registro = _parsear_movimiento(archivo.read(longitud).decode("utf-8", "replace"))
+                # Un rango que no es del usuario delata un índice viejo: se descarta.
+                if registro is not None and registro[0] == usuario:
+                    lista.append(registro[1])
+                medicion.bytes += longitud
+        medicion.filas = len(lista)
+    return lista
+
+
+def leer_pagina_movimientos(usuario, pagina, por_pagina):
+    # Devuelve los movimientos de la página pedida (0 es la más reciente),
+    # del más nuevo al más viejo, y si hay una página siguiente. El índice se
+    # lee desde el final, así que el costo no depende del largo del historial.
+    if not os.path.exists(MOVIMIENTOS_ARCHIVO):
+        return [], False
+    _preparar_lectura()
+    ruta = _ruta_indice(usuario)
+    lista = []
+    with metricas.medir("helpers.leer_pagina_movimientos") as medicion, bloqueos.bloquear("diario", exclusivo=False):
+        if not os.path.exists(ruta):
+            return [], False
+        desde = pagina * por_pagina
+        lineas = list(itertools.islice(_lineas_invertidas(ruta), desde, desde + por_pagina + 1))
+        with open(MOVIMIENTOS_ARCHIVO, "rb") as archivo:
+            for linea in lineas[:por_pagina]:
+                rango = _parsear_rango(linea)
+                if rango is None:
+                    continue
+                archivo.seek(rango[0])
+                registro = _parsear_movimiento(archivo.read(rango[1]).decode("utf-8", "replace"))
+                if registro is not None and registro[0] == usuario:
+                    lista.append(registro[1])
+                medicion.bytes += rango[1]
+        medicion.filas = len(lista)
+    return lista, len(lineas) > por_pagina
+
+
+def linea_movimiento(usuario, movimiento):
+    return "{};{};{};{};{}\n".format(
+        usuario,
+        registros.fecha_texto(movimiento.fecha),
+        movimiento.concepto,
+        registros.formatear_centavos(movimiento.centavos),
+        registros.formatear_centavos(movimiento.saldo_centavos),
+    )
+
+
+def _escribir_movimientos(movimientos):
+    with metricas.medir("helpers.guardar_movimientos") as medicion:
+        temporal = MOVIMIENTOS_ARCHIVO + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            for usuario, lista in movimientos.items():
+                for movimiento in lista:
+                    archivo.write(linea_movimiento(usuario, movimiento))
+                medicion.filas += len(lista)
+            medicion.bytes = archivo.tell()
+        os.replace(temporal, MOVIMIENTOS_ARCHIVO)
+    _reconstruir_indice()
+
+
 def guardar_movimientos(movimientos):
-    with open(MOVIMIENTOS_ARCHIVO, "w", encoding="utf-8") as archivo:
-        for usuario, lista in movimientos.items():
-            for movimiento in lista:
-                linea = "{};{};{};{};{}\n".format(
-                    usuario,
-                    movimiento.get("fecha", ""),
-                    movimiento.get("concepto", ""),
-                    movimiento.get("monto", ""),
-                    movimiento.get("saldo", ""),
-                )
-                archivo.write(linea)
+    with bloqueos.bloquear("diario"):
+        _escribir_movimientos(movimientos)
+
+
+def reemplazar_movimientos(ruta):
+    # Pone el archivo ya escrito en ruta (con el formato del diario) en lugar
+    # del diario y reconstruye el índice.
+    with bloqueos.bloquear("diario"):
+        os.replace(ruta, MOVIMIENTOS_ARCHIVO)
+        _reconstruir_indice()
 
 
 def registrar_movimiento(movimientos, usuario, fecha, concepto, monto, saldo):
-    movimientos.setdefault(usuario, []).append(
-        {
-            "fecha": fecha,
-            "concepto": concepto,
-            "monto": monto,
-            "saldo": saldo,
-        }
-    )
-    guardar_movimientos(movimientos)
+    movimiento = registros.desde_texto(fecha, concepto, monto, saldo)
+    movimientos.setdefault(usuario, []).append(movimiento)
+    agregar_movimientos([(usuario, movimiento)])
+
+
+def agregar_movimientos(nuevos, sincronizar=False):
+    # Agrega al diario una lista de (usuario, movimiento) con una sola escritura.
+    if not nuevos:
+        return
+    datos = bytearray()
+    rangos = {}
+    for usuario, movimiento in nuevos:
+        linea = linea_movimiento(usuario, movimiento).encode("utf-8")
+        rangos.setdefault(usuario, []).append((len(datos), len(linea), registros.marca_tiempo(movimiento.fecha)))
+        datos += linea
+    # El archivo funciona como un diario: solo se agregan las líneas nuevas.
+    # El bloqueo mantiene el diario y su índice alineados entre procesos.
+    with metricas.medir("helpers.agregar_movimientos") as medicion, bloqueos.bloquear("diario"):
+        medicion.bytes = len(datos)
+        medicion.filas = len(nuevos)
+        _asegurar_indice()
+        with open(MOVIMIENTOS_ARCHIVO, "ab") as archivo:
+            archivo.write(datos)
+            archivo.flush()
+            if sincronizar or SINCRONIZAR_MOVIMIENTOS:
+                os.fsync(archivo.fileno())
+            fin = archivo.tell()
+        base = fin - len(datos)
+        for usuario, lista in rangos.items():
+            _agregar_rangos(usuario, [(base + inicio, longitud, marca) for inicio, longitud, marca in lista])
+        _guardar_fin_indice(fin)
+
+
+def aplicar_operaciones(operaciones):
+    # Cada operación es (usuario, datos_usuario, movimiento): el saldo nuevo y
+    # el movimiento que lo explica. Todo el grupo se escribe junto, primero los
+    # movimientos y después el WAL, con un único fsync por archivo.
+    agregar_movimientos([(usuario, movimiento) for usuario, _, movimiento in operaciones], sincronizar=True)
+    agregar_usuarios([(usuario, datos) for usuario, datos, _ in operaciones], sincronizar=True)
+
+
+def compactar_movimientos():
+    # Reescribe el diario completo agrupando las líneas por usuario y
+    # descartando las que estén mal formadas.
+    with bloqueos.bloquear("diario"):
+        movimientos = leer_movimientos()
+        _escribir_movimientos(movimientos)
+    return movimientos
+
+
+# ---------------- Índice de movimientos ----------------
+# Por cada usuario se guarda MOVIMIENTOS_INDICE/<usuario>.idx con una línea
+# "inicio;longitud;marca" por cada movimiento suyo dentro del diario: la
+# posición y el largo en bytes y la fecha en segundos desde 1970
+# (registros.marca_tiempo). Los índices anteriores no tienen la marca.
+# El archivo "fin" indica hasta qué byte del diario está indexado y con qué
+# diario ("fin;inodo;crc"): el inodo y el CRC de los primeros y los últimos
+# bytes indexados. Si el diario se reemplazó (una copia de respaldo, migracion
+# a-txt, una edición a mano) la identidad no coincide y el índice se rehace en
+# lugar de seguir desde una posición que ya apunta a otros bytes.
+# "generacion" cambia cada vez que el índice se reconstruye.
+
+MUESTRA_IDENTIDAD = 4096
+
+def _ruta_indice(usuario):
+    return os.path.join(MOVIMIENTOS_INDICE, f"{usuario}.idx")
+
+
+def _ruta_fin_indice():
+    return os.path.join(MOVIMIENTOS_INDICE, "fin")
+
+
+def _identidad_diario(fin):
+    # Los bytes anteriores a fin no cambian al agregar, así que la identidad
+    # de un diario indexado hasta fin se mantiene mientras solo crezca.
+    try:
+        with open(MOVIMIENTOS_ARCHIVO, "rb") as archivo:
+            inodo = os.fstat(archivo.fileno()).st_ino
+            crc = zlib.crc32(archivo.read(min(fin, MUESTRA_IDENTIDAD)))
+            if fin > MUESTRA_IDENTIDAD:
+                archivo.seek(max(MUESTRA_IDENTIDAD, fin - MUESTRA_IDENTIDAD))
+                crc = zlib.crc32(archivo.read(fin - archivo.tell()), crc)
+    except OSError:
+        return ""
+    return f"{inodo};{crc}"
+
+
+def _leer_fin_indice():
+    # Devuelve (fin, identidad); un índice anterior sin identidad se rehace.
+    try:
+        with open(_ruta_fin_indice(), "r", encoding="utf-8") as archivo:
+            fin, _, identidad = archivo.read().strip().partition(";")
+            return int(fin or 0), identidad
+    except (OSError, ValueError):
+        return 0, None
+
+
+def _guardar_fin_indice(fin):
+    with open(_ruta_fin_indice(), "w", encoding="utf-8") as archivo:
+        archivo.write(f"{fin};{_identidad_diario(fin)}")
+
+
+def _leer_rangos(usuario):
+    rangos = []
+    ruta = _ruta_indice(usuario)
+    if not os.path.exists(ruta):
+        return rangos
+    with open(ruta, "r", encoding="utf-8") as archivo:
+        for linea in archivo:
+            rango = _parsear_rango(linea)
+            if rango is not None:
+                rangos.append(rango)
+    return rangos
+
+
+def _parsear_rango(linea):
+    entrada = _parsear_entrada_indice(linea)
+    return None if entrada is None else entrada[:2]
+
+
+def _parsear_entrada_indice(linea):
+    # Devuelve (inicio, longitud, marca); la marca es None si la línea no la tiene.
+    partes = linea.strip().split(";")
+    if len(partes) not in (2, 3):
+        return None
+    try:
+        marca = int(partes[2]) if len(partes) == 3 and partes[2] else None
+        return int(partes[0]), int(partes[1]), marca
+    except ValueError:
+        return None
+
+
+def _lineas_invertidas(ruta, bloque=4096):
+    # Recorre un archivo de texto desde el final, de a bloques, sin leerlo entero.
+    with open(ruta, "rb") as archivo:
+        archivo.seek(0, os.SEEK_END)
+        posicion = archivo.tell()
+        resto = b""
+        while posicion > 0:
+            cantidad = min(bloque, posicion)
+            posicion -= cantidad
+            archivo.seek(posicion)
+            lineas = (archivo.read(cantidad) + resto).split(b"\n")
+            resto = lineas.pop(0)
+            for linea in reversed(lineas):
+                if linea:
+                    yield linea.decode("utf-8", "replace")
+        if resto:
+            yield resto.decode("utf-8", "replace")
+
+
+def _agregar_rangos(usuario, rangos):
+    with open(_ruta_indice(usuario), "a", encoding="utf-8") as archivo:
+        for inicio, longitud, marca in rangos:
+            archivo.write(f"{inicio};{longitud};{'' if marca is None else marca}\n")
+
+
+def _indexar_desde(inicio):
+    nuevos = {}
+    posicion = inicio
+    with metricas.medir("helpers.indexar_movimientos") as medicion:
+        with open(MOVIMIENTOS_ARCHIVO, "rb") as archivo:
+            archivo.seek(inicio)
+            for linea in archivo:
+                if not linea.endswith(b"\n"):
+                    # Línea a medio escribir: se indexa en la próxima pasada.
+                    break
+                # Para indexar alcanzan el usuario y la fecha; no hace falta armar el registro.
+                partes = _partes_movimiento(linea.decode("utf-8", "replace"))
+                if partes is not None:
+                    marca = registros.marca_tiempo(registros.fecha_desde_texto(partes[1]))
+                    nuevos.setdefault(partes[0], []).append((posicion, len(linea), marca))
+                    medicion.filas += 1
+                posicion += len(linea)
+        for usuario, rangos in nuevos.items():
+            _agregar_rangos(usuario, rangos)
+        _guardar_fin_indice(posicion)
+        medicion.bytes = posicion - inicio
+
+
+def _indice_al_dia():
+    if not os.path.isdir(MOVIMIENTOS_INDICE):
+        return False
+    tamanio = os.path.getsize(MOVIMIENTOS_ARCHIVO) if os.path.exists(MOVIMIENTOS_ARCHIVO) else 0
+    fin, identidad = _leer_fin_indice()
+    return tamanio == fin and identidad == _identidad_diario(fin)
+
+
+def _asegurar_indice():
+    # Se llama con el bloqueo "diario" tomado.
+    if not os.path.isdir(MOVIMIENTOS_INDICE):
+        _reconstruir_indice()
+        return
+    tamanio = os.path.getsize(MOVIMIENTOS_ARCHIVO) if os.path.exists(MOVIMIENTOS_ARCHIVO) else 0
+    fin, identidad = _leer_fin_indice()
+    if tamanio < fin or identidad != _identidad_diario(fin):
+        _reconstruir_indice()
+    elif tamanio > fin:
+        _indexar_desde(fin)
+
+
+def _preparar_lectura():
+    if not _indice_al_dia():
+        with bloqueos.bloquear("diario"):
+            _asegurar_indice()
+
+
+def reconstruir_indice_movimientos():
+    with bloqueos.bloquear("diario"):
+        _reconstruir_indice()
+
+
+def _reconstruir_indice():
+    os.makedirs(MOVIMIENTOS_INDICE, exist_ok=True)
+    for nombre in os.listdir(MOVIMIENTOS_INDICE):
+        os.remove(os.path.join(MOVIMIENTOS_INDICE, nombre))
+    with open(os.path.join(MOVIMIENTOS_INDICE, "generacion"), "w", encoding="utf-8") as archivo:
+        archivo.write(str(time.time_ns()))
+    _guardar_fin_indice(0)
+    if os.path.exists(MOVIMIENTOS_ARCHIVO):
+        _indexar_desde(0)
+
+
+# ---------------- Búsqueda de movimientos ----------------
+# Para buscar por fecha se arma en memoria, la primera vez que se consulta a
+# un usuario, su índice ordenado por marca de tiempo: una lista de marcas y
+# otra con las posiciones en el diario. Un rango se ubica con bisect y solo se
+# leen del diario sus k líneas, O(log n + k). Después solo se incorporan las
+# líneas que se agregaron al .idx, salvo que el índice se haya reconstruido.
+
+_indices_tiempo = {}
+
+
+def _leer_generacion():
+    try:
+        with open(os.path.join(MOVIMIENTOS_INDICE, "generacion"), "r", encoding="utf-8") as archivo:
+            return archivo.read()
+    except OSError:
+        return ""
+
+
+def _marca_en_diario(diario, inicio, longitud):
+    # Para las líneas de un índice anterior, que no guardaba la fecha.
+    diario.seek(inicio)
+    partes = _partes_movimiento(diario.read(longitud).decode("utf-8", "replace"))
+    return None if partes is None else registros.marca_tiempo(registros.fecha_desde_texto(partes[1]))
+
+
+def _indice_tiempo(usuario):
+    # Se llama con el bloqueo "diario" tomado.
+    ruta = _ruta_indice(usuario)
+    generacion = _leer_generacion()
+    tamanio = _tamanio(ruta)
+    indice = _indices_tiempo.get(usuario)
+    if indice is None or indice["generacion"] != generacion or tamanio < indice["posicion"]:
+        indice = {"generacion": generacion, "posicion": 0, "marcas": [], "rangos": []}
+        _indices_tiempo[usuario] = indice
+    if tamanio == indice["posicion"]:
+        return indice
+    with open(ruta, "rb") as archivo:
+        archivo.seek(indice["posicion"])
+        datos = archivo.read(tamanio - indice["posicion"])
+    datos = datos[: datos.rfind(b"\n") + 1]
+    marcas = indice["marcas"]
+    rangos = indice["rangos"]
+    with open(MOVIMIENTOS_ARCHIVO, "rb") as diario:
+        for linea in datos.decode("utf-8", "replace").splitlines():
+            entrada = _parsear_entrada_indice(linea)
+            if entrada is None:
+                continue
+            inicio, longitud, marca = entrada
+            if marca is None:
+                marca = _marca_en_diario(diario, inicio, longitud)
+                if marca is None:
+                    continue
+            # Casi siempre llegan en orden y se agregan al final.
+            if not marcas or marca >= marcas[-1]:
+                marcas.append(marca)
+                rangos.append((inicio, longitud))
+            else:
+                posicion = bisect.bisect_right(marcas, marca)
+                marcas.insert(posicion, marca)
+                rangos.insert(posicion, (inicio, longitud))
+    indice["posicion"] += len(datos)
+    return indice
+
+
+def _marca_limite(fecha, fin_del_dia):
+    marca = registros.marca_tiempo(fecha)
+    # Una fecha sin hora como límite superior incluye todo ese día.
+    if fin_del_dia and not isinstance(fecha, datetime.datetime):
+        marca += 86399
+    return marca
+
+
+def buscar_movimientos(usuario, desde=None, hasta=None, tipo="", monto_minimo=None, monto_maximo=None):
+    # Devuelve, del más viejo al más nuevo, los movimientos del usuario con
+    # fecha entre desde y hasta (date o datetime, ambos incluidos; None es sin
+    # límite), cuyo tipo empiece con tipo ("ingreso", "pago"...) y cuyo monto
+    # esté entre monto_minimo y monto_maximo.
+    lista = []
+    if not os.path.exists(MOVIMIENTOS_ARCHIVO):
+        return lista
+    _preparar_lectura()
+    tipo = tipo.strip().lower()
+    minimo = None if monto_minimo is None else registros.a_centavos(monto_minimo)
+    maximo = None if monto_maximo is None else registros.a_centavos(monto_maximo)
+    with metricas.medir("helpers.buscar_movimientos") as medicion, bloqueos.bloquear("diario", exclusivo=False):
+        indice = _indice_tiempo(usuario)
+        marcas = indice["marcas"]
+        primero = 0 if desde is None else bisect.bisect_left(marcas, _marca_limite(desde, False))
+        ultimo = len(marcas) if hasta is None else bisect.bisect_right(marcas, _marca_limite(hasta, True))
+        with open(MOVIMIENTOS_ARCHIVO, "rb") as archivo:
+            for inicio, longitud in indice["rangos"][primero:ultimo]:
+                archivo.seek(inicio)
+                registro = _parsear_movimiento(archivo.read(longitud).decode("utf-8", "replace"))
+                medicion.bytes += longitud
+                if registro is None or registro[0] != usuario:
+                    continue
+                movimiento = registro[1]
+                if tipo and not registros.tipo_movimiento(movimiento).lower().startswith(tipo):
+                    continue
+                if minimo is not None and movimiento.centavos < minimo:
+                    continue
+                if maximo is not None and movimiento.centavos > maximo:
+                    continue
+                lista.append(movimiento)
+        medicion.filas = len(lista)
+    return lista
 
 
 # ---------------- Servicios ----------------
 
-def leer_servicios():
+def _leer_archivo_servicios(ruta):
     servicios = []
-    if not os.path.exists(SERVICIOS_ARCHIVO):
+    if not os.path.exists(ruta):
         return servicios
-    with open(SERVICIOS_ARCHIVO, "r", encoding="utf-8") as archivo:
-        for linea in archivo:
-            linea = linea.strip()
-            if not linea:
-                continue
-            partes = linea.split(";")
-            if len(partes) < 3:
-                continue
-            servicios.append(
-                {
-                    "codigo": partes[0],
-                    "nombre": partes[1],
-                    "monto": partes[2],
-                }
-            )
+    with metricas.medir("helpers.leer_servicios") as medicion:
+        with open(ruta, "r", encoding="utf-8") as archivo:
+            for linea in archivo:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                partes = linea.split(";")
+                if len(partes) < 3:
+                    continue
+                servicios.append(
+                    {
+                        "codigo": partes[0],
+                        "nombre": partes[1],
+                        "monto": partes[2],
+                        "categoria": partes[3] if len(partes) > 3 else "",
+                    }
+                )
+        medicion.bytes = _tamanio(ruta)
+        medicion.filas = len(servicios)
     return servicios
 
 
+def leer_servicios():
+    # Devuelve el catálogo indexado: se recorre como la lista de antes, pero
+    # buscar por código no lo recorre y se vuelve a leer solo si el archivo
+    # cambió, así que se puede editar sin reiniciar la consola.
+    return catalogo.CatalogoServicios(SERVICIOS_ARCHIVO, _leer_archivo_servicios, "codigo")
+
+
 def buscar_servicio(servicios, codigo):
+    if isinstance(servicios, catalogo.CatalogoServicios):
+        return servicios.obtener(codigo)
     for servicio in servicios:
         if servicio.get("codigo") == codigo:
             return servicio
     return None
 
 
+def buscar_servicios(servicios, texto, limite=catalogo.LIMITE_BUSQUEDA):
+    if isinstance(servicios, catalogo.CatalogoServicios):
+        return servicios.buscar(texto, limite)
+    buscado = catalogo.normalizar(texto.strip())
+    return [s for s in servicios if buscado in catalogo.normalizar(s.get("nombre", ""))][:limite]
+
+
 # ---------------- Utilidades ----------------
 
+def leer_monto(texto):
+    # float() acepta "nan", "inf" y "1e999"; ninguno es un monto.
+    numero = float(texto)
+    if not math.isfinite(numero):
+        raise ValueError(f"Monto inválido: {texto}")
+    return numero
+
+
 def formatear_monto(valor):
     try:
         numero = float(valor)
@@ -1,10 +1,26 @@
-"""Utility functions for reading and writing project data files."""
+"""Utility functions for reading and writing project data files.
+
+:func:`leer_json` and :func:`leer_csv` keep what they parsed in an LRU cache
+keyed by path and validated against the file's ``(mtime, size)``, so reading
+an unchanged file again skips opening and parsing it. Callers always receive
+their own copy. :func:`escribir_json` and :func:`escribir_csv` drop the entry
+of the file they write, and write it whole into a temporary file that then
+replaces it: a reader (or the cache) never sees a half-written file, and a
+crash leaves the previous version.
+"""
 from __future__ import annotations
 
 import csv
 import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, List, Dict, Any
+from typing import IO, Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple
+
+import metricas
 
 BASE_DIR = Path(__file__).resolve().parent
 DATA_DIR = BASE_DIR / "data"
@@ -12,60 +28,238 @@ LOG_DIR = BASE_DIR / "logs"
 REPORTS_DIR = BASE_DIR / "reports"
 
 
+# Directorios que este proceso ya comprobó o creó.
+_directorios_listos: Set[Path] = set()
+
+
+def asegurar_directorio(directorio: Path) -> None:
+    """Create *directorio* if needed; each directory is checked once per process."""
+    if directorio not in _directorios_listos:
+        directorio.mkdir(parents=True, exist_ok=True)
+        _directorios_listos.add(directorio)
+
+
 def asegurar_estructura_directorios() -> None:
     """Ensure the expected directory structure exists."""
     for folder in (DATA_DIR, LOG_DIR, REPORTS_DIR):
-        folder.mkdir(parents=True, exist_ok=True)
+        asegurar_directorio(folder)
 
 
 def ruta_datos(nombre_archivo: str) -> Path:
-    """Return the absolute path for a data file located inside DATA_DIR."""
-    asegurar_estructura_directorios()
+    """Return the absolute path for a data file located inside DATA_DIR.
+
+    No filesystem access happens here: the directory is created by the first
+    write through :func:`escribir_json` or :func:`escribir_csv`.
+    """
     return DATA_DIR / nombre_archivo
 
 
 def ruta_log(nombre_archivo: str) -> Path:
     """Return the absolute path for a log file located inside LOG_DIR."""
-    asegurar_estructura_directorios()
     return LOG_DIR / nombre_archivo
 
 
 def ruta_reporte(nombre_archivo: str) -> Path:
     """Return the absolute path for a report file located inside REPORTS_DIR."""
-    asegurar_estructura_directorios()
     return REPORTS_DIR / nombre_archivo
 
 
+# ---------------- Caché de lecturas ----------------
+
+# Tope de la caché, medido por el tamaño en disco de los archivos guardados.
+CAPACIDAD_CACHE = 32 * 1024 * 1024
+# Un archivo modificado hace menos que esto no se guarda: otro proceso podría
+# volver a escribirlo sin que cambien su fecha (la resolución es gruesa) ni su tamaño.
+MARGEN_MODIFICACION_NS = 1_000_000_000
+
+Firma = Tuple[int, int]
+# Lo que devuelve CacheLecturas.obtener cuando no tiene el archivo (None es un JSON válido).
+FALTA = object()
+
+
+def _firma(path: Path) -> Optional[Firma]:
+    try:
+        estado = os.stat(path)
+    except OSError:
+        return None
+    return estado.st_mtime_ns, estado.st_size
+
+
+def _copiar(valor: Any) -> Any:
+    """Copy the lists and dicts of a parsed JSON value (strings and numbers are shared)."""
+    if isinstance(valor, dict):
+        return {clave: _copiar(dato) for clave, dato in valor.items()}
+    if isinstance(valor, list):
+        return [_copiar(dato) for dato in valor]
+    return valor
+
+
+class CacheLecturas:
+    """LRU cache of parsed files, bounded by the total size of the cached files."""
+
+    def __init__(self, capacidad: int = CAPACIDAD_CACHE) -> None:
+        self.capacidad = capacidad
+        self._entradas: OrderedDict[Tuple[Any, ...], Tuple[Firma, Any]] = OrderedDict()
+        self._claves_por_ruta: Dict[Path, Set[Tuple[Any, ...]]] = {}
+        self._bytes = 0
+        self._bloqueo = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave: Tuple[Any, ...], firma: Firma) -> Any:
+        """Return the cached value for *clave* if it was read with *firma*, else ``FALTA``."""
+        with self._bloqueo:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[0] == firma:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return entrada[1]
+            self.fallos += 1
+            return FALTA
+
+    def guardar(self, clave: Tuple[Any, ...], firma: Firma, valor: Any) -> None:
+        mtime, tamanio = firma
+        if tamanio > self.capacidad // 4 or time.time_ns() - mtime < MARGEN_MODIFICACION_NS:
+            return
+        with self._bloqueo:
+            self._quitar(clave)
+            self._entradas[clave] = (firma, valor)
+            self._claves_por_ruta.setdefault(clave[1], set()).add(clave)
+            self._bytes += tamanio
+            while self._bytes > self.capacidad:
+                self._quitar(next(iter(self._entradas)))
+                self.desalojos += 1
+
+    def _quitar(self, clave: Tuple[Any, ...]) -> None:
+        entrada = self._entradas.pop(clave, None)
+        if entrada is None:
+            return
+        self._bytes -= entrada[0][1]
+        claves = self._claves_por_ruta[clave[1]]
+        claves.discard(clave)
+        if not claves:
+            del self._claves_por_ruta[clave[1]]
+
+    def invalidar(self, path: Path) -> None:
+        """Drop every entry read from *path*."""
+        with self._bloqueo:
+            for clave in list(self._claves_por_ruta.get(path, ())):
+                self._quitar(clave)
+                self.invalidaciones += 1
+
+    def vaciar(self) -> None:
+        with self._bloqueo:
+            self._entradas.clear()
+            self._claves_por_ruta.clear()
+            self._bytes = 0
+
+    def estadisticas(self) -> Dict[str, int]:
+        with self._bloqueo:
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "invalidaciones": self.invalidaciones,
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+            }
+
+
+cache_lecturas = CacheLecturas()
+
+
+def estadisticas_cache() -> Dict[str, int]:
+    """Return the hit/miss/eviction counters and current size of the read cache."""
+    return cache_lecturas.estadisticas()
+
+
+# ---------------- Lectura y escritura ----------------
+
+
 def leer_json(path: Path, default: Any) -> Any:
     """Read JSON data from *path* returning *default* if the file does not exist."""
-    if not path.exists():
+    firma = _firma(path)
+    if firma is None:
         return default
-    with path.open("r", encoding="utf-8") as archivo:
-        try:
-            return json.load(archivo)
-        except json.JSONDecodeError:
-            return default
+    clave = ("json", path)
+    with metricas.medir("io_archivos.leer_json") as medicion:
+        valor = cache_lecturas.obtener(clave, firma)
+        if valor is FALTA:
+            # Solo cuenta como bytes leídos lo que no vino de la caché.
+            medicion.bytes = firma[1]
+            with path.open("r", encoding="utf-8") as archivo:
+                try:
+                    valor = json.load(archivo)
+                except json.JSONDecodeError:
+                    return default
+            cache_lecturas.guardar(clave, firma, valor)
+        copia = _copiar(valor)
+        medicion.filas = len(copia) if isinstance(copia, (list, dict)) else 1
+    return copia
+
+
+@contextmanager
+def _reemplazo_atomico(path: Path, sincronizar: bool = False, **opciones: Any) -> Iterator[IO[str]]:
+    """Open a temporary file next to *path* that replaces it once the block ends without errors."""
+    asegurar_directorio(path.parent)
+    # Un nombre por proceso e hilo: dos escritores no comparten el temporal.
+    temporal = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with temporal.open("w", encoding="utf-8", **opciones) as archivo:
+            yield archivo
+            if sincronizar:
+                archivo.flush()
+                os.fsync(archivo.fileno())
+        os.replace(temporal, path)
+    except BaseException:
+        temporal.unlink(missing_ok=True)
+        raise
+
 
+def escribir_json(path: Path, data: Any, indent: int | None = 2, sincronizar: bool = False) -> None:
+    """Write *data* as JSON into *path*; ``indent=None`` writes it compactly.
 
-def escribir_json(path: Path, data: Any) -> None:
-    """Write *data* as JSON into *path*."""
-    with path.open("w", encoding="utf-8") as archivo:
-        json.dump(data, archivo, indent=2, ensure_ascii=False)
+    With *sincronizar* the new contents are on disk (``fsync``) before they replace the old file.
+    """
+    separadores = None if indent is not None else (",", ":")
+    cache_lecturas.invalidar(path)
+    with metricas.medir("io_archivos.escribir_json") as medicion:
+        with _reemplazo_atomico(path, sincronizar) as archivo:
+            json.dump(data, archivo, indent=indent, separators=separadores, ensure_ascii=False)
+            medicion.bytes = archivo.tell()
+        medicion.filas = len(data) if isinstance(data, (list, dict)) else 1
 
 
 def leer_csv(path: Path, fieldnames: Iterable[str] | None = None) -> List[Dict[str, str]]:
     """Read a CSV file returning a list of dictionaries."""
-    if not path.exists():
+    firma = _firma(path)
+    if firma is None:
         return []
-    with path.open("r", encoding="utf-8", newline="") as archivo:
-        lector = csv.DictReader(archivo) if fieldnames is None else csv.DictReader(archivo, fieldnames=fieldnames)
-        return [dict(fila) for fila in lector]
+    campos = tuple(fieldnames) if fieldnames is not None else None
+    clave = ("csv", path, campos)
+    with metricas.medir("io_archivos.leer_csv") as medicion:
+        filas = cache_lecturas.obtener(clave, firma)
+        if filas is FALTA:
+            medicion.bytes = firma[1]
+            with path.open("r", encoding="utf-8", newline="") as archivo:
+                lector = csv.DictReader(archivo, fieldnames=campos)
+                filas = [dict(fila) for fila in lector]
+            cache_lecturas.guardar(clave, firma, filas)
+        medicion.filas = len(filas)
+        # Los valores son cadenas: alcanza con copiar cada fila.
+        return [dict(fila) for fila in filas]
 
 
 def escribir_csv(path: Path, fieldnames: Iterable[str], rows: Iterable[Dict[str, Any]]) -> None:
     """Write dictionaries in *rows* to *path* as CSV using the given *fieldnames*."""
-    with path.open("w", encoding="utf-8", newline="") as archivo:
-        escritor = csv.DictWriter(archivo, fieldnames=fieldnames)
-        escritor.writeheader()
-        for fila in rows:
-            escritor.writerow({clave: fila.get(clave, "") for clave in fieldnames})
+    cache_lecturas.invalidar(path)
+    with metricas.medir("io_archivos.escribir_csv") as medicion:
+        with _reemplazo_atomico(path, newline="") as archivo:
+            escritor = csv.DictWriter(archivo, fieldnames=fieldnames)
+            escritor.writeheader()
+            for fila in rows:
+                escritor.writerow({clave: fila.get(clave, "") for clave in fieldnames})
+                medicion.filas += 1
+            medicion.bytes = archivo.tell()
@@ -1,16 +1,249 @@
-"""Simple file logger for the Kiwillet application."""
+"""Simple file logger for the Kiwillet application.
+
+Events are queued and written by a background thread in batches, flushed when
+``TAMANIO_LOTE`` events accumulate, every ``INTERVALO_VACIADO`` seconds and at
+interpreter exit. The log is rotated by size or by day, keeping ``COPIAS``
+rotated files that can optionally be gzip-compressed.
+
+Several processes may share the log: each batch is written holding a
+:mod:`bloqueos` lock whose file sits next to the log (so processes started from
+different directories share it), and a writer whose open file was rotated by
+another process reopens the path before writing. A batch that cannot be
+written is kept and retried; if rotating fails, the lines go to the current file.
+"""
 from __future__ import annotations
 
-from datetime import datetime
+import atexit
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Optional
 
-from io_archivos import ruta_log
+import bloqueos
+import metricas
+from io_archivos import asegurar_directorio, ruta_log
 
 
 BITACORA = ruta_log("bitacora.log")
+INTERVALO_VACIADO = 1.0
+TAMANIO_LOTE = 512
+TAMANIO_MAXIMO = 5 * 1024 * 1024
+COPIAS = 5
+
+
+class EscritorBitacora:
+    """Background writer that batches log lines and rotates the log file."""
+
+    def __init__(
+        self,
+        ruta: Path,
+        intervalo: float = INTERVALO_VACIADO,
+        tamanio_lote: int = TAMANIO_LOTE,
+        rotacion: str = "tamanio",
+        tamanio_maximo: int = TAMANIO_MAXIMO,
+        copias: int = COPIAS,
+        comprimir: bool = True,
+    ) -> None:
+        if rotacion not in ("tamanio", "diaria"):
+            raise ValueError("rotacion debe ser 'tamanio' o 'diaria'")
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.tamanio_lote = max(1, tamanio_lote)
+        self.rotacion = rotacion
+        self.tamanio_maximo = tamanio_maximo
+        self.copias = copias
+        self.comprimir = comprimir
+        self._cola: "queue.Queue[object]" = queue.Queue()
+        self._archivo = None
+        self._fecha_archivo: Optional[date] = None
+        self._pid = os.getpid()
+        self._hilo = threading.Thread(target=self._trabajar, name="bitacora", daemon=True)
+        self._hilo.start()
+        if "multiprocessing" in sys.modules:
+            # Los procesos hijos de multiprocessing terminan sin pasar por atexit.
+            from multiprocessing import util
+
+            util.Finalize(self, self.cerrar, exitpriority=10)
+
+    @property
+    def vigente(self) -> bool:
+        # Tras un fork el hilo escritor no existe en el proceso hijo.
+        return self._pid == os.getpid() and self._hilo.is_alive()
+
+    def registrar(self, linea: str) -> None:
+        self._cola.put(linea)
+
+    def vaciar(self) -> None:
+        """Block until every queued line has been written."""
+        self._pedir("vaciar")
+
+    def cerrar(self) -> None:
+        """Write the pending lines and stop the background thread."""
+        if self._hilo.is_alive():
+            self._pedir("cerrar")
+            self._hilo.join()
+
+    def _pedir(self, orden: str) -> None:
+        listo = threading.Event()
+        self._cola.put((orden, listo))
+        listo.wait()
+
+    def _trabajar(self) -> None:
+        pendientes: List[str] = []
+        limite = 0.0
+        fallando = False
+        while True:
+            espera = max(0.0, limite - time.monotonic()) if pendientes else None
+            try:
+                elemento = self._cola.get(timeout=espera)
+            except queue.Empty:
+                elemento = None
+            if isinstance(elemento, str):
+                if not pendientes:
+                    limite = time.monotonic() + self.intervalo
+                pendientes.append(elemento)
+                # Tras un fallo se espera al intervalo aunque el lote esté lleno.
+                if (fallando or len(pendientes) < self.tamanio_lote) and time.monotonic() < limite:
+                    continue
+            try:
+                self._escribir(pendientes)
+                pendientes = []
+                fallando = False
+            except Exception as error:
+                # El hilo no termina (quien espera en _pedir quedaría colgado):
+                # el lote se conserva y se reintenta en el próximo intervalo.
+                print(f"bitacora: no se pudieron escribir {len(pendientes)} eventos, se reintenta: {error!r}", file=sys.stderr)
+                self._cerrar_archivo()
+                limite = time.monotonic() + self.intervalo
+                fallando = True
+            if isinstance(elemento, tuple):
+                orden, listo = elemento
+                if orden == "cerrar":
+                    if pendientes:
+                        print(f"bitacora: se descartan {len(pendientes)} eventos sin escribir", file=sys.stderr)
+                    self._cerrar_archivo()
+                listo.set()
+                if orden == "cerrar":
+                    return
+
+    def _escribir(self, lineas: List[str]) -> None:
+        if not lineas:
+            return
+        bloqueo = bloqueos.bloquear(self.ruta.stem, directorio=str(self.ruta.parent))
+        with metricas.medir("logger.escribir") as medicion, bloqueo:
+            self._reabrir_si_rotaron()
+            try:
+                self._rotar_si_corresponde()
+            except OSError as error:
+                # Sin rotar, el lote va igual al archivo actual.
+                print(f"bitacora: no se pudo rotar {self.ruta}: {error!r}", file=sys.stderr)
+            if self._archivo is None:
+                asegurar_directorio(self.ruta.parent)
+                self._archivo = self.ruta.open("a", encoding="utf-8")
+                if self._fecha_archivo is None:
+                    self._fecha_archivo = date.today()
+            texto = "".join(lineas)
+            self._archivo.write(texto)
+            self._archivo.flush()
+            medicion.bytes = len(texto)
+            medicion.filas = len(lineas)
+
+    def _cerrar_archivo(self) -> None:
+        if self._archivo is not None:
+            archivo, self._archivo = self._archivo, None
+            archivo.close()
+
+    def _reabrir_si_rotaron(self) -> None:
+        # Otro proceso pudo rotar la bitácora: el archivo abierto ya no es el
+        # de la ruta y lo escrito ahí terminaría en una copia rotada.
+        if self._archivo is None:
+            return
+        try:
+            actual = os.stat(self.ruta)
+        except FileNotFoundError:
+            actual = None
+        abierto = os.fstat(self._archivo.fileno())
+        if actual is None or (actual.st_ino, actual.st_dev) != (abierto.st_ino, abierto.st_dev):
+            self._cerrar_archivo()
+            self._fecha_archivo = None
+
+    def _rotar_si_corresponde(self) -> None:
+        if not self.ruta.exists():
+            return
+        if self._fecha_archivo is None:
+            self._fecha_archivo = date.fromtimestamp(self.ruta.stat().st_mtime)
+        if self.rotacion == "diaria":
+            if self._fecha_archivo != date.today():
+                self._rotar(self._fecha_archivo.strftime("%Y%m%d"))
+        elif self.ruta.stat().st_size >= self.tamanio_maximo:
+            self._rotar(datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    def _rotar(self, sufijo: str) -> None:
+        self._cerrar_archivo()
+        destino = self.ruta.with_name(f"{self.ruta.name}.{sufijo}")
+        numero = 1
+        while destino.exists() or destino.with_name(destino.name + ".gz").exists():
+            destino = self.ruta.with_name(f"{self.ruta.name}.{sufijo}-{numero}")
+            numero += 1
+        os.replace(self.ruta, destino)
+        self._fecha_archivo = None
+        if self.comprimir:
+            # Solo hacen falta al rotar; así no pesan en el arranque.
+            import gzip
+            import shutil
+
+            with destino.open("rb") as origen, gzip.open(destino.with_name(destino.name + ".gz"), "wb") as comprimido:
+                shutil.copyfileobj(origen, comprimido)
+            destino.unlink()
+        rotados = sorted(self.ruta.parent.glob(f"{self.ruta.name}.*"), key=lambda ruta: ruta.stat().st_mtime_ns)
+        for viejo in rotados[: max(0, len(rotados) - self.copias)]:
+            viejo.unlink()
+
+
+_escritor: Optional[EscritorBitacora] = None
+_bloqueo = threading.Lock()
+_opciones: dict = {}
+
+
+def configurar_bitacora(**opciones) -> None:
+    """Set the :class:`EscritorBitacora` options used from now on (pending lines are flushed)."""
+    global _escritor
+    with _bloqueo:
+        if _escritor is not None and _escritor.vigente:
+            _escritor.cerrar()
+        _escritor = None
+        _opciones.clear()
+        _opciones.update(opciones)
+
+
+def _obtener_escritor() -> EscritorBitacora:
+    global _escritor
+    escritor = _escritor
+    if escritor is not None and escritor.vigente:
+        return escritor
+    with _bloqueo:
+        if _escritor is None or not _escritor.vigente:
+            _escritor = EscritorBitacora(BITACORA, **_opciones)
+        return _escritor
+
+
+def vaciar_bitacora() -> None:
+    """Block until every event logged so far is on disk."""
+    if _escritor is not None and _escritor.vigente:
+        _escritor.vaciar()
+
+
+@atexit.register
+def _cerrar_al_salir() -> None:
+    if _escritor is not None and _escritor.vigente:
+        _escritor.cerrar()
 
 
 def registrar_evento(accion: str, detalle: str = "") -> None:
     """Append a log entry with current timestamp, action and detail."""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with BITACORA.open("a", encoding="utf-8") as archivo:
-        archivo.write(f"{timestamp};{accion};{detalle}\n")
+    _obtener_escritor().registrar(f"{timestamp};{accion};{detalle}\n")
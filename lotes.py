@@ -0,0 +1,260 @@
+"""Procesamiento por lotes de operaciones sobre la billetera.
+
+Lee un archivo CSV o JSONL con una operación por línea, las valida y aplica en
+memoria, y persiste cada archivo afectado una sola vez por bloque en lugar de
+una vez por operación. Mientras se procesa un bloque se mantienen tomados los
+bloqueos de sus usuarios, así que las terminales pueden seguir operando sobre
+otras cuentas. Genera un reporte CSV con el resultado de cada línea; las filas
+de un bloque se escriben después de guardarlo, y si el guardado falla sus
+operaciones figuran con error y el proceso se detiene.
+
+Columnas reconocidas: ``operacion`` (``ingreso``, ``pago_servicio``,
+``alta_tarjeta`` o ``baja_tarjeta``), ``usuario``, ``monto``, ``servicio``,
+``alias``, ``numero``, ``tipo``, ``vencimiento`` y ``fecha`` (opcional,
+``DD/MM/AAAA``; una fecha ilegible rechaza la línea). En JSONL, ``null``
+equivale a un campo vacío.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import datetime
+import json
+import math
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import bloqueos
+import helpers
+import registros
+
+CAMPOS_REPORTE = ["linea", "operacion", "usuario", "resultado", "detalle"]
+TAMANIO_BLOQUE = 5000
+
+
+def leer_operaciones(ruta: Path) -> Iterator[Tuple[int, Optional[Dict[str, str]]]]:
+    """Yield ``(line_number, operation)``; the operation is ``None`` if the line cannot be parsed."""
+    if ruta.suffix.lower() == ".jsonl":
+        with ruta.open("r", encoding="utf-8") as archivo:
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    datos = json.loads(linea)
+                except json.JSONDecodeError:
+                    yield numero, None
+                    continue
+                if not isinstance(datos, dict):
+                    yield numero, None
+                    continue
+                yield numero, {clave: "" if valor is None else str(valor).strip() for clave, valor in datos.items()}
+        return
+    with ruta.open("r", encoding="utf-8", newline="") as archivo:
+        lector = csv.DictReader(archivo)
+        for fila in lector:
+            yield lector.line_num, {clave: (valor or "").strip() for clave, valor in fila.items() if clave}
+
+
+def _monto(operacion: Dict[str, str], obligatorio: bool = True) -> Optional[float]:
+    texto = operacion.get("monto", "")
+    if not texto:
+        if obligatorio:
+            raise ValueError("Falta el monto.")
+        return None
+    try:
+        valor = float(texto)
+    except ValueError:
+        raise ValueError("Monto inválido.") from None
+    # float() acepta "nan", "inf" y "1e999"; ninguno es un monto.
+    if not math.isfinite(valor):
+        raise ValueError("Monto inválido.")
+    if valor <= 0:
+        raise ValueError("El monto debe ser positivo.")
+    return valor
+
+
+def _fecha(operacion: Dict[str, str], hoy: datetime.date) -> registros.Fecha:
+    texto = operacion.get("fecha", "")
+    if not texto:
+        return hoy
+    fecha = registros.fecha_desde_texto(texto)
+    if not isinstance(fecha, datetime.date):
+        raise ValueError("Fecha inválida.")
+    return fecha
+
+
+def _campo_tarjeta(operacion: Dict[str, str], campo: str) -> str:
+    # Los campos van tal cual a una línea de tarjetas.wal separada por ";".
+    valor = operacion.get(campo, "")
+    if any(caracter in valor for caracter in ";\r\n"):
+        raise ValueError(f"El campo {campo} no puede contener ';' ni saltos de línea.")
+    return valor
+
+
+class ProcesadorLotes:
+    """Apply operations in memory and persist the affected files once per block."""
+
+    def __init__(self) -> None:
+        helpers.inicializar_archivos()
+        self.usuarios = helpers.leer_usuarios()
+        self.tarjetas = helpers.leer_tarjetas()
+        self.servicios = helpers.leer_servicios()
+        self.hoy = datetime.date.today()
+        self._movimientos: List[Tuple[str, registros.Movimiento]] = []
+        self._usuarios_modificados: Set[str] = set()
+        self._cambios_tarjetas: List[str] = []
+
+    def refrescar(self, nombres: Iterable[str]) -> None:
+        """Reload from disk the users and cards of *nombres* (their locks must be held)."""
+        for nombre in set(nombres):
+            helpers.refrescar_usuario(self.usuarios, nombre)
+        helpers.refrescar_tarjetas(self.tarjetas)
+
+    def aplicar(self, operacion: Dict[str, str]) -> str:
+        """Apply *operacion* and return a detail message; raise ``ValueError`` if it is rejected."""
+        usuario = operacion.get("usuario", "")
+        if usuario not in self.usuarios:
+            raise ValueError("Usuario inexistente.")
+        tipo = operacion.get("operacion", "").lower()
+        if tipo == "ingreso":
+            return self._ingreso(usuario, operacion)
+        if tipo == "pago_servicio":
+            return self._pago_servicio(usuario, operacion)
+        if tipo == "alta_tarjeta":
+            return self._alta_tarjeta(usuario, operacion)
+        if tipo == "baja_tarjeta":
+            return self._baja_tarjeta(usuario, operacion)
+        raise ValueError("Operación desconocida.")
+
+    def _mover_saldo(self, usuario: str, fecha: registros.Fecha, concepto: str, monto: float) -> None:
+        datos = self.usuarios[usuario]
+        saldo = datos["saldo"] + monto
+        # El movimiento se arma antes de tocar el saldo en memoria, para que
+        # un error al convertirlo deje al usuario como estaba.
+        movimiento = registros.Movimiento(fecha, concepto, registros.a_centavos(abs(monto)), registros.a_centavos(saldo))
+        datos["saldo"] = saldo
+        self._usuarios_modificados.add(usuario)
+        self._movimientos.append((usuario, movimiento))
+
+    def _ingreso(self, usuario: str, operacion: Dict[str, str]) -> str:
+        monto = _monto(operacion)
+        self._mover_saldo(usuario, _fecha(operacion, self.hoy), "Ingreso de dinero", monto)
+        return f"Saldo: {helpers.formatear_monto(self.usuarios[usuario]['saldo'])}"
+
+    def _pago_servicio(self, usuario: str, operacion: Dict[str, str]) -> str:
+        alias = operacion.get("alias", "")
+        if helpers.obtener_tarjeta(self.tarjetas, usuario, alias) is None:
+            raise ValueError("Tarjeta no encontrada.")
+        servicio = helpers.buscar_servicio(self.servicios, operacion.get("servicio", ""))
+        if servicio is None:
+            raise ValueError("Servicio inexistente.")
+        fecha = _fecha(operacion, self.hoy)
+        monto = _monto(operacion, obligatorio=False)
+        if monto is None:
+            monto = float(servicio.get("monto", "0") or 0)
+        if monto > self.usuarios[usuario]["saldo"]:
+            raise ValueError("Saldo insuficiente.")
+        self._mover_saldo(usuario, fecha, f"Pago {servicio.get('nombre', '')}", -monto)
+        return f"Saldo: {helpers.formatear_monto(self.usuarios[usuario]['saldo'])}"
+
+    def _alta_tarjeta(self, usuario: str, operacion: Dict[str, str]) -> str:
+        tarjeta = {campo: _campo_tarjeta(operacion, campo) for campo in ("alias", "numero", "tipo", "vencimiento")}
+        alias = tarjeta["alias"]
+        if not alias:
+            raise ValueError("Falta el alias de la tarjeta.")
+        por_alias = self.tarjetas.setdefault(usuario, {})
+        if alias in por_alias:
+            raise ValueError("Ya existe una tarjeta con ese alias.")
+        por_alias[alias] = tarjeta
+        self._cambios_tarjetas.append(helpers.linea_alta_tarjeta(usuario, tarjeta))
+        return f"Tarjeta {alias} agregada."
+
+    def _baja_tarjeta(self, usuario: str, operacion: Dict[str, str]) -> str:
+        alias = operacion.get("alias", "")
+        if self.tarjetas.get(usuario, {}).pop(alias, None) is None:
+            raise ValueError("No se encontró la tarjeta.")
+        self._cambios_tarjetas.append(helpers.linea_baja_tarjeta(usuario, alias))
+        return f"Tarjeta {alias} eliminada."
+
+    def persistir(self) -> None:
+        """Write everything applied since the last call, one write per affected file."""
+        helpers.agregar_movimientos(self._movimientos)
+        self._movimientos = []
+        if self._usuarios_modificados:
+            helpers.agregar_usuarios([(nombre, self.usuarios[nombre]) for nombre in self._usuarios_modificados])
+            self._usuarios_modificados = set()
+        # Las altas y bajas del bloque se agregan al WAL de tarjetas de una vez.
+        helpers.agregar_cambios_tarjetas(self._cambios_tarjetas)
+        self._cambios_tarjetas = []
+
+
+def _bloques(
+    operaciones: Iterable[Tuple[int, Optional[Dict[str, str]]]], tamanio: int
+) -> Iterator[List[Tuple[int, Optional[Dict[str, str]]]]]:
+    bloque: List[Tuple[int, Optional[Dict[str, str]]]] = []
+    for elemento in operaciones:
+        bloque.append(elemento)
+        if len(bloque) >= tamanio:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def procesar_lote(ruta: Path, ruta_reporte: Path, tamanio_bloque: int = TAMANIO_BLOQUE) -> Dict[str, int]:
+    """Process the operations file at *ruta*, write the per-line report and return totals.
+
+    If a block cannot be saved, its report rows are written as errors and the
+    ``OSError`` is re-raised.
+    """
+    procesador = ProcesadorLotes()
+    totales = {"ok": 0, "error": 0}
+    with ruta_reporte.open("w", encoding="utf-8", newline="") as archivo:
+        escritor = csv.DictWriter(archivo, fieldnames=CAMPOS_REPORTE)
+        escritor.writeheader()
+        for bloque in _bloques(leer_operaciones(ruta), tamanio_bloque):
+            nombres = {operacion.get("usuario", "") for _, operacion in bloque if operacion}
+            with bloqueos.bloquear_usuarios(nombres):
+                procesador.refrescar(nombres)
+                filas = []
+                for numero, operacion in bloque:
+                    fila = {"linea": numero, "operacion": "", "usuario": ""}
+                    if operacion is None:
+                        fila.update(resultado="error", detalle="Línea ilegible.")
+                    else:
+                        fila.update(operacion=operacion.get("operacion", ""), usuario=operacion.get("usuario", ""))
+                        try:
+                            fila.update(resultado="ok", detalle=procesador.aplicar(operacion))
+                        except ValueError as error:
+                            fila.update(resultado="error", detalle=str(error))
+                    filas.append(fila)
+                try:
+                    procesador.persistir()
+                except OSError as error:
+                    for fila in filas:
+                        if fila["resultado"] == "ok":
+                            fila.update(resultado="error", detalle=f"No se pudo guardar el bloque: {error}")
+                    raise
+                finally:
+                    for fila in filas:
+                        totales[fila["resultado"]] += 1
+                    escritor.writerows(filas)
+    return totales
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Aplica un lote de operaciones CSV/JSONL sobre la billetera.")
+    parser.add_argument("operaciones", type=Path, help="archivo .csv o .jsonl con una operación por línea")
+    parser.add_argument("--reporte", type=Path, default=Path("resultado_lote.csv"), help="reporte CSV por línea")
+    parser.add_argument("--bloque", type=int, default=TAMANIO_BLOQUE, help="operaciones aplicadas entre escrituras")
+    argumentos = parser.parse_args()
+    try:
+        totales = procesar_lote(argumentos.operaciones, argumentos.reporte, max(1, argumentos.bloque))
+    except OSError as error:
+        sys.exit(f"No se pudo guardar el lote: {error} | Reporte parcial: {argumentos.reporte}")
+    print(f"Operaciones correctas: {totales['ok']} | Con error: {totales['error']} | Reporte: {argumentos.reporte}")
+
+
+if __name__ == "__main__":
+    main()
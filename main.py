@@ -1,8 +1,19 @@
 """Programa sencillo de billetera virtual."""
 
+import argparse
 import datetime
+import threading
 
+import bloqueos
 import helpers
+import metricas
+import programados
+import registros
+import seguridad
+import transacciones
+
+MOVIMIENTOS_POR_PAGINA = 10
+SERVICIOS_POR_BUSQUEDA = 10
 
 
 def pausar():
@@ -17,7 +28,9 @@ def mostrar_menu():
     print("4. Pagar servicio")
     print("5. Ver movimientos")
     print("6. Cambiar contraseña")
-    print("7. Salir")
+    print("7. Pagos programados")
+    print("8. Buscar movimientos")
+    print("9. Salir")
     return input("Opción: ").strip()
 
 
@@ -30,7 +43,16 @@ def mostrar_menu_tarjetas():
     return input("Opción: ").strip()
 
 
-def iniciar_sesion(usuarios):
+def mostrar_menu_programados():
+    print("\n--- Pagos programados ---")
+    print("1. Listar pagos programados")
+    print("2. Programar un pago")
+    print("3. Cancelar un pago")
+    print("4. Volver")
+    return input("Opción: ").strip()
+
+
+def iniciar_sesion(almacen, usuarios):
     while True:
         print("\n1. Iniciar sesión")
         print("2. Crear cuenta")
@@ -39,8 +61,10 @@ def iniciar_sesion(usuarios):
         if opcion == "1":
             nombre = input("Usuario: ").strip()
             clave = input("Contraseña: ").strip()
+            almacen.refrescar_usuario(usuarios, nombre)
             datos = usuarios.get(nombre)
-            if datos and datos.get("clave") == clave:
+            if datos and helpers.clave_correcta(datos, clave):
+                actualizar_hash_clave(almacen, usuarios, nombre, clave)
                 print("Bienvenido", nombre)
                 return nombre
             print("Datos incorrectos.")
@@ -49,12 +73,14 @@ def iniciar_sesion(usuarios):
             if not nombre:
                 print("Ingrese un nombre válido.")
                 continue
-            if nombre in usuarios:
-                print("El usuario ya existe.")
-                continue
             clave = input("Contraseña: ").strip()
-            usuarios[nombre] = {"clave": clave, "saldo": 0.0}
-            helpers.guardar_usuarios(usuarios)
+            with bloqueos.bloquear_usuario(nombre):
+                almacen.refrescar_usuario(usuarios, nombre)
+                if nombre in usuarios:
+                    print("El usuario ya existe.")
+                    continue
+                usuarios[nombre] = {"clave": seguridad.hash_password(clave), "saldo": 0.0}
+                almacen.guardar_usuario(usuarios, nombre)
             print("Usuario creado. Ingrese nuevamente para continuar.")
         elif opcion == "3":
             return None
@@ -62,6 +88,21 @@ def iniciar_sesion(usuarios):
             print("Opción inválida.")
 
 
+def actualizar_hash_clave(almacen, usuarios, nombre, clave):
+    # Las claves en texto plano o con un hash de costo anterior se reemplazan
+    # por el hash vigente, ahora que se conoce la contraseña.
+    anterior = usuarios[nombre]["clave"]
+    if not seguridad.necesita_rehash(anterior):
+        return
+    nuevo = seguridad.hash_password(clave)
+    with bloqueos.bloquear_usuario(nombre):
+        almacen.refrescar_usuario(usuarios, nombre)
+        # Si otra consola la cambió mientras tanto, gana ese cambio.
+        if nombre in usuarios and usuarios[nombre]["clave"] == anterior:
+            usuarios[nombre]["clave"] = nuevo
+            almacen.guardar_usuario(usuarios, nombre)
+
+
 def mostrar_tarjetas(tarjetas_usuario):
     if not tarjetas_usuario:
         print("No hay tarjetas cargadas.")
@@ -74,7 +115,7 @@ def mostrar_tarjetas(tarjetas_usuario):
         print(f"Alias: {alias} | Número: {numero} | Tipo: {tipo} | Vence: {vencimiento}")
 
 
-def flujo_tarjetas(tarjetas, usuario):
+def flujo_tarjetas(almacen, tarjetas, usuario):
     while True:
         opcion = mostrar_menu_tarjetas()
         tarjetas_usuario = helpers.obtener_tarjetas_usuario(tarjetas, usuario)
@@ -86,14 +127,14 @@ def flujo_tarjetas(tarjetas, usuario):
             numero = input("Número: ").strip()
             tipo = input("Tipo: ").strip()
             vencimiento = input("Vencimiento (MM/AA): ").strip()
-            if helpers.agregar_tarjeta(tarjetas, usuario, alias, numero, tipo, vencimiento):
+            if almacen.agregar_tarjeta(tarjetas, usuario, alias, numero, tipo, vencimiento):
                 print("Tarjeta agregada.")
             else:
                 print("Ya existe una tarjeta con ese alias.")
             pausar()
         elif opcion == "3":
             alias = input("Alias a eliminar: ").strip()
-            if helpers.eliminar_tarjeta(tarjetas, usuario, alias):
+            if almacen.eliminar_tarjeta(tarjetas, usuario, alias):
                 print("Tarjeta eliminada.")
             else:
                 print("No se encontró la tarjeta.")
@@ -104,32 +145,45 @@ def flujo_tarjetas(tarjetas, usuario):
             print("Opción inválida.")
 
 
-def ingresar_dinero(usuarios, movimientos, usuario):
+def ingresar_dinero(almacen, confirmador, usuarios, movimientos, usuario):
     monto = input("Monto a ingresar: ").strip()
     try:
-        valor = float(monto)
+        valor = helpers.leer_monto(monto)
     except ValueError:
         print("Monto inválido.")
         return
     if valor <= 0:
         print("El monto debe ser positivo.")
         return
-    usuarios[usuario]["saldo"] += valor
-    helpers.guardar_usuarios(usuarios)
     fecha = datetime.date.today().strftime("%d/%m/%Y")
-    saldo_actual = helpers.formatear_monto(usuarios[usuario]["saldo"])
-    helpers.registrar_movimiento(
-        movimientos,
-        usuario,
-        fecha,
-        "Ingreso de dinero",
-        helpers.formatear_monto(valor),
-        saldo_actual,
+    saldo = transacciones.mover_saldo(
+        almacen, confirmador, usuarios, movimientos, usuario, valor, "Ingreso de dinero", fecha
     )
-    print("Saldo actualizado:", saldo_actual)
+    print("Saldo actualizado:", helpers.formatear_monto(saldo))
 
 
-def pagar_servicio(usuarios, tarjetas, servicios, movimientos, usuario):
+def elegir_servicio(almacen, servicios):
+    # Con el código se elige directo; con parte del nombre se muestran solo
+    # las coincidencias en lugar del catálogo completo.
+    while True:
+        texto = input("Código o nombre del servicio (ENTER para cancelar): ").strip()
+        if not texto:
+            return None
+        servicio = almacen.buscar_servicio(servicios, texto)
+        if servicio is not None:
+            return servicio
+        encontrados = almacen.buscar_servicios(servicios, texto, SERVICIOS_POR_BUSQUEDA)
+        if not encontrados:
+            print("Servicio inexistente.")
+            continue
+        for servicio in encontrados:
+            codigo = servicio.get("codigo", "")
+            nombre = servicio.get("nombre", "")
+            monto = helpers.formatear_monto(servicio.get("monto", "0"))
+            print(f"{codigo} - {nombre} ({monto})")
+
+
+def pagar_servicio(almacen, confirmador, usuarios, tarjetas, servicios, movimientos, usuario):
     tarjetas_usuario = helpers.obtener_tarjetas_usuario(tarjetas, usuario)
     if not tarjetas_usuario:
         print("Debe registrar al menos una tarjeta.")
@@ -138,29 +192,16 @@ def pagar_servicio(usuarios, tarjetas, servicios, movimientos, usuario):
     for tarjeta in tarjetas_usuario:
         print("-", tarjeta.get("alias", ""))
     alias = input("Seleccione tarjeta por alias: ").strip()
-    tarjeta_elegida = None
-    for tarjeta in tarjetas_usuario:
-        if tarjeta.get("alias") == alias:
-            tarjeta_elegida = tarjeta
-            break
-    if tarjeta_elegida is None:
+    if helpers.obtener_tarjeta(tarjetas, usuario, alias) is None:
         print("Tarjeta no encontrada.")
         return
-    print("Servicios disponibles:")
-    for servicio in servicios:
-        codigo = servicio.get("codigo", "")
-        nombre = servicio.get("nombre", "")
-        monto = helpers.formatear_monto(servicio.get("monto", "0"))
-        print(f"{codigo} - {nombre} ({monto})")
-    codigo = input("Código del servicio: ").strip()
-    servicio = helpers.buscar_servicio(servicios, codigo)
+    servicio = elegir_servicio(almacen, servicios)
     if servicio is None:
-        print("Servicio inexistente.")
         return
     monto_str = input("Monto a pagar (ENTER para sugerido): ").strip()
     if monto_str:
         try:
-            monto = float(monto_str)
+            monto = helpers.leer_monto(monto_str)
         except ValueError:
             print("Monto inválido.")
             return
@@ -169,83 +210,266 @@ def pagar_servicio(usuarios, tarjetas, servicios, movimientos, usuario):
             monto = float(servicio.get("monto", "0"))
         except ValueError:
             monto = 0.0
-    saldo_actual = usuarios[usuario]["saldo"]
-    if monto > saldo_actual:
-        print("Saldo insuficiente.")
-        return
-    usuarios[usuario]["saldo"] = saldo_actual - monto
-    helpers.guardar_usuarios(usuarios)
     fecha = datetime.date.today().strftime("%d/%m/%Y")
-    helpers.registrar_movimiento(
-        movimientos,
-        usuario,
-        fecha,
-        f"Pago {servicio.get('nombre', '')}",
-        helpers.formatear_monto(monto),
-        helpers.formatear_monto(usuarios[usuario]["saldo"]),
+    saldo = transacciones.mover_saldo(
+        almacen, confirmador, usuarios, movimientos, usuario, -monto, f"Pago {servicio.get('nombre', '')}", fecha
     )
+    if saldo is None:
+        print("Saldo insuficiente.")
+        return
     print("Pago realizado con la tarjeta", alias)
-    print("Saldo actual:", helpers.formatear_monto(usuarios[usuario]["saldo"]))
+    print("Saldo actual:", helpers.formatear_monto(saldo))
+
+
+def mostrar_programados(usuario):
+    pagos = programados.pagos_de(usuario)
+    if not pagos:
+        print("No hay pagos programados.")
+        return
+    for pago in pagos:
+        monto = "sugerido" if pago.monto is None else helpers.formatear_monto(pago.monto)
+        proxima = registros.fecha_texto(pago.proxima)
+        print(f"#{pago.id} | {pago.servicio} | Tarjeta: {pago.alias} | {monto} | {pago.frecuencia} | Próximo: {proxima}")
+
+
+def programar_pago(almacen, tarjetas, servicios, usuario):
+    # Se valida como en pagar_servicio; el saldo se controla recién al pagar.
+    tarjetas_usuario = helpers.obtener_tarjetas_usuario(tarjetas, usuario)
+    if not tarjetas_usuario:
+        print("Debe registrar al menos una tarjeta.")
+        return
+    print("Tarjetas disponibles:")
+    for tarjeta in tarjetas_usuario:
+        print("-", tarjeta.get("alias", ""))
+    alias = input("Seleccione tarjeta por alias: ").strip()
+    if helpers.obtener_tarjeta(tarjetas, usuario, alias) is None:
+        print("Tarjeta no encontrada.")
+        return
+    servicio = elegir_servicio(almacen, servicios)
+    if servicio is None:
+        return
+    monto = None
+    monto_str = input("Monto a pagar (ENTER para el sugerido en cada pago): ").strip()
+    if monto_str:
+        try:
+            monto = helpers.leer_monto(monto_str)
+        except ValueError:
+            print("Monto inválido.")
+            return
+        if monto <= 0:
+            print("El monto debe ser positivo.")
+            return
+    frecuencia = input(f"Frecuencia ({', '.join(programados.FRECUENCIAS)}): ").strip().lower()
+    if frecuencia not in programados.FRECUENCIAS:
+        print("Frecuencia inválida.")
+        return
+    inicio = datetime.date.today()
+    inicio_str = input("Primer pago (DD/MM/AAAA, ENTER para hoy): ").strip()
+    if inicio_str:
+        inicio = programados.leer_dia(inicio_str)
+        if inicio is None:
+            print("Fecha inválida.")
+            return
+    pago = programados.programar_pago(usuario, servicio.get("codigo", ""), alias, monto, frecuencia, inicio)
+    print(f"Pago #{pago.id} programado para el {registros.fecha_texto(pago.proxima)}.")
 
 
-def mostrar_movimientos(movimientos, usuario):
-    lista = movimientos.get(usuario, [])
+def flujo_programados(almacen, carga, usuario):
+    while True:
+        opcion = mostrar_menu_programados()
+        if opcion == "1":
+            mostrar_programados(usuario)
+            pausar()
+        elif opcion == "2":
+            tarjetas = obtener_carga(carga, "tarjetas")
+            servicios = obtener_carga(carga, "servicios")
+            programar_pago(almacen, tarjetas, servicios, usuario)
+            pausar()
+        elif opcion == "3":
+            numero = input("Número del pago a cancelar: ").strip().lstrip("#")
+            if numero.isdigit() and programados.cancelar_pago(usuario, int(numero)):
+                print("Pago cancelado.")
+            else:
+                print("No se encontró el pago.")
+            pausar()
+        elif opcion == "4":
+            break
+        else:
+            print("Opción inválida.")
+
+
+def mostrar_movimiento(movimiento):
+    fecha = registros.fecha_texto(movimiento.fecha)
+    monto = registros.formatear_centavos(movimiento.centavos)
+    saldo = registros.formatear_centavos(movimiento.saldo_centavos)
+    print(f"[{fecha}] {movimiento.concepto} - {monto} (Saldo: {saldo})")
+
+
+def pedir_fecha(mensaje):
+    # Devuelve (ok, fecha); ENTER deja la fecha en None (sin límite).
+    texto = input(mensaje).strip()
+    if not texto:
+        return True, None
+    fecha = registros.fecha_desde_texto(texto)
+    if not isinstance(fecha, datetime.date):
+        print("Fecha inválida.")
+        return False, None
+    return True, fecha
+
+
+def pedir_monto(mensaje):
+    texto = input(mensaje).strip()
+    if not texto:
+        return True, None
+    try:
+        return True, helpers.leer_monto(texto)
+    except ValueError:
+        print("Monto inválido.")
+        return False, None
+
+
+def buscar_movimientos(almacen, usuario):
+    ok, desde = pedir_fecha("Desde (DD/MM/AAAA, ENTER sin límite): ")
+    if not ok:
+        return
+    ok, hasta = pedir_fecha("Hasta (DD/MM/AAAA, ENTER sin límite): ")
+    if not ok:
+        return
+    tipo = input("Tipo (ingreso, pago; ENTER para todos): ").strip()
+    ok, minimo = pedir_monto("Monto mínimo (ENTER sin límite): ")
+    if not ok:
+        return
+    ok, maximo = pedir_monto("Monto máximo (ENTER sin límite): ")
+    if not ok:
+        return
+    lista = almacen.buscar_movimientos(usuario, desde, hasta, tipo, minimo, maximo)
     if not lista:
-        print("No hay movimientos registrados.")
+        print("No hay movimientos que coincidan.")
         return
+    print(f"\n--- Movimientos encontrados: {len(lista)} (del más antiguo al más reciente) ---")
     for movimiento in lista:
-        fecha = movimiento.get("fecha", "")
-        concepto = movimiento.get("concepto", "")
-        monto = movimiento.get("monto", "")
-        saldo = movimiento.get("saldo", "")
-        print(f"[{fecha}] {concepto} - {monto} (Saldo: {saldo})")
+        mostrar_movimiento(movimiento)
 
 
-def cambiar_clave(usuarios, usuario):
+def mostrar_movimientos(almacen, usuario):
+    pagina = 0
+    while True:
+        lista, hay_siguiente = almacen.leer_pagina_movimientos(usuario, pagina, MOVIMIENTOS_POR_PAGINA)
+        if not lista and pagina == 0:
+            print("No hay movimientos registrados.")
+            return
+        print(f"\n--- Movimientos (página {pagina + 1}, más recientes primero) ---")
+        for movimiento in lista:
+            mostrar_movimiento(movimiento)
+        opciones = []
+        if hay_siguiente:
+            opciones.append("S. Siguiente")
+        if pagina > 0:
+            opciones.append("A. Anterior")
+        opciones.append("ENTER. Volver")
+        opcion = input(" | ".join(opciones) + ": ").strip().lower()
+        if opcion == "s" and hay_siguiente:
+            pagina += 1
+        elif opcion == "a" and pagina > 0:
+            pagina -= 1
+        elif not opcion:
+            return
+        else:
+            print("Opción inválida.")
+
+
+def cambiar_clave(almacen, usuarios, usuario):
     actual = input("Contraseña actual: ").strip()
-    if usuarios[usuario]["clave"] != actual:
+    if not helpers.clave_correcta(usuarios[usuario], actual):
         print("Contraseña incorrecta.")
         return
     nueva = input("Nueva contraseña: ").strip()
     if not nueva:
         print("Debe ingresar una contraseña válida.")
         return
-    usuarios[usuario]["clave"] = nueva
-    helpers.guardar_usuarios(usuarios)
+    with bloqueos.bloquear_usuario(usuario):
+        almacen.refrescar_usuario(usuarios, usuario)
+        usuarios[usuario]["clave"] = seguridad.hash_password(nueva)
+        almacen.guardar_usuario(usuarios, usuario)
     print("Contraseña actualizada.")
 
 
-def principal():
-    helpers.inicializar_archivos()
-    usuarios = helpers.leer_usuarios()
-    tarjetas = helpers.leer_tarjetas()
-    movimientos = helpers.leer_movimientos()
-    servicios = helpers.leer_servicios()
-    usuario = iniciar_sesion(usuarios)
+# ---------------- Carga diferida ----------------
+
+# Antes de la primera pantalla no se lee ningún archivo: los usuarios se cargan
+# al iniciar sesión (refrescar_usuario) y las tarjetas y los servicios la
+# primera vez que un menú los pide, o antes si un hilo los precarga.
+
+def crear_carga(almacen):
+    return {"almacen": almacen, "datos": {}, "bloqueo": threading.Lock()}
+
+
+def obtener_carga(carga, nombre):
+    with carga["bloqueo"]:
+        if nombre not in carga["datos"]:
+            carga["datos"][nombre] = getattr(carga["almacen"], "leer_" + nombre)()
+        return carga["datos"][nombre]
+
+
+def precargar(carga, nombres):
+    def leer():
+        for nombre in nombres:
+            obtener_carga(carga, nombre)
+
+    hilo = threading.Thread(target=leer, name="precarga", daemon=True)
+    hilo.start()
+    return hilo
+
+
+def principal(almacen=helpers, precarga=True):
+    if almacen is helpers:
+        helpers.inicializar_archivos()
+    usuarios = {}
+    usuario = iniciar_sesion(almacen, usuarios)
     if usuario is None:
         print("Hasta luego.")
         return
+    carga = crear_carga(almacen)
+    if precarga:
+        precargar(carga, ["tarjetas", "servicios"])
+    # El historial se lee del diario página por página al mostrarlo.
+    movimientos = {}
+    confirmador = transacciones.CommitGrupal(almacen)
+    try:
+        menu_principal(almacen, confirmador, usuarios, carga, movimientos, usuario)
+    finally:
+        confirmador.cerrar()
+
+
+def menu_principal(almacen, confirmador, usuarios, carga, movimientos, usuario):
     while True:
         opcion = mostrar_menu()
         if opcion == "1":
+            almacen.refrescar_usuario(usuarios, usuario)
             saldo = helpers.formatear_monto(usuarios[usuario]["saldo"])
             print("Saldo disponible:", saldo)
             pausar()
         elif opcion == "2":
-            ingresar_dinero(usuarios, movimientos, usuario)
+            ingresar_dinero(almacen, confirmador, usuarios, movimientos, usuario)
             pausar()
         elif opcion == "3":
-            flujo_tarjetas(tarjetas, usuario)
+            flujo_tarjetas(almacen, obtener_carga(carga, "tarjetas"), usuario)
         elif opcion == "4":
-            pagar_servicio(usuarios, tarjetas, servicios, movimientos, usuario)
+            tarjetas = obtener_carga(carga, "tarjetas")
+            servicios = obtener_carga(carga, "servicios")
+            pagar_servicio(almacen, confirmador, usuarios, tarjetas, servicios, movimientos, usuario)
             pausar()
         elif opcion == "5":
-            mostrar_movimientos(movimientos, usuario)
-            pausar()
+            mostrar_movimientos(almacen, usuario)
         elif opcion == "6":
-            cambiar_clave(usuarios, usuario)
+            cambiar_clave(almacen, usuarios, usuario)
             pausar()
         elif opcion == "7":
+            flujo_programados(almacen, carga, usuario)
+        elif opcion == "8":
+            buscar_movimientos(almacen, usuario)
+            pausar()
+        elif opcion == "9":
             print("Hasta luego.")
             break
         else:
@@ -253,5 +477,55 @@ def principal():
             pausar()
 
 
+def leer_argumentos():
+    parser = argparse.ArgumentParser(description="Billetera virtual Kiwillet.")
+    parser.add_argument("--sqlite", metavar="RUTA", help="usar una base SQLite en lugar de los archivos .txt")
+    parser.add_argument(
+        "--sin-precarga", action="store_true", help="no leer tarjetas y servicios en segundo plano tras iniciar sesión"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="al salir, mostrar llamadas, tiempo, bytes y filas de cada operación"
+    )
+    parser.add_argument("--cprofile", metavar="RUTA", help="guardar las estadísticas de cProfile de la sesión en RUTA")
+    return parser.parse_args()
+
+
+def ejecutar(argumentos):
+    if argumentos.sqlite:
+        from repositorio import RepositorioSQLite
+
+        almacen = RepositorioSQLite(argumentos.sqlite)
+        try:
+            principal(almacen, precarga=not argumentos.sin_precarga)
+        finally:
+            almacen.cerrar()
+    else:
+        principal(precarga=not argumentos.sin_precarga)
+
+
+# ---------------- Perfil ----------------
+
+# Las operaciones de archivos siempre se cuentan en metricas; --profile solo
+# decide si se muestra el resumen. cProfile sí cuesta, así que se activa
+# únicamente con --cprofile.
+
+def ejecutar_con_perfil(argumentos):
+    perfil = None
+    if argumentos.cprofile:
+        import cProfile
+
+        perfil = cProfile.Profile()
+        perfil.enable()
+    try:
+        ejecutar(argumentos)
+    finally:
+        if perfil is not None:
+            perfil.disable()
+            perfil.dump_stats(argumentos.cprofile)
+            print(f"Estadísticas de cProfile en {argumentos.cprofile} (python -m pstats {argumentos.cprofile})")
+        if argumentos.profile:
+            print("\n" + metricas.resumen())
+
+
 if __name__ == "__main__":
-    principal()
+    ejecutar_con_perfil(leer_argumentos())
@@ -0,0 +1,108 @@
+"""Contadores y tiempos de las operaciones de almacenamiento de la billetera.
+
+Cada lectura o escritura de archivos (``helpers``, ``io_archivos``, la
+bitácora), el hashing de contraseñas, la recarga del catálogo y la generación
+de reportes se registran con :func:`medir` bajo un nombre como
+``helpers.agregar_movimientos``: cantidad de llamadas, tiempo total y máximo,
+bytes y filas. Registrar cuesta un par de ``perf_counter`` y un bloqueo, así
+que está siempre activo.
+
+:func:`instantanea` devuelve los valores acumulados (la usan
+``benchmarks/operaciones.py`` y ``GET /metricas`` del servidor) y
+:func:`resumen` los arma como tabla para ``python main.py --profile``.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# nombre -> [llamadas, segundos, máximo, bytes, filas]
+_valores: Dict[str, List[float]] = {}
+_bloqueo = threading.Lock()
+
+
+def registrar(nombre: str, segundos: float, bytes_: int = 0, filas: int = 0) -> None:
+    """Add one call of *nombre* that took *segundos* and moved *bytes_* and *filas*."""
+    with _bloqueo:
+        valores = _valores.get(nombre)
+        if valores is None:
+            _valores[nombre] = [1, segundos, segundos, bytes_, filas]
+            return
+        valores[0] += 1
+        valores[1] += segundos
+        if segundos > valores[2]:
+            valores[2] = segundos
+        valores[3] += bytes_
+        valores[4] += filas
+
+
+class Medicion:
+    """Context manager that times its block; set ``bytes`` and ``filas`` inside it."""
+
+    __slots__ = ("nombre", "bytes", "filas", "_inicio")
+
+    def __init__(self, nombre: str) -> None:
+        self.nombre = nombre
+        self.bytes = 0
+        self.filas = 0
+
+    def __enter__(self) -> "Medicion":
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *excepcion: Any) -> None:
+        registrar(self.nombre, time.perf_counter() - self._inicio, self.bytes, self.filas)
+
+
+def medir(nombre: str) -> Medicion:
+    return Medicion(nombre)
+
+
+def instrumentar(nombre: str) -> Callable[[F], F]:
+    """Decorator that records every call of the function under *nombre*."""
+
+    def decorar(funcion: F) -> F:
+        @wraps(funcion)
+        def envoltura(*argumentos: Any, **opciones: Any) -> Any:
+            inicio = time.perf_counter()
+            try:
+                return funcion(*argumentos, **opciones)
+            finally:
+                registrar(nombre, time.perf_counter() - inicio)
+
+        return envoltura  # type: ignore[return-value]
+
+    return decorar
+
+
+def instantanea() -> Dict[str, Dict[str, float]]:
+    """Return a copy of every counter: calls, total and max seconds, bytes and rows."""
+    with _bloqueo:
+        return {
+            nombre: {"llamadas": int(v[0]), "segundos": v[1], "maximo": v[2], "bytes": int(v[3]), "filas": int(v[4])}
+            for nombre, v in _valores.items()
+        }
+
+
+def reiniciar() -> None:
+    with _bloqueo:
+        _valores.clear()
+
+
+def resumen(valores: Optional[Dict[str, Dict[str, float]]] = None) -> str:
+    """Format the counters as a table sorted by total time."""
+    valores = instantanea() if valores is None else valores
+    if not valores:
+        return "Sin operaciones registradas."
+    lineas = [f"{'operación':<34} {'llamadas':>9} {'total ms':>10} {'media ms':>9} {'máx ms':>9} {'filas':>9} {'KB':>10}"]
+    for nombre, datos in sorted(valores.items(), key=lambda par: par[1]["segundos"], reverse=True):
+        llamadas = datos["llamadas"]
+        lineas.append(
+            f"{nombre:<34} {llamadas:>9} {datos['segundos'] * 1000:>10.2f} {datos['segundos'] * 1000 / llamadas:>9.3f} "
+            f"{datos['maximo'] * 1000:>9.3f} {datos['filas']:>9} {datos['bytes'] / 1024:>10.1f}"
+        )
+    return "\n".join(lineas)
@@ -0,0 +1,384 @@
+"""Migración entre el formato txt de la consola y el formato JSON/CSV de los servicios.
+
+La consola (``helpers.py``) guarda todo en ``usuarios.txt``, ``tarjetas.txt``
+y ``movimientos.txt`` (cada uno con su WAL, salvo el diario); los servicios
+(``usuarios.py``, ``tarjetas.py``, ``movimientos.py``) usan
+``data/usuarios.json`` y un CSV de tarjetas y otro de movimientos por usuario.
+Este módulo convierte en ambos sentidos sin cargar el historial en memoria:
+
+* los archivos se recorren con generadores, línea por línea u objeto por objeto;
+* el diario se reparte en los CSV por usuario acumulando a lo sumo
+  ``FILAS_EN_MEMORIA`` filas y volcándolas con un solo archivo abierto a la vez;
+* las claves en texto plano de ``usuarios.txt`` se guardan como
+  ``seguridad.hash_password``, calculado en un ``seguridad.PoolClaves`` con
+  hasta ``CLAVES_EN_VUELO`` hashes pendientes; al volver a txt queda el hash,
+  que la consola también acepta (``helpers.clave_correcta``);
+* las fechas pasan al formato de cada lado: ``AAAA-MM-DD HH:MM:SS`` en los
+  CSV (medianoche si el diario no tenía hora) y ``DD/MM/AAAA`` en el diario,
+  que es lo que esperan ``analitica`` y ``reportes``.
+
+Las tarjetas sí se arman en memoria (una baja del WAL puede anular un alta
+anterior), pero son pocas frente al historial. Al terminar se informa cuántos
+registros y bytes se procesaron por segundo. Conviene migrar con la billetera
+detenida: los archivos de destino se reemplazan.
+
+Uso: python migracion.py a-datos [--txt .] [--datos data]
+     python migracion.py a-txt [--datos data] [--txt .]
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+import helpers
+import seguridad
+from io_archivos import DATA_DIR, asegurar_directorio, cache_lecturas, escribir_csv
+from movimientos import CAMPOS_MOVIMIENTO
+from registros import concepto_consola, fecha_consola, fecha_iso, texto_centavos, tipo_y_descripcion
+from tarjetas import CAMPOS_TARJETA
+
+FILAS_EN_MEMORIA = 50_000
+TAMANIO_BLOQUE = 64 * 1024
+CLAVES_EN_VUELO = 64
+
+_SEPARADORES = re.compile(r"[\s,]*")
+
+
+@dataclass
+class Resultado:
+    """Records and source bytes converted by one step, and how long it took."""
+
+    nombre: str
+    registros: int = 0
+    bytes: int = 0
+    segundos: float = 0.0
+
+    def __str__(self) -> str:
+        segundos = max(self.segundos, 1e-9)
+        return (
+            f"{self.nombre}: {self.registros} registros, {self.bytes / 1e6:.1f} MB en {self.segundos:.2f} s "
+            f"({self.registros / segundos:.0f} registros/s, {self.bytes / 1e6 / segundos:.1f} MB/s)"
+        )
+
+
+def _tamanio(*rutas: Path) -> int:
+    return sum(ruta.stat().st_size for ruta in rutas if ruta.exists())
+
+
+def _reemplazar(temporal: Path, destino: Path) -> None:
+    os.replace(temporal, destino)
+    cache_lecturas.invalidar(destino)
+
+
+def _hash_clave(claves: seguridad.PoolClaves, clave: str) -> "Future[str]":
+    # Una clave que ya es un hash (vino de una migración anterior) se conserva.
+    if seguridad.parece_hash(clave):
+        listo: "Future[str]" = Future()
+        listo.set_result(clave)
+        return listo
+    return claves.hashear(clave)
+
+
+def objetos_json(ruta: Path, bloque: int = TAMANIO_BLOQUE) -> Iterator[Any]:
+    """Yield the elements of the JSON array stored in *ruta*, reading it in blocks."""
+    if not ruta.exists():
+        return
+    decodificador = json.JSONDecoder()
+    with ruta.open("r", encoding="utf-8") as archivo:
+        pendiente = archivo.read(bloque).lstrip()
+        if not pendiente:
+            return
+        if not pendiente.startswith("["):
+            raise ValueError(f"{ruta} no contiene una lista JSON.")
+        posicion = 1
+        fin = False
+        while True:
+            posicion = _SEPARADORES.match(pendiente, posicion).end()
+            if pendiente.startswith("]", posicion):
+                return
+            try:
+                valor, posicion = decodificador.raw_decode(pendiente, posicion)
+            except json.JSONDecodeError:
+                # El elemento sigue en el próximo bloque.
+                if fin:
+                    raise
+                leido = archivo.read(bloque)
+                fin = not leido
+                pendiente = pendiente[posicion:] + leido
+                posicion = 0
+                continue
+            yield valor
+
+
+class RepartidorCSV:
+    """Split rows into one CSV per user keeping at most *limite* rows in memory.
+
+    When the limit is reached every pending user file is appended to (one
+    file open at a time). The first write of each user truncates the file and
+    writes the header.
+    """
+
+    def __init__(self, directorio: Path, campos: List[str], prefijo: str, limite: int = FILAS_EN_MEMORIA) -> None:
+        self.directorio = directorio
+        self.campos = campos
+        self.prefijo = prefijo
+        self.limite = limite
+        self.archivos = 0
+        self._pendientes: Dict[str, List[Tuple[str, ...]]] = {}
+        self._cantidad = 0
+        self._iniciados: Set[str] = set()
+
+    def agregar(self, usuario: str, fila: Tuple[str, ...]) -> None:
+        self._pendientes.setdefault(usuario, []).append(fila)
+        self._cantidad += 1
+        if self._cantidad >= self.limite:
+            self.volcar()
+
+    def volcar(self) -> None:
+        asegurar_directorio(self.directorio)
+        for usuario, filas in self._pendientes.items():
+            ruta = self.directorio / f"{self.prefijo}_{usuario}.csv"
+            nuevo = usuario not in self._iniciados
+            with ruta.open("w" if nuevo else "a", encoding="utf-8", newline="") as archivo:
+                escritor = csv.writer(archivo)
+                if nuevo:
+                    escritor.writerow(self.campos)
+                    self._iniciados.add(usuario)
+                    self.archivos += 1
+                escritor.writerows(filas)
+            cache_lecturas.invalidar(ruta)
+        self._pendientes = {}
+        self._cantidad = 0
+
+
+# ---------------- De txt a JSON/CSV ----------------
+
+
+def usuarios_a_datos(txt: Path, datos: Path) -> Resultado:
+    """Write ``usuarios.txt`` as ``usuarios.json`` and its WAL as the JSON WAL, hashing the passwords."""
+    resultado = Resultado("usuarios")
+    instantanea = txt / helpers.USUARIOS_ARCHIVO
+    wal = txt / helpers.USUARIOS_WAL
+    inicio = time.perf_counter()
+    asegurar_directorio(datos)
+
+    def entradas(registros: Iterable[Tuple[str, Dict[str, Any]]]) -> Iterator[str]:
+        # Los hashes se calculan en paralelo; se escriben en el orden de lectura.
+        pendientes: "deque[Tuple[str, float, Future[str]]]" = deque()
+        for nombre, valores in registros:
+            resultado.registros += 1
+            pendientes.append((nombre, valores["saldo"], _hash_clave(claves, valores["clave"])))
+            if len(pendientes) >= CLAVES_EN_VUELO:
+                yield texto_entrada(*pendientes.popleft())
+        while pendientes:
+            yield texto_entrada(*pendientes.popleft())
+
+    def texto_entrada(nombre: str, saldo: float, password_hash: "Future[str]") -> str:
+        entrada = {"usuario": nombre, "password_hash": password_hash.result(), "saldo": saldo}
+        return json.dumps(entrada, ensure_ascii=False, separators=(",", ":"))
+
+    # La instantánea va a la instantánea y el WAL al WAL: el orden en que se
+    # aplican, y por lo tanto qué dato de cada usuario gana, no cambia.
+    claves = seguridad.PoolClaves()
+    try:
+        temporal = datos / "usuarios.json.tmp"
+        with temporal.open("w", encoding="utf-8") as archivo:
+            archivo.write("[")
+            for numero, texto in enumerate(entradas(helpers.iterar_usuarios(str(instantanea)))):
+                archivo.write(("," if numero else "") + texto)
+            archivo.write("]")
+        _reemplazar(temporal, datos / "usuarios.json")
+        temporal = datos / "usuarios.wal.tmp"
+        with temporal.open("w", encoding="utf-8") as archivo:
+            for texto in entradas(helpers.iterar_usuarios(str(wal), solo_completas=True)):
+                archivo.write(texto + "\n")
+        _reemplazar(temporal, datos / "usuarios.wal")
+    finally:
+        claves.cerrar()
+    resultado.bytes = _tamanio(instantanea, wal)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def tarjetas_a_datos(txt: Path, datos: Path) -> Resultado:
+    """Write the cards of ``tarjetas.txt`` and its WAL as one ``tarjetas_{usuario}.csv`` per user."""
+    resultado = Resultado("tarjetas")
+    instantanea = txt / helpers.TARJETAS_ARCHIVO
+    wal = txt / helpers.TARJETAS_WAL
+    inicio = time.perf_counter()
+    for usuario, por_alias in helpers.leer_tarjetas_de(str(instantanea), str(wal)).items():
+        if not por_alias:
+            continue
+        filas = [
+            {
+                "id": tarjeta["alias"],
+                "tipo": tarjeta["tipo"],
+                "entidad": "",
+                "numero": tarjeta["numero"],
+                "vencimiento": tarjeta["vencimiento"],
+            }
+            for tarjeta in por_alias.values()
+        ]
+        escribir_csv(datos / f"tarjetas_{usuario}.csv", CAMPOS_TARJETA, filas)
+        resultado.registros += len(filas)
+    resultado.bytes = _tamanio(instantanea, wal)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def movimientos_a_datos(txt: Path, datos: Path, limite: int = FILAS_EN_MEMORIA) -> Resultado:
+    """Split ``movimientos.txt`` into one ``movimientos_{usuario}.csv`` per user."""
+    resultado = Resultado("movimientos")
+    diario = txt / helpers.MOVIMIENTOS_ARCHIVO
+    inicio = time.perf_counter()
+    repartidor = RepartidorCSV(datos, CAMPOS_MOVIMIENTO, "movimientos", limite)
+    for usuario, movimiento in helpers.iterar_movimientos(str(diario)):
+        tipo, descripcion = tipo_y_descripcion(movimiento.concepto)
+        fila = (
+            fecha_iso(movimiento.fecha),
+            tipo,
+            descripcion,
+            texto_centavos(movimiento.centavos),
+            texto_centavos(movimiento.saldo_centavos),
+        )
+        repartidor.agregar(usuario, fila)
+        resultado.registros += 1
+    repartidor.volcar()
+    resultado.bytes = _tamanio(diario)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def txt_a_datos(txt: Path, datos: Path, limite: int = FILAS_EN_MEMORIA) -> List[Resultado]:
+    return [usuarios_a_datos(txt, datos), tarjetas_a_datos(txt, datos), movimientos_a_datos(txt, datos, limite)]
+
+
+# ---------------- De JSON/CSV a txt ----------------
+
+
+def _filas_csv(ruta: Path) -> Iterator[Dict[str, str]]:
+    # A diferencia de io_archivos.leer_csv, no arma la lista completa.
+    with ruta.open("r", encoding="utf-8", newline="") as archivo:
+        yield from csv.DictReader(archivo)
+
+
+def _por_usuario(datos: Path, prefijo: str) -> Iterator[Tuple[str, Path]]:
+    for ruta in sorted(datos.glob(f"{prefijo}_*.csv")):
+        yield ruta.stem[len(prefijo) + 1 :], ruta
+
+
+def usuarios_a_txt(datos: Path, txt: Path) -> Resultado:
+    """Write ``usuarios.json`` and its WAL as ``usuarios.txt`` and its WAL (the hash becomes the password)."""
+    resultado = Resultado("usuarios")
+    instantanea = datos / "usuarios.json"
+    wal = datos / "usuarios.wal"
+    inicio = time.perf_counter()
+
+    def escribir(entradas: Iterable[Dict[str, Any]], destino: Path) -> None:
+        temporal = destino.with_name(destino.name + ".tmp")
+        with temporal.open("w", encoding="utf-8") as archivo:
+            for entrada in entradas:
+                nombre = entrada.get("usuario", "")
+                if not nombre:
+                    continue
+                archivo.write(f"{nombre};{entrada.get('password_hash', '')};{float(entrada.get('saldo', 0.0))}\n")
+                resultado.registros += 1
+        os.replace(temporal, destino)
+
+    def entradas_wal() -> Iterator[Dict[str, Any]]:
+        if not wal.exists():
+            return
+        with wal.open("r", encoding="utf-8") as archivo:
+            for linea in archivo:
+                try:
+                    yield json.loads(linea)
+                except json.JSONDecodeError:
+                    continue
+
+    escribir(objetos_json(instantanea), txt / helpers.USUARIOS_ARCHIVO)
+    escribir(entradas_wal(), txt / helpers.USUARIOS_WAL)
+    resultado.bytes = _tamanio(instantanea, wal)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def tarjetas_a_txt(datos: Path, txt: Path) -> Resultado:
+    """Write every ``tarjetas_{usuario}.csv`` into ``tarjetas.txt`` and empty its WAL."""
+    resultado = Resultado("tarjetas")
+    inicio = time.perf_counter()
+    destino = txt / helpers.TARJETAS_ARCHIVO
+    temporal = destino.with_name(destino.name + ".tmp")
+    with temporal.open("w", encoding="utf-8") as archivo:
+        for usuario, ruta in _por_usuario(datos, "tarjetas"):
+            resultado.bytes += ruta.stat().st_size
+            for fila in _filas_csv(ruta):
+                # La entidad no tiene lugar en tarjetas.txt y se pierde.
+                archivo.write(f"{usuario};{fila['id']};{fila['numero']};{fila['tipo']};{fila['vencimiento']}\n")
+                resultado.registros += 1
+    os.replace(temporal, destino)
+    (txt / helpers.TARJETAS_WAL).write_text("", encoding="utf-8")
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def movimientos_a_txt(datos: Path, txt: Path) -> Resultado:
+    """Write every ``movimientos_{usuario}.csv`` into ``movimientos.txt``, grouped by user.
+
+    If *txt* is the console's working directory the journal is replaced through
+    ``helpers.reemplazar_movimientos`` so its index is rebuilt.
+    """
+    resultado = Resultado("movimientos")
+    inicio = time.perf_counter()
+    destino = txt / helpers.MOVIMIENTOS_ARCHIVO
+    temporal = destino.with_name(destino.name + ".tmp")
+    with temporal.open("w", encoding="utf-8") as archivo:
+        for usuario, ruta in _por_usuario(datos, "movimientos"):
+            resultado.bytes += ruta.stat().st_size
+            for fila in _filas_csv(ruta):
+                concepto = concepto_consola(fila.get("tipo") or "", fila.get("descripcion") or "")
+                fecha = fecha_consola(fila.get("fecha") or "")
+                archivo.write(f"{usuario};{fecha};{concepto};${fila['monto']};${fila['saldo_resultante']}\n")
+                resultado.registros += 1
+    if destino.resolve() == Path(helpers.MOVIMIENTOS_ARCHIVO).resolve():
+        helpers.reemplazar_movimientos(str(temporal))
+    else:
+        os.replace(temporal, destino)
+    resultado.segundos = time.perf_counter() - inicio
+    return resultado
+
+
+def datos_a_txt(datos: Path, txt: Path) -> List[Resultado]:
+    asegurar_directorio(txt)
+    return [usuarios_a_txt(datos, txt), tarjetas_a_txt(datos, txt), movimientos_a_txt(datos, txt)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migra la billetera entre el formato txt y el formato JSON/CSV.")
+    parser.add_argument("sentido", choices=["a-datos", "a-txt"], help="a-datos: txt -> JSON/CSV; a-txt: al revés")
+    parser.add_argument("--txt", type=Path, default=Path("."), help="carpeta de usuarios.txt, tarjetas.txt, ...")
+    parser.add_argument("--datos", type=Path, default=DATA_DIR, help="carpeta de usuarios.json y los CSV")
+    parser.add_argument(
+        "--filas-en-memoria", type=int, default=FILAS_EN_MEMORIA, help="movimientos acumulados antes de volcarlos"
+    )
+    argumentos = parser.parse_args()
+    inicio = time.perf_counter()
+    if argumentos.sentido == "a-datos":
+        resultados = txt_a_datos(argumentos.txt, argumentos.datos, max(1, argumentos.filas_en_memoria))
+    else:
+        resultados = datos_a_txt(argumentos.datos, argumentos.txt)
+    for resultado in resultados:
+        print(resultado)
+    print(f"Total: {time.perf_counter() - inicio:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
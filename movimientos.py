@@ -1,92 +1,178 @@
-"""Registro de movimientos y generación de reportes estadísticos."""
+"""Registro de movimientos y generación de reportes estadísticos.
+
+Junto a cada ``movimientos_{usuario}.csv`` se guarda
+``movimientos_{usuario}.estadisticas.json`` con los acumulados que necesita el
+reporte (cantidad, suma de saldos, ingresos, gastos y pagos por servicio).
+``registrar_movimiento`` los actualiza con cada movimiento, así que el reporte
+no recorre el historial; solo se recalculan si faltan o no corresponden al CSV.
+"""
 from __future__ import annotations
 
-from collections import Counter
 from datetime import datetime
-from statistics import mean
-from typing import Dict, Iterable, List
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
 
-from io_archivos import escribir_csv, leer_csv, ruta_datos, ruta_reporte
+from io_archivos import escribir_csv, escribir_json, leer_csv, leer_json, ruta_datos, ruta_reporte
 from logger import registrar_evento
+from metricas import instrumentar
+from registros import Movimiento, a_centavos, desde_texto, fecha_texto, texto_centavos
 
 CAMPOS_MOVIMIENTO = ["fecha", "tipo", "descripcion", "monto", "saldo_resultante"]
+VERSION_ESTADISTICAS = 2
 
 
-def _ruta_movimientos(usuario: str):
+def _ruta_movimientos(usuario: str) -> Path:
     return ruta_datos(f"movimientos_{usuario}.csv")
 
 
-def cargar_movimientos(usuario: str) -> List[Dict[str, str]]:
-    return leer_csv(_ruta_movimientos(usuario))
+def _ruta_estadisticas(usuario: str) -> Path:
+    return ruta_datos(f"movimientos_{usuario}.estadisticas.json")
 
 
-def guardar_movimientos(usuario: str, movimientos: List[Dict[str, str]]) -> None:
-    escribir_csv(_ruta_movimientos(usuario), CAMPOS_MOVIMIENTO, movimientos)
+def a_fila(movimiento: Movimiento) -> Dict[str, str]:
+    """Return *movimiento* as a CSV/JSON row with the ``CAMPOS_MOVIMIENTO`` keys."""
+    return {
+        "fecha": fecha_texto(movimiento.fecha),
+        "tipo": movimiento.tipo,
+        "descripcion": movimiento.concepto,
+        "monto": texto_centavos(movimiento.centavos),
+        "saldo_resultante": texto_centavos(movimiento.saldo_centavos),
+    }
+
+
+def desde_fila(fila: Dict[str, str]) -> Movimiento:
+    """Build a :class:`Movimiento` from a row with the ``CAMPOS_MOVIMIENTO`` keys."""
+    return desde_texto(
+        fila.get("fecha") or "",
+        fila.get("descripcion") or "",
+        fila.get("monto") or "",
+        fila.get("saldo_resultante") or "",
+        fila.get("tipo") or "",
+    )
+
+
+def cargar_movimientos(usuario: str) -> List[Movimiento]:
+    return [desde_fila(fila) for fila in leer_csv(_ruta_movimientos(usuario))]
+
+
+def guardar_movimientos(usuario: str, movimientos: List[Movimiento]) -> None:
+    escribir_csv(_ruta_movimientos(usuario), CAMPOS_MOVIMIENTO, (a_fila(movimiento) for movimiento in movimientos))
 
 
 def registrar_movimiento(
     usuario: str,
-    movimientos: List[Dict[str, str]],
+    movimientos: List[Movimiento],
     tipo: str,
     descripcion: str,
     monto: float,
     saldo_resultante: float,
 ) -> None:
-    entrada = {
-        "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "tipo": tipo,
-        "descripcion": descripcion,
-        "monto": f"{monto:.2f}",
-        "saldo_resultante": f"{saldo_resultante:.2f}",
-    }
+    entrada = Movimiento(
+        datetime.now().replace(microsecond=0), descripcion, a_centavos(monto), a_centavos(saldo_resultante), tipo
+    )
+    agregados = _leer_agregados(usuario)
     movimientos.append(entrada)
+    if agregados is not None and agregados["cantidad"] == len(movimientos) - 1:
+        _acumular(agregados, entrada)
+    else:
+        agregados = calcular_agregados(movimientos)
     guardar_movimientos(usuario, movimientos)
+    _guardar_agregados(usuario, agregados)
     registrar_evento("movimiento", f"{usuario}:{tipo}:{monto:.2f}")
 
 
-def _valores_float(movimientos: Iterable[Dict[str, str]], campo: str) -> List[float]:
-    valores: List[float] = []
+def _agregados_vacios() -> Dict[str, Any]:
+    return {
+        "cantidad": 0,
+        "suma_saldos": 0,
+        "total_ingresos": 0,
+        "total_gastos": 0,
+        "pagos_servicio": {},
+    }
+
+
+def _acumular(agregados: Dict[str, Any], movimiento: Movimiento) -> None:
+    """Add one movement to *agregados* (amounts in cents) in constant time."""
+    agregados["cantidad"] += 1
+    agregados["suma_saldos"] += movimiento.saldo_centavos
+    tipo = movimiento.tipo.lower()
+    if "ingreso" in tipo or "recarga" in tipo:
+        agregados["total_ingresos"] += movimiento.centavos
+    if "pago" in tipo:
+        agregados["total_gastos"] += movimiento.centavos
+    if "servicio" in tipo:
+        pagos = agregados["pagos_servicio"]
+        pagos[movimiento.concepto] = pagos.get(movimiento.concepto, 0) + 1
+
+
+def calcular_agregados(movimientos: Iterable[Movimiento]) -> Dict[str, Any]:
+    """Build the running aggregates of *movimientos* in a single pass."""
+    agregados = _agregados_vacios()
     for movimiento in movimientos:
-        try:
-            valores.append(float(movimiento.get(campo, 0) or 0))
-        except ValueError:
-            continue
-    return valores
-
-
-def calcular_estadisticas(movimientos: List[Dict[str, str]]) -> Dict[str, float | str]:
-    if not movimientos:
-        return {
-            "saldo_promedio": 0.0,
-            "total_ingresos": 0.0,
-            "total_gastos": 0.0,
-            "servicio_mas_pagado": "N/A",
-        }
-
-    saldos = _valores_float(movimientos, "saldo_resultante")
-    montos = _valores_float(movimientos, "monto")
-    tipos = [movimiento.get("tipo", "") for movimiento in movimientos]
-    descripciones = [movimiento.get("descripcion", "") for movimiento in movimientos if "servicio" in movimiento.get("tipo", "").lower()]
-
-    total_ingresos = sum(monto for monto, tipo in zip(montos, tipos) if "ingreso" in tipo.lower() or "recarga" in tipo.lower())
-    total_gastos = sum(monto for monto, tipo in zip(montos, tipos) if "pago" in tipo.lower())
-    mas_pagado = "N/A"
-    if descripciones:
-        contador = Counter(descripciones)
-        mas_pagado = max(contador.items(), key=lambda par: par[1])[0]
+        _acumular(agregados, movimiento)
+    return agregados
+
+
+def _firma_csv(usuario: str) -> Optional[List[int]]:
+    try:
+        estado = _ruta_movimientos(usuario).stat()
+    except OSError:
+        return None
+    return [estado.st_size, estado.st_mtime_ns]
 
+
+def _leer_agregados(usuario: str) -> Optional[Dict[str, Any]]:
+    """Return the stored aggregates, or ``None`` if missing or out of date with the CSV."""
+    datos = leer_json(_ruta_estadisticas(usuario), default=None)
+    if not isinstance(datos, dict) or datos.get("version") != VERSION_ESTADISTICAS:
+        return None
+    if datos.get("firma") != _firma_csv(usuario):
+        return None
+    return datos["agregados"]
+
+
+def _guardar_agregados(usuario: str, agregados: Dict[str, Any]) -> None:
+    escribir_json(
+        _ruta_estadisticas(usuario),
+        {"version": VERSION_ESTADISTICAS, "firma": _firma_csv(usuario), "agregados": agregados},
+        indent=None,
+    )
+
+
+def _estadisticas(agregados: Dict[str, Any]) -> Dict[str, float | str]:
+    pagos = agregados["pagos_servicio"]
     return {
-        "saldo_promedio": mean(saldos) if saldos else 0.0,
-        "total_ingresos": total_ingresos,
-        "total_gastos": total_gastos,
-        "servicio_mas_pagado": mas_pagado,
+        "saldo_promedio": agregados["suma_saldos"] / agregados["cantidad"] / 100 if agregados["cantidad"] else 0.0,
+        "total_ingresos": agregados["total_ingresos"] / 100,
+        "total_gastos": agregados["total_gastos"] / 100,
+        # Ante un empate gana el servicio que se pagó primero.
+        "servicio_mas_pagado": max(pagos.items(), key=lambda par: par[1])[0] if pagos else "N/A",
     }
 
 
-def generar_reporte(usuario: str, movimientos: List[Dict[str, str]]) -> str:
-    estadisticas = calcular_estadisticas(movimientos)
-    fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
-    ruta = ruta_reporte(f"reporte_{usuario}_{fecha}.csv")
+def calcular_estadisticas(movimientos: List[Movimiento]) -> Dict[str, float | str]:
+    return _estadisticas(calcular_agregados(movimientos))
+
+
+def estadisticas_usuario(usuario: str, movimientos: Optional[List[Movimiento]] = None) -> Dict[str, float | str]:
+    """Return the report statistics of *usuario* from the stored aggregates.
+
+    If they are missing or stale they are recomputed from the CSV and saved.
+    When *movimientos* is given and holds a different number of movements
+    than the aggregates, the statistics are computed from that list instead.
+    """
+    agregados = _leer_agregados(usuario)
+    if agregados is None:
+        guardados = cargar_movimientos(usuario)
+        agregados = calcular_agregados(guardados)
+        _guardar_agregados(usuario, agregados)
+    if movimientos is not None and agregados["cantidad"] != len(movimientos):
+        return calcular_estadisticas(movimientos)
+    return _estadisticas(agregados)
+
+
+def escribir_reporte(ruta: Path, estadisticas: Dict[str, float | str]) -> None:
+    """Write the report CSV for *estadisticas* into *ruta*."""
     filas: List[Dict[str, str]] = [
         {"metrica": "Saldo promedio", "valor": f"{estadisticas['saldo_promedio']:.2f}"},
         {"metrica": "Total ingresos", "valor": f"{estadisticas['total_ingresos']:.2f}"},
@@ -94,5 +180,13 @@ def generar_reporte(usuario: str, movimientos: List[Dict[str, str]]) -> str:
         {"metrica": "Servicio más pagado", "valor": estadisticas["servicio_mas_pagado"]},
     ]
     escribir_csv(ruta, ["metrica", "valor"], filas)
+
+
+@instrumentar("movimientos.generar_reporte")
+def generar_reporte(usuario: str, movimientos: List[Movimiento]) -> str:
+    estadisticas = estadisticas_usuario(usuario, movimientos)
+    fecha = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ruta = ruta_reporte(f"reporte_{usuario}_{fecha}.csv")
+    escribir_reporte(ruta, estadisticas)
     registrar_evento("reporte_generado", f"{usuario}:{ruta.name}")
     return str(ruta)
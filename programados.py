@@ -0,0 +1,423 @@
+"""Pagos de servicios programados y recurrentes.
+
+Cada usuario puede programar un pago (servicio, alias de tarjeta, monto y
+frecuencia) desde el menú de la consola. Los pagos se guardan en
+``programados.txt``, una línea por pago::
+
+    id;usuario;servicio;alias;monto;frecuencia;inicio;proxima
+
+con las fechas en ``DD/MM/AAAA`` y el monto vacío cuando se paga el sugerido
+por el catálogo al momento de cada pago.
+
+El programador (``python programados.py``) ejecuta en una sola pasada todos los
+pagos vencidos de todas las cuentas. :class:`Agenda` mantiene un montículo
+ordenado por fecha de vencimiento, así que encontrar los vencidos no recorre
+los pagos ni los usuarios que no vencen: solo se bloquean, releen y escriben
+las cuentas con algo que pagar. Primero se guarda (con ``fsync``) la agenda ya
+adelantada y después se persisten juntos los saldos y movimientos de toda la
+pasada con ``almacen.aplicar_operaciones``: si el proceso cae entre los dos
+pasos, esos períodos quedan sin cobrar en lugar de cobrarse dos veces al
+reiniciar. Si un pago se atrasó varios períodos se paga cada uno con su fecha; un
+pago sin saldo suficiente (o cuya tarjeta o servicio ya no existe) no se
+reintenta: queda en el reporte y en la bitácora y pasa al período siguiente.
+
+Con ``--cada SEGUNDOS`` el programador queda corriendo con la agenda en
+memoria y en cada vuelta solo mira la cima del montículo; vuelve a leer
+``programados.txt`` cuando la consola lo modificó.
+
+Uso: python programados.py [--fecha DD/MM/AAAA] [--reporte pagos.csv] [--sqlite kiwillet.db] [--cada 60]
+"""
+from __future__ import annotations
+
+import argparse
+import calendar
+import csv
+import heapq
+import math
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import bloqueos
+import helpers
+import metricas
+import registros
+from logger import registrar_evento
+
+PROGRAMADOS_ARCHIVO = "programados.txt"
+FRECUENCIAS = ("semanal", "quincenal", "mensual", "anual")
+CAMPOS_REPORTE = ["id", "usuario", "servicio", "alias", "fecha", "monto", "resultado", "detalle"]
+
+
+@dataclass
+class PagoProgramado:
+    id: int
+    usuario: str
+    servicio: str
+    alias: str
+    monto: Optional[float]
+    frecuencia: str
+    inicio: date
+    proxima: date
+
+    def linea(self) -> str:
+        monto = "" if self.monto is None else f"{self.monto:.2f}"
+        return (
+            f"{self.id};{self.usuario};{self.servicio};{self.alias};{monto};{self.frecuencia};"
+            f"{registros.fecha_texto(self.inicio)};{registros.fecha_texto(self.proxima)}\n"
+        )
+
+
+def leer_dia(texto: str) -> Optional[date]:
+    """Parse *texto* as a day; a date with a time of day keeps only the day."""
+    fecha = registros.fecha_desde_texto(texto)
+    if isinstance(fecha, datetime):
+        # Un datetime en la agenda no se puede comparar con las fechas del
+        # montículo y frenaría los pagos de todas las cuentas.
+        return fecha.date()
+    return fecha if isinstance(fecha, date) else None
+
+
+def _parsear(linea: str) -> Optional[PagoProgramado]:
+    partes = linea.rstrip("\n").split(";")
+    if len(partes) != 8:
+        return None
+    identificador, usuario, servicio, alias, monto, frecuencia, inicio, proxima = partes
+    fechas = leer_dia(inicio), leer_dia(proxima)
+    if frecuencia not in FRECUENCIAS or None in fechas:
+        return None
+    try:
+        valor = float(monto) if monto else None
+        # Con nan "monto > saldo" es falso y el saldo quedaría en nan.
+        if valor is not None and (not math.isfinite(valor) or valor <= 0):
+            return None
+        return PagoProgramado(int(identificador), usuario, servicio, alias, valor, frecuencia, *fechas)
+    except ValueError:
+        return None
+
+
+def siguiente_fecha(pago: PagoProgramado) -> date:
+    """Return the due date after ``pago.proxima``; monthly and yearly ones keep the start day."""
+    if pago.frecuencia == "semanal":
+        return pago.proxima + timedelta(days=7)
+    if pago.frecuencia == "quincenal":
+        return pago.proxima + timedelta(days=14)
+    meses = 1 if pago.frecuencia == "mensual" else 12
+    anio, mes = divmod(pago.proxima.year * 12 + pago.proxima.month - 1 + meses, 12)
+    # El 31 de enero pasa al 28 (o 29) de febrero y vuelve al 31 en marzo.
+    return date(anio, mes + 1, min(pago.inicio.day, calendar.monthrange(anio, mes + 1)[1]))
+
+
+# ---------------- Archivo ----------------
+
+
+def leer_programados(ruta: str = PROGRAMADOS_ARCHIVO) -> List[PagoProgramado]:
+    if not os.path.exists(ruta):
+        return []
+    with metricas.medir("programados.leer") as medicion:
+        with open(ruta, "r", encoding="utf-8") as archivo:
+            pagos = [pago for pago in map(_parsear, archivo) if pago is not None]
+        medicion.bytes = os.path.getsize(ruta)
+        medicion.filas = len(pagos)
+    return pagos
+
+
+def guardar_programados(pagos: Iterable[PagoProgramado], ruta: str = PROGRAMADOS_ARCHIVO) -> None:
+    with metricas.medir("programados.guardar") as medicion:
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            for pago in pagos:
+                archivo.write(pago.linea())
+                medicion.filas += 1
+            medicion.bytes = archivo.tell()
+            # El programador cobra recién cuando la agenda adelantada está en disco.
+            archivo.flush()
+            os.fsync(archivo.fileno())
+        os.replace(temporal, ruta)
+
+
+def programar_pago(
+    usuario: str,
+    servicio: str,
+    alias: str,
+    monto: Optional[float],
+    frecuencia: str,
+    inicio: date,
+    ruta: str = PROGRAMADOS_ARCHIVO,
+) -> PagoProgramado:
+    """Add a scheduled payment whose first due date is *inicio* and return it."""
+    if frecuencia not in FRECUENCIAS:
+        raise ValueError(f"Frecuencia inválida: {frecuencia}")
+    if monto is not None and (not math.isfinite(monto) or monto <= 0):
+        raise ValueError(f"Monto inválido: {monto}")
+    if isinstance(inicio, datetime):
+        inicio = inicio.date()
+    with bloqueos.bloquear("programados"):
+        pagos = leer_programados(ruta)
+        pago = PagoProgramado(
+            max((pago.id for pago in pagos), default=0) + 1, usuario, servicio, alias, monto, frecuencia, inicio, inicio
+        )
+        pagos.append(pago)
+        guardar_programados(pagos, ruta)
+    registrar_evento("alta_pago_programado", f"{usuario};{pago.id}")
+    return pago
+
+
+def cancelar_pago(usuario: str, identificador: int, ruta: str = PROGRAMADOS_ARCHIVO) -> bool:
+    with bloqueos.bloquear("programados"):
+        pagos = leer_programados(ruta)
+        restantes = [pago for pago in pagos if not (pago.id == identificador and pago.usuario == usuario)]
+        if len(restantes) == len(pagos):
+            return False
+        guardar_programados(restantes, ruta)
+    registrar_evento("baja_pago_programado", f"{usuario};{identificador}")
+    return True
+
+
+def pagos_de(usuario: str, ruta: str = PROGRAMADOS_ARCHIVO) -> List[PagoProgramado]:
+    with bloqueos.bloquear("programados", exclusivo=False):
+        return sorted((pago for pago in leer_programados(ruta) if pago.usuario == usuario), key=lambda pago: pago.proxima)
+
+
+# ---------------- Agenda ----------------
+
+
+class Agenda:
+    """Scheduled payments plus a heap of ``(proxima, id)`` to find the due ones without a scan."""
+
+    def __init__(self, pagos: Iterable[PagoProgramado] = ()) -> None:
+        self.pagos: Dict[int, PagoProgramado] = {pago.id: pago for pago in pagos}
+        self._monticulo: List[Tuple[date, int]] = [(pago.proxima, pago.id) for pago in self.pagos.values()]
+        heapq.heapify(self._monticulo)
+
+    def __len__(self) -> int:
+        return len(self.pagos)
+
+    def proximo_vencimiento(self) -> Optional[date]:
+        return self._monticulo[0][0] if self._monticulo else None
+
+    def vencidos(self, hoy: date) -> List[PagoProgramado]:
+        """Pop and return, oldest first, the payments due on or before *hoy*."""
+        encontrados = []
+        while True:
+            proxima = self.proximo_vencimiento()
+            if proxima is None or proxima > hoy:
+                return encontrados
+            encontrados.append(self.pagos[heapq.heappop(self._monticulo)[1]])
+
+    def reprogramar(self, pago: PagoProgramado) -> None:
+        """Put a payment returned by :meth:`vencidos` back in the heap under its new ``proxima``."""
+        heapq.heappush(self._monticulo, (pago.proxima, pago.id))
+
+
+@dataclass
+class ResultadoPago:
+    pago: PagoProgramado
+    fecha: date
+    monto: float
+    resultado: str
+    detalle: str
+
+    def fila(self) -> Dict[str, Any]:
+        return {
+            "id": self.pago.id,
+            "usuario": self.pago.usuario,
+            "servicio": self.pago.servicio,
+            "alias": self.pago.alias,
+            "fecha": registros.fecha_texto(self.fecha),
+            "monto": f"{self.monto:.2f}",
+            "resultado": self.resultado,
+            "detalle": self.detalle,
+        }
+
+
+class Programador:
+    """Run every due payment of the agenda against *almacen* (``helpers`` or a ``RepositorioSQLite``)."""
+
+    def __init__(self, almacen: Any = helpers, ruta: str = PROGRAMADOS_ARCHIVO) -> None:
+        self.almacen = almacen
+        self.ruta = ruta
+        self.agenda = Agenda()
+        self.usuarios: Dict[str, Dict[str, Any]] = {}
+        self.tarjetas: Dict[str, Dict[str, Dict[str, str]]] = {}
+        self.servicios = almacen.leer_servicios()
+        self._firma: Optional[Tuple[int, int, int]] = None
+
+    def _firma_archivo(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return None
+        return estado.st_ino, estado.st_mtime_ns, estado.st_size
+
+    def _recargar_si_cambio(self) -> None:
+        firma = self._firma_archivo()
+        if firma != self._firma:
+            self.agenda = Agenda(leer_programados(self.ruta))
+            self._firma = firma
+
+    def ejecutar(self, hoy: date) -> List[ResultadoPago]:
+        """Pay everything due on or before *hoy* and return one result per attempted payment."""
+        # La agenda queda bloqueada durante la pasada para que un alta desde
+        # la consola no se pierda al guardarla.
+        with metricas.medir("programados.ejecutar") as medicion, bloqueos.bloquear("programados"):
+            self._recargar_si_cambio()
+            vencidos = self.agenda.vencidos(hoy)
+            if not vencidos:
+                return []
+            anteriores = [(pago, pago.proxima) for pago in vencidos]
+            with bloqueos.bloquear_usuarios({pago.usuario for pago in vencidos}):
+                resultados, operaciones, cuentas = self._pagar(vencidos, hoy)
+                # La agenda adelantada va a disco antes que los cobros: volver
+                # a correr la pasada tras una caída no paga dos veces.
+                self._guardar_agenda()
+                try:
+                    self.almacen.aplicar_operaciones(operaciones)
+                except BaseException:
+                    for pago, proxima in anteriores:
+                        pago.proxima = proxima
+                    self._guardar_agenda()
+                    raise
+                finally:
+                    for pago in vencidos:
+                        self.agenda.reprogramar(pago)
+            self.usuarios.update(cuentas)
+            medicion.filas = len(resultados)
+        for resultado in resultados:
+            accion = "pago_programado" if resultado.resultado == "ok" else "pago_programado_fallido"
+            registrar_evento(accion, f"{resultado.pago.usuario};{resultado.pago.id};{resultado.detalle}")
+        return resultados
+
+    def _guardar_agenda(self) -> None:
+        guardar_programados(sorted(self.agenda.pagos.values(), key=lambda pago: pago.id), self.ruta)
+        self._firma = self._firma_archivo()
+
+    def _pagar(self, vencidos: List[PagoProgramado], hoy: date) -> Tuple[
+        List[ResultadoPago], List[Tuple[str, Dict[str, Any], registros.Movimiento]], Dict[str, Dict[str, Any]]
+    ]:
+        # Solo se releen los datos y tarjetas de las cuentas con algo vencido.
+        # Los saldos se descuentan sobre copias, que pasan a self.usuarios
+        # recién cuando aplicar_operaciones los guardó.
+        cuentas: Dict[str, Dict[str, Any]] = {}
+        for usuario in {pago.usuario for pago in vencidos}:
+            self.almacen.refrescar_usuario(self.usuarios, usuario)
+            self.almacen.refrescar_tarjetas_usuario(self.tarjetas, usuario)
+            if usuario in self.usuarios:
+                cuentas[usuario] = dict(self.usuarios[usuario])
+        resultados: List[ResultadoPago] = []
+        operaciones: List[Tuple[str, Dict[str, Any], registros.Movimiento]] = []
+        # Los períodos atrasados vuelven al montículo local, así que todo se
+        # paga en orden de fecha aunque un pago deba varios períodos.
+        pendientes = [(pago.proxima, pago.id, pago) for pago in vencidos]
+        heapq.heapify(pendientes)
+        while pendientes:
+            fecha, _, pago = heapq.heappop(pendientes)
+            resultado = self._pagar_uno(pago, fecha, cuentas, operaciones)
+            resultados.append(resultado)
+            pago.proxima = siguiente_fecha(pago)
+            if pago.proxima <= hoy:
+                heapq.heappush(pendientes, (pago.proxima, pago.id, pago))
+        return resultados, operaciones, cuentas
+
+    def _pagar_uno(
+        self,
+        pago: PagoProgramado,
+        fecha: date,
+        cuentas: Dict[str, Dict[str, Any]],
+        operaciones: List[Tuple[str, Dict[str, Any], registros.Movimiento]],
+    ) -> ResultadoPago:
+        datos = cuentas.get(pago.usuario)
+        servicio = self.almacen.buscar_servicio(self.servicios, pago.servicio)
+        monto = pago.monto
+        if monto is None and servicio is not None:
+            try:
+                monto = float(servicio.get("monto", "0"))
+            except ValueError:
+                monto = 0.0
+        monto = monto or 0.0
+        if datos is None:
+            return ResultadoPago(pago, fecha, monto, "error", "Usuario inexistente.")
+        if helpers.obtener_tarjeta(self.tarjetas, pago.usuario, pago.alias) is None:
+            return ResultadoPago(pago, fecha, monto, "error", "Tarjeta no encontrada.")
+        if servicio is None:
+            return ResultadoPago(pago, fecha, monto, "error", "Servicio inexistente.")
+        if monto > datos["saldo"]:
+            return ResultadoPago(pago, fecha, monto, "saldo_insuficiente", f"Saldo: {helpers.formatear_monto(datos['saldo'])}")
+        datos["saldo"] -= monto
+        movimiento = registros.Movimiento(
+            fecha, f"Pago {servicio.get('nombre', '')}", registros.a_centavos(monto), registros.a_centavos(datos["saldo"])
+        )
+        operaciones.append((pago.usuario, dict(datos), movimiento))
+        return ResultadoPago(pago, fecha, monto, "ok", f"Saldo: {helpers.formatear_monto(datos['saldo'])}")
+
+
+def escribir_reporte(ruta: Path, resultados: Iterable[ResultadoPago]) -> None:
+    with ruta.open("w", encoding="utf-8", newline="") as archivo:
+        escritor = csv.DictWriter(archivo, fieldnames=CAMPOS_REPORTE)
+        escritor.writeheader()
+        escritor.writerows(resultado.fila() for resultado in resultados)
+
+
+def _resumen(resultados: List[ResultadoPago]) -> str:
+    pagados = sum(1 for resultado in resultados if resultado.resultado == "ok")
+    sin_saldo = sum(1 for resultado in resultados if resultado.resultado == "saldo_insuficiente")
+    return (
+        f"Pagos realizados: {pagados} | Sin saldo: {sin_saldo} | "
+        f"Con error: {len(resultados) - pagados - sin_saldo}"
+    )
+
+
+def _pasadas(programador: Programador, fecha: Optional[date], cada: Optional[float]) -> Iterator[List[ResultadoPago]]:
+    while True:
+        yield programador.ejecutar(fecha or date.today())
+        if cada is None:
+            return
+        time.sleep(cada)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ejecuta los pagos programados vencidos de todas las cuentas.")
+    parser.add_argument("--fecha", help="pagar lo vencido hasta esta fecha (DD/MM/AAAA, por defecto hoy)")
+    parser.add_argument("--reporte", type=Path, help="reporte CSV con el resultado de cada pago")
+    parser.add_argument("--sqlite", metavar="RUTA", help="usar una base SQLite en lugar de los archivos .txt")
+    parser.add_argument("--cada", type=float, metavar="SEGUNDOS", help="seguir corriendo y revisar cada SEGUNDOS")
+    argumentos = parser.parse_args()
+    fecha = None
+    if argumentos.fecha:
+        fecha = leer_dia(argumentos.fecha)
+        if fecha is None:
+            parser.error("la fecha debe tener el formato DD/MM/AAAA")
+    almacen: Any = helpers
+    if argumentos.sqlite:
+        from repositorio import RepositorioSQLite
+
+        almacen = RepositorioSQLite(argumentos.sqlite)
+    else:
+        helpers.inicializar_archivos()
+    try:
+        programador = Programador(almacen)
+        for resultados in _pasadas(programador, fecha, argumentos.cada):
+            # En modo continuo solo se informan las pasadas que pagaron algo.
+            if not resultados and argumentos.cada is not None:
+                continue
+            if argumentos.reporte:
+                escribir_reporte(argumentos.reporte, resultados)
+            print(_resumen(resultados))
+            for resultado in resultados:
+                if resultado.resultado == "saldo_insuficiente":
+                    print(
+                        f"  Sin saldo: {resultado.pago.usuario} no pudo pagar {resultado.pago.servicio} "
+                        f"({helpers.formatear_monto(resultado.monto)}) del {registros.fecha_texto(resultado.fecha)}"
+                    )
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if almacen is not helpers:
+            almacen.cerrar()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Registro compacto de un movimiento de la billetera.
+
+Un movimiento se guarda en memoria como :class:`Movimiento`: una clase con
+``__slots__``, la fecha ya interpretada y los montos en centavos enteros. El
+texto (``$123.45``, ``DD/MM/AAAA``) se arma recién al mostrarlo o al escribirlo
+en disco. Las fechas y los conceptos repetidos se comparten entre registros,
+así que un historial largo ocupa varias veces menos que con diccionarios.
+"""
+from __future__ import annotations
+
+import sys
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Optional, Tuple, Union
+
+Fecha = Union[date, datetime, str]
+
+
+class Movimiento:
+    """One movement: parsed date, concept and amounts in integer cents."""
+
+    __slots__ = ("fecha", "tipo", "concepto", "centavos", "saldo_centavos")
+
+    def __init__(self, fecha: Fecha, concepto: str, centavos: int, saldo_centavos: int, tipo: str = "") -> None:
+        self.fecha = fecha
+        self.tipo = tipo
+        self.concepto = concepto
+        self.centavos = centavos
+        self.saldo_centavos = saldo_centavos
+
+    def _clave(self) -> Tuple[Fecha, str, str, int, int]:
+        return self.fecha, self.tipo, self.concepto, self.centavos, self.saldo_centavos
+
+    def __eq__(self, otro: object) -> bool:
+        if not isinstance(otro, Movimiento):
+            return NotImplemented
+        return self._clave() == otro._clave()
+
+    def __repr__(self) -> str:
+        return (
+            f"Movimiento({fecha_texto(self.fecha)!r}, {self.concepto!r}, {self.centavos}, "
+            f"{self.saldo_centavos}, tipo={self.tipo!r})"
+        )
+
+    @property
+    def monto(self) -> float:
+        return self.centavos / 100
+
+    @property
+    def saldo(self) -> float:
+        return self.saldo_centavos / 100
+
+
+@lru_cache(maxsize=8192)
+def _fecha_dia(texto: str) -> Fecha:
+    try:
+        if texto[2] == "/":
+            return date(int(texto[6:10]), int(texto[3:5]), int(texto[0:2]))
+        return date.fromisoformat(texto)
+    except (ValueError, IndexError):
+        return texto
+
+
+def fecha_desde_texto(texto: str) -> Fecha:
+    """Parse ``DD/MM/AAAA``, ``AAAA-MM-DD`` or ``AAAA-MM-DD HH:MM:SS``; other text is kept as is."""
+    if len(texto) == 10:
+        # Las fechas sin hora se repiten mucho: se comparte un único objeto por día.
+        return _fecha_dia(texto)
+    try:
+        return datetime.fromisoformat(texto)
+    except ValueError:
+        return texto
+
+
+def fecha_texto(fecha: Fecha) -> str:
+    """Format *fecha* the way it is stored: ``AAAA-MM-DD HH:MM:SS`` or ``DD/MM/AAAA``."""
+    if isinstance(fecha, datetime):
+        return fecha.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(fecha, date):
+        return f"{fecha.day:02d}/{fecha.month:02d}/{fecha.year:04d}"
+    return fecha
+
+
+def fecha_iso(fecha: Fecha) -> str:
+    """Format *fecha* as the services store it: ``AAAA-MM-DD HH:MM:SS`` (a date at midnight)."""
+    if isinstance(fecha, datetime):
+        return fecha.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(fecha, date):
+        return f"{fecha.isoformat()} 00:00:00"
+    return fecha
+
+
+def fecha_consola(texto: str) -> str:
+    """Format a stored date as the console journal does, ``DD/MM/AAAA``, dropping any time."""
+    fecha = fecha_desde_texto(texto)
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    return fecha_texto(fecha)
+
+
+_DIA_CERO = date(1970, 1, 1).toordinal()
+
+
+def marca_tiempo(fecha: Fecha) -> Optional[int]:
+    """Seconds since 1970-01-01 for *fecha* (a date counts from midnight); ``None`` for unparsed text.
+
+    Stored times carry no zone, so they are counted as if they were UTC: the
+    value is only used to order and compare movements.
+    """
+    if isinstance(fecha, datetime):
+        return (fecha.toordinal() - _DIA_CERO) * 86400 + fecha.hour * 3600 + fecha.minute * 60 + fecha.second
+    if isinstance(fecha, date):
+        return (fecha.toordinal() - _DIA_CERO) * 86400
+    return None
+
+
+def tipo_movimiento(movimiento: Movimiento) -> str:
+    """Type of *movimiento*; console movements only have a concept, so it is derived from it."""
+    return movimiento.tipo or tipo_y_descripcion(movimiento.concepto)[0]
+
+
+def a_centavos(valor: Union[str, float, int]) -> int:
+    """Convert ``"$123.45"``, ``"123.45"`` or a number to integer cents (0 if invalid)."""
+    if isinstance(valor, str):
+        valor = valor.replace("$", "").strip() or 0
+    try:
+        return round(float(valor) * 100)
+    except (ValueError, OverflowError):
+        # round() rechaza nan con ValueError e infinito con OverflowError.
+        return 0
+
+
+def texto_centavos(centavos: int) -> str:
+    """Format cents as a plain decimal such as ``123.45``."""
+    signo = "-" if centavos < 0 else ""
+    centavos = abs(centavos)
+    return f"{signo}{centavos // 100}.{centavos % 100:02d}"
+
+
+def formatear_centavos(centavos: int) -> str:
+    """Format cents for display, like ``helpers.formatear_monto`` (``$123.45``)."""
+    return "$" + texto_centavos(centavos)
+
+
+def desde_texto(fecha: str, concepto: str, monto: str, saldo: str, tipo: str = "") -> Movimiento:
+    """Build a :class:`Movimiento` from the text fields of a stored line."""
+    return Movimiento(fecha_desde_texto(fecha), sys.intern(concepto), a_centavos(monto), a_centavos(saldo), sys.intern(tipo))
+
+
+def tipo_y_descripcion(concepto: str) -> Tuple[str, str]:
+    """Type and description of a console movement, which only has a concept."""
+    if concepto.startswith("Pago "):
+        return "Pago servicio", concepto[len("Pago ") :]
+    return ("Ingreso" if concepto.startswith("Ingreso") else concepto), concepto
+
+
+def concepto_consola(tipo: str, descripcion: str) -> str:
+    """Inverse of :func:`tipo_y_descripcion`: the concept the console journal stores."""
+    if tipo == "Pago servicio":
+        return "Pago " + descripcion
+    return descripcion
@@ -0,0 +1,138 @@
+"""Generación en paralelo de los reportes de todas las cuentas.
+
+Busca todos los usuarios (``usuarios.json`` y los ``movimientos_*.csv``
+existentes), los reparte en bloques y genera el reporte de cada uno en un
+``ProcessPoolExecutor``. Como cada usuario tiene su propio archivo, los
+procesos no comparten nada y el tiempo baja casi en proporción a los núcleos.
+
+Los reportes quedan en ``reports/lote_<periodo>/reporte_<usuario>.csv``. Cada
+bloque terminado se anota en ``progreso.txt`` dentro de esa carpeta; si el
+proceso se interrumpe, volver a ejecutarlo continúa con los usuarios que
+faltan (``--rehacer`` empieza de cero). Cuando terminan todos los bloques el
+progreso se borra, así que la ejecución siguiente vuelve a generar todo.
+
+Uso: python reportes.py [--periodo 2024-05] [--procesos 8] [--bloque 64]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from io_archivos import DATA_DIR, asegurar_directorio, ruta_reporte
+from logger import registrar_evento
+from movimientos import calcular_estadisticas, cargar_movimientos, escribir_reporte, estadisticas_usuario
+from registros import fecha_iso
+from usuarios import cargar_usuarios
+
+TAMANIO_BLOQUE = 64
+ARCHIVO_PROGRESO = "progreso.txt"
+
+
+def listar_usuarios() -> List[str]:
+    """Return every registered user plus any user that only has a movements file."""
+    nombres = set(cargar_usuarios())
+    nombres.update(ruta.stem[len("movimientos_") :] for ruta in DATA_DIR.glob("movimientos_*.csv"))
+    return sorted(nombres)
+
+
+def directorio_lote(periodo: Optional[str]) -> Path:
+    return ruta_reporte(f"lote_{periodo or 'completo'}")
+
+
+def _leer_progreso(ruta: Path) -> Set[str]:
+    if not ruta.exists():
+        return set()
+    with ruta.open("r", encoding="utf-8") as archivo:
+        # Una línea sin salto final quedó cortada por la interrupción.
+        return {linea[:-1] for linea in archivo if linea.endswith("\n")}
+
+
+def _generar_bloque(usuarios: List[str], directorio: Path, periodo: Optional[str]) -> List[str]:
+    """Write the report of each user in *usuarios*; runs inside a worker process."""
+    for usuario in usuarios:
+        if periodo:
+            movimientos = [
+                # fecha_iso también da AAAA-MM-DD para las fechas sin hora.
+                movimiento for movimiento in cargar_movimientos(usuario) if fecha_iso(movimiento.fecha).startswith(periodo)
+            ]
+            estadisticas = calcular_estadisticas(movimientos)
+        else:
+            # El historial completo sale de los acumulados, sin leer el CSV.
+            estadisticas = estadisticas_usuario(usuario)
+        escribir_reporte(directorio / f"reporte_{usuario}.csv", estadisticas)
+    return usuarios
+
+
+def generar_reportes(
+    periodo: Optional[str] = None,
+    procesos: Optional[int] = None,
+    tamanio_bloque: int = TAMANIO_BLOQUE,
+    rehacer: bool = False,
+    progreso: Optional[Callable[[int, int], None]] = None,
+) -> Dict[str, int]:
+    """Generate the reports of every user and return ``{"generados": n, "omitidos": m}``.
+
+    *periodo* (``AAAA-MM`` or any prefix of the movement date) restricts the
+    statistics to those movements; without it the full history is reported.
+    *progreso* is called with ``(done, total)`` after each finished block.
+    """
+    directorio = directorio_lote(periodo)
+    asegurar_directorio(directorio)
+    ruta_progreso = directorio / ARCHIVO_PROGRESO
+    if rehacer and ruta_progreso.exists():
+        ruta_progreso.unlink()
+    hechos = _leer_progreso(ruta_progreso)
+    pendientes = [usuario for usuario in listar_usuarios() if usuario not in hechos]
+    total = len(pendientes)
+    terminados = 0
+    if progreso is not None:
+        progreso(terminados, total)
+    bloques = [pendientes[inicio : inicio + tamanio_bloque] for inicio in range(0, total, max(1, tamanio_bloque))]
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor, ruta_progreso.open("a", encoding="utf-8") as registro:
+        futuros = [ejecutor.submit(_generar_bloque, bloque, directorio, periodo) for bloque in bloques]
+        try:
+            for futuro in as_completed(futuros):
+                usuarios = futuro.result()
+                registro.write("".join(f"{usuario}\n" for usuario in usuarios))
+                registro.flush()
+                terminados += len(usuarios)
+                if progreso is not None:
+                    progreso(terminados, total)
+        except BaseException:
+            # Ante una interrupción no se empiezan los bloques que faltan; lo
+            # anotado en el progreso se retoma en la próxima ejecución.
+            ejecutor.shutdown(cancel_futures=True)
+            raise
+    # Lote completo: el progreso solo sirve para retomar una interrupción.
+    ruta_progreso.unlink()
+    registrar_evento("reportes_lote", f"{directorio.name}:{terminados}")
+    return {"generados": terminados, "omitidos": len(hechos)}
+
+
+def _mostrar_progreso(hechos: int, total: int) -> None:
+    print(f"\rReportes: {hechos}/{total}", end="", file=sys.stderr, flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera en paralelo el reporte de cada cuenta.")
+    parser.add_argument("--periodo", help="solo los movimientos cuya fecha empieza así (por ejemplo 2024-05)")
+    parser.add_argument("--procesos", type=int, default=os.cpu_count(), help="procesos trabajadores")
+    parser.add_argument("--bloque", type=int, default=TAMANIO_BLOQUE, help="usuarios por tarea")
+    parser.add_argument("--rehacer", action="store_true", help="ignorar el progreso guardado y empezar de cero")
+    argumentos = parser.parse_args()
+    totales = generar_reportes(
+        argumentos.periodo, max(1, argumentos.procesos), max(1, argumentos.bloque), argumentos.rehacer, _mostrar_progreso
+    )
+    print(file=sys.stderr)
+    print(
+        f"Reportes generados: {totales['generados']} | Ya hechos: {totales['omitidos']} | "
+        f"Carpeta: {directorio_lote(argumentos.periodo)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
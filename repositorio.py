@@ -0,0 +1,416 @@
+"""Repositorio de datos de la billetera sobre SQLite.
+
+El flujo de consola de ``main.py`` trabaja contra un *almacén*: cualquier objeto
+que cumpla con :class:`Repositorio`. El módulo ``helpers`` (archivos ``.txt``)
+ya lo cumple tal cual; :class:`RepositorioSQLite` ofrece la misma interfaz
+sobre una base ``sqlite3`` en modo WAL, con índices por usuario y fecha.
+"""
+from __future__ import annotations
+
+import sqlite3
+import sys
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Protocol, Tuple
+
+import helpers
+import registros
+from catalogo import LIMITE_BUSQUEDA
+from metricas import instrumentar
+from registros import Fecha, Movimiento
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (
+    usuario TEXT PRIMARY KEY,
+    clave TEXT NOT NULL,
+    saldo REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tarjetas (
+    usuario TEXT NOT NULL,
+    alias TEXT NOT NULL,
+    numero TEXT NOT NULL DEFAULT '',
+    tipo TEXT NOT NULL DEFAULT '',
+    vencimiento TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (usuario, alias)
+);
+CREATE TABLE IF NOT EXISTS movimientos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    usuario TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    concepto TEXT NOT NULL DEFAULT '',
+    monto REAL NOT NULL DEFAULT 0,
+    saldo REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS movimientos_usuario_fecha ON movimientos (usuario, fecha, id);
+CREATE TABLE IF NOT EXISTS servicios (
+    codigo TEXT PRIMARY KEY,
+    nombre TEXT NOT NULL,
+    monto REAL NOT NULL DEFAULT 0
+);
+"""
+
+SERVICIOS_BASE = [
+    ("agu", "Agua corriente", 1800.0),
+    ("ele", "Electricidad", 2500.0),
+    ("int", "Internet", 3200.0),
+]
+
+FORMATOS_FECHA = ("%d/%m/%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+# {usuario: {alias: tarjeta}}
+Tarjetas = Dict[str, Dict[str, Dict[str, str]]]
+
+
+class Repositorio(Protocol):
+    """Operaciones de almacenamiento que usa el flujo de consola."""
+
+    def leer_usuarios(self) -> Dict[str, Dict]: ...
+
+    def refrescar_usuario(self, usuarios: Dict[str, Dict], nombre: str) -> None: ...
+
+    def guardar_usuario(self, usuarios: Dict[str, Dict], nombre: str) -> None: ...
+
+    def leer_tarjetas(self) -> Tarjetas: ...
+
+    def refrescar_tarjetas_usuario(self, tarjetas: Tarjetas, usuario: str) -> None: ...
+
+    def agregar_tarjeta(
+        self, tarjetas: Tarjetas, usuario: str, alias: str, numero: str, tipo: str, vencimiento: str
+    ) -> bool: ...
+
+    def eliminar_tarjeta(self, tarjetas: Tarjetas, usuario: str, alias: str) -> bool: ...
+
+    def registrar_movimiento(
+        self, movimientos: Dict[str, List[Movimiento]], usuario: str, fecha: str, concepto: str, monto: str, saldo: str
+    ) -> None: ...
+
+    def leer_pagina_movimientos(self, usuario: str, pagina: int, por_pagina: int) -> Tuple[List[Movimiento], bool]: ...
+
+    def buscar_movimientos(
+        self,
+        usuario: str,
+        desde: Optional[date] = None,
+        hasta: Optional[date] = None,
+        tipo: str = "",
+        monto_minimo: Optional[float] = None,
+        monto_maximo: Optional[float] = None,
+    ) -> List[Movimiento]: ...
+
+    def aplicar_operaciones(self, operaciones: List[Tuple[str, Dict, Movimiento]]) -> None: ...
+
+    def leer_servicios(self) -> Iterable[Dict[str, str]]: ...
+
+    def buscar_servicio(self, servicios: Iterable[Dict[str, str]], codigo: str) -> Optional[Dict[str, str]]: ...
+
+    def buscar_servicios(
+        self, servicios: Iterable[Dict[str, str]], texto: str, limite: int = LIMITE_BUSQUEDA
+    ) -> List[Dict[str, str]]: ...
+
+
+def _fecha_iso(fecha: Fecha) -> str:
+    if isinstance(fecha, datetime):
+        return fecha.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(fecha, date):
+        return f"{fecha.isoformat()} 00:00:00"
+    for formato in FORMATOS_FECHA:
+        try:
+            return datetime.strptime(fecha, formato).strftime("%Y-%m-%d %H:%M:%S")
+        except ValueError:
+            continue
+    return fecha
+
+
+def _fila_movimiento(movimiento: Movimiento) -> Tuple[str, str, float, float]:
+    return _fecha_iso(movimiento.fecha), movimiento.concepto, movimiento.centavos / 100, movimiento.saldo_centavos / 100
+
+
+def _a_numero(valor: str | float) -> float:
+    try:
+        return float(str(valor).replace("$", "").strip() or 0)
+    except ValueError:
+        return 0.0
+
+
+class RepositorioSQLite:
+    """SQLite-backed implementation of :class:`Repositorio`."""
+
+    def __init__(self, ruta: str = "kiwillet.db") -> None:
+        self.ruta = ruta
+        self._locales = threading.local()
+        self._abiertas: List[sqlite3.Connection] = []
+        self._bloqueo = threading.Lock()
+        with self._conexion:
+            self._conexion.executescript(ESQUEMA)
+            self._conexion.executemany(
+                "INSERT OR IGNORE INTO servicios (codigo, nombre, monto) VALUES (?, ?, ?)",
+                SERVICIOS_BASE,
+            )
+
+    @property
+    def _conexion(self) -> sqlite3.Connection:
+        # Una conexión de sqlite3 no se puede usar desde dos hilos a la vez y
+        # el repositorio se usa desde la consola, el commit agrupado y la
+        # precarga: cada hilo abre la suya, y el modo WAL deja leer mientras
+        # otro escribe.
+        conexion = getattr(self._locales, "conexion", None)
+        if conexion is None:
+            # check_same_thread=False solo para que cerrar() las cierre todas.
+            conexion = sqlite3.connect(self.ruta, check_same_thread=False)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            with self._bloqueo:
+                self._abiertas.append(conexion)
+            self._locales.conexion = conexion
+        return conexion
+
+    def cerrar(self) -> None:
+        with self._bloqueo:
+            abiertas, self._abiertas = self._abiertas, []
+        for conexion in abiertas:
+            conexion.close()
+        self._locales = threading.local()
+
+    # ---------------- Usuarios ----------------
+
+    @instrumentar("sqlite.leer_usuarios")
+    def leer_usuarios(self) -> Dict[str, Dict]:
+        filas = self._conexion.execute("SELECT usuario, clave, saldo FROM usuarios")
+        return {usuario: {"clave": clave, "saldo": saldo} for usuario, clave, saldo in filas}
+
+    def obtener_usuario(self, nombre: str) -> Optional[Dict]:
+        fila = self._conexion.execute("SELECT clave, saldo FROM usuarios WHERE usuario = ?", (nombre,)).fetchone()
+        if fila is None:
+            return None
+        return {"clave": fila[0], "saldo": fila[1]}
+
+    @instrumentar("sqlite.refrescar_usuario")
+    def refrescar_usuario(self, usuarios: Dict[str, Dict], nombre: str) -> None:
+        datos = self.obtener_usuario(nombre)
+        if datos is not None:
+            usuarios[nombre] = datos
+
+    @instrumentar("sqlite.guardar_usuario")
+    def guardar_usuario(self, usuarios: Dict[str, Dict], nombre: str) -> None:
+        datos = usuarios[nombre]
+        with self._conexion:
+            self._conexion.execute(
+                "INSERT INTO usuarios (usuario, clave, saldo) VALUES (?, ?, ?) "
+                "ON CONFLICT (usuario) DO UPDATE SET clave = excluded.clave, saldo = excluded.saldo",
+                (nombre, datos["clave"], datos["saldo"]),
+            )
+
+    # ---------------- Tarjetas ----------------
+
+    @instrumentar("sqlite.leer_tarjetas")
+    def leer_tarjetas(self) -> Tarjetas:
+        tarjetas: Tarjetas = {}
+        filas = self._conexion.execute("SELECT usuario, alias, numero, tipo, vencimiento FROM tarjetas ORDER BY rowid")
+        for usuario, alias, numero, tipo, vencimiento in filas:
+            tarjetas.setdefault(usuario, {})[alias] = {
+                "alias": alias,
+                "numero": numero,
+                "tipo": tipo,
+                "vencimiento": vencimiento,
+            }
+        return tarjetas
+
+    @instrumentar("sqlite.refrescar_tarjetas_usuario")
+    def refrescar_tarjetas_usuario(self, tarjetas: Tarjetas, usuario: str) -> None:
+        """Reload only *usuario*'s cards into *tarjetas*."""
+        filas = self._conexion.execute(
+            "SELECT alias, numero, tipo, vencimiento FROM tarjetas WHERE usuario = ? ORDER BY rowid", (usuario,)
+        )
+        tarjetas[usuario] = {
+            alias: {"alias": alias, "numero": numero, "tipo": tipo, "vencimiento": vencimiento}
+            for alias, numero, tipo, vencimiento in filas
+        }
+
+    @instrumentar("sqlite.agregar_tarjeta")
+    def agregar_tarjeta(
+        self, tarjetas: Tarjetas, usuario: str, alias: str, numero: str, tipo: str, vencimiento: str
+    ) -> bool:
+        with self._conexion:
+            cursor = self._conexion.execute(
+                "INSERT OR IGNORE INTO tarjetas (usuario, alias, numero, tipo, vencimiento) VALUES (?, ?, ?, ?, ?)",
+                (usuario, alias, numero, tipo, vencimiento),
+            )
+        if cursor.rowcount == 0:
+            return False
+        tarjetas.setdefault(usuario, {})[alias] = {
+            "alias": alias,
+            "numero": numero,
+            "tipo": tipo,
+            "vencimiento": vencimiento,
+        }
+        return True
+
+    @instrumentar("sqlite.eliminar_tarjeta")
+    def eliminar_tarjeta(self, tarjetas: Tarjetas, usuario: str, alias: str) -> bool:
+        with self._conexion:
+            cursor = self._conexion.execute("DELETE FROM tarjetas WHERE usuario = ? AND alias = ?", (usuario, alias))
+        if cursor.rowcount == 0:
+            return False
+        tarjetas.get(usuario, {}).pop(alias, None)
+        return True
+
+    # ---------------- Movimientos ----------------
+
+    def registrar_movimiento(
+        self, movimientos: Dict[str, List[Movimiento]], usuario: str, fecha: str, concepto: str, monto: str, saldo: str
+    ) -> None:
+        movimiento = registros.desde_texto(fecha, concepto, monto, saldo)
+        movimientos.setdefault(usuario, []).append(movimiento)
+        with self._conexion:
+            self._conexion.execute(
+                "INSERT INTO movimientos (usuario, fecha, concepto, monto, saldo) VALUES (?, ?, ?, ?, ?)",
+                (usuario, *_fila_movimiento(movimiento)),
+            )
+
+    @instrumentar("sqlite.aplicar_operaciones")
+    def aplicar_operaciones(self, operaciones: List[Tuple[str, Dict, Movimiento]]) -> None:
+        """Persist ``(usuario, datos_usuario, movimiento)`` triples in a single transaction."""
+        with self._conexion:
+            self._conexion.executemany(
+                "INSERT INTO movimientos (usuario, fecha, concepto, monto, saldo) VALUES (?, ?, ?, ?, ?)",
+                ((usuario, *_fila_movimiento(movimiento)) for usuario, _, movimiento in operaciones),
+            )
+            self._conexion.executemany(
+                "INSERT INTO usuarios (usuario, clave, saldo) VALUES (?, ?, ?) "
+                "ON CONFLICT (usuario) DO UPDATE SET clave = excluded.clave, saldo = excluded.saldo",
+                ((usuario, datos["clave"], datos["saldo"]) for usuario, datos, _ in operaciones),
+            )
+
+    def _movimientos(self, filas) -> List[Movimiento]:
+        # La consola registra fechas sin hora, así que se muestra solo el día.
+        return [
+            Movimiento(registros.fecha_desde_texto(fecha[:10]), concepto, round(monto * 100), round(saldo * 100))
+            for fecha, concepto, monto, saldo in filas
+        ]
+
+    @instrumentar("sqlite.leer_movimientos_usuario")
+    def leer_movimientos_usuario(self, usuario: str) -> List[Movimiento]:
+        filas = self._conexion.execute(
+            "SELECT fecha, concepto, monto, saldo FROM movimientos WHERE usuario = ? ORDER BY fecha, id",
+            (usuario,),
+        )
+        return self._movimientos(filas)
+
+    @instrumentar("sqlite.leer_pagina_movimientos")
+    def leer_pagina_movimientos(self, usuario: str, pagina: int, por_pagina: int) -> Tuple[List[Movimiento], bool]:
+        filas = self._conexion.execute(
+            "SELECT fecha, concepto, monto, saldo FROM movimientos WHERE usuario = ? "
+            "ORDER BY fecha DESC, id DESC LIMIT ? OFFSET ?",
+            (usuario, por_pagina + 1, pagina * por_pagina),
+        ).fetchall()
+        return self._movimientos(filas[:por_pagina]), len(filas) > por_pagina
+
+    @instrumentar("sqlite.buscar_movimientos")
+    def buscar_movimientos(
+        self,
+        usuario: str,
+        desde: Optional[date] = None,
+        hasta: Optional[date] = None,
+        tipo: str = "",
+        monto_minimo: Optional[float] = None,
+        monto_maximo: Optional[float] = None,
+    ) -> List[Movimiento]:
+        """Same filters as ``helpers.buscar_movimientos``; the date range uses the (usuario, fecha) index."""
+        condiciones = ["usuario = ?"]
+        parametros: List[object] = [usuario]
+        if desde is not None:
+            condiciones.append("fecha >= ?")
+            parametros.append(_fecha_iso(desde))
+        if hasta is not None:
+            condiciones.append("fecha <= ?")
+            # Una fecha sin hora incluye todo ese día.
+            parametros.append(_fecha_iso(hasta) if isinstance(hasta, datetime) else f"{hasta.isoformat()} 23:59:59")
+        if monto_minimo is not None:
+            condiciones.append("monto >= ?")
+            parametros.append(monto_minimo)
+        if monto_maximo is not None:
+            condiciones.append("monto <= ?")
+            parametros.append(monto_maximo)
+        filas = self._conexion.execute(
+            f"SELECT fecha, concepto, monto, saldo FROM movimientos WHERE {' AND '.join(condiciones)} ORDER BY fecha, id",
+            parametros,
+        )
+        tipo = tipo.strip().lower()
+        return [
+            movimiento
+            for movimiento in self._movimientos(filas)
+            if not tipo or registros.tipo_movimiento(movimiento).lower().startswith(tipo)
+        ]
+
+    # ---------------- Servicios ----------------
+
+    @instrumentar("sqlite.leer_servicios")
+    def leer_servicios(self) -> List[Dict[str, str]]:
+        filas = self._conexion.execute("SELECT codigo, nombre, monto FROM servicios ORDER BY codigo")
+        return [{"codigo": codigo, "nombre": nombre, "monto": f"{monto:g}"} for codigo, nombre, monto in filas]
+
+    def buscar_servicio(self, servicios: Iterable[Dict[str, str]], codigo: str) -> Optional[Dict[str, str]]:
+        fila = self._conexion.execute("SELECT nombre, monto FROM servicios WHERE codigo = ?", (codigo,)).fetchone()
+        if fila is None:
+            return None
+        return {"codigo": codigo, "nombre": fila[0], "monto": f"{fila[1]:g}"}
+
+    @instrumentar("sqlite.buscar_servicios")
+    def buscar_servicios(
+        self, servicios: Iterable[Dict[str, str]], texto: str, limite: int = LIMITE_BUSQUEDA
+    ) -> List[Dict[str, str]]:
+        """Return services whose name contains *texto*; those starting with it come first."""
+        patron = texto.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        filas = self._conexion.execute(
+            "SELECT codigo, nombre, monto FROM servicios WHERE nombre LIKE ? ESCAPE '\\' "
+            "ORDER BY nombre LIKE ? ESCAPE '\\' DESC, nombre LIMIT ?",
+            (f"%{patron}%", f"{patron}%", limite),
+        )
+        return [{"codigo": codigo, "nombre": nombre, "monto": f"{monto:g}"} for codigo, nombre, monto in filas]
+
+    # ---------------- Importación ----------------
+
+    def importar_archivos(self) -> None:
+        """Copy the data stored in the ``helpers`` text files into an empty database.
+
+        Raises ``ValueError`` if the database already has users or movements:
+        importing again would duplicate the history.
+        """
+        for tabla in ("usuarios", "movimientos"):
+            if self._conexion.execute(f"SELECT 1 FROM {tabla} LIMIT 1").fetchone() is not None:
+                raise ValueError(f"La base {self.ruta} ya tiene datos; importe sobre una base nueva.")
+        usuarios = helpers.leer_usuarios()
+        tarjetas = helpers.leer_tarjetas()
+        movimientos = helpers.leer_movimientos()
+        servicios = helpers.leer_servicios()
+        with self._conexion:
+            self._conexion.executemany(
+                "INSERT OR REPLACE INTO usuarios (usuario, clave, saldo) VALUES (?, ?, ?)",
+                ((nombre, datos["clave"], datos["saldo"]) for nombre, datos in usuarios.items()),
+            )
+            self._conexion.executemany(
+                "INSERT OR REPLACE INTO tarjetas (usuario, alias, numero, tipo, vencimiento) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (usuario, t["alias"], t["numero"], t["tipo"], t["vencimiento"])
+                    for usuario, por_alias in tarjetas.items()
+                    for t in por_alias.values()
+                ),
+            )
+            self._conexion.executemany(
+                "INSERT INTO movimientos (usuario, fecha, concepto, monto, saldo) VALUES (?, ?, ?, ?, ?)",
+                ((usuario, *_fila_movimiento(movimiento)) for usuario, lista in movimientos.items() for movimiento in lista),
+            )
+            self._conexion.executemany(
+                "INSERT OR REPLACE INTO servicios (codigo, nombre, monto) VALUES (?, ?, ?)",
+                ((s["codigo"], s["nombre"], _a_numero(s["monto"])) for s in servicios),
+            )
+
+
+if __name__ == "__main__":
+    # Uso: python repositorio.py kiwillet.db  (importa los .txt de la carpeta actual)
+    repositorio = RepositorioSQLite(sys.argv[1] if len(sys.argv) > 1 else "kiwillet.db")
+    try:
+        repositorio.importar_archivos()
+    except ValueError as error:
+        sys.exit(str(error))
+    finally:
+        repositorio.cerrar()
@@ -0,0 +1,341 @@
+"""Segmentos binarios de movimientos con registros de ancho fijo.
+
+Un segmento guarda los movimientos de toda la billetera en un único archivo:
+
+* un encabezado (``ENCABEZADO``) con la cantidad de registros y de usuarios;
+* los registros (``REGISTRO``, 40 bytes cada uno), agrupados por usuario y en
+  el orden en que ocurrieron: usuario, fecha en segundos desde 1970, tipo,
+  concepto, centavos, saldo resultante en centavos y marcas de la fecha;
+* el índice de usuarios (``USUARIO``): dónde empieza cada uno y cuántos tiene;
+* la tabla de cadenas: usuarios, tipos y conceptos se guardan una sola vez y
+  los registros solo llevan su número.
+
+:class:`SegmentoMovimientos` lo abre con ``mmap`` y lo recorre con
+``memoryview``: leer el registro *n* o los movimientos de un usuario es un
+``struct.unpack_from`` sobre el mapa, sin partir líneas ni copiar el archivo.
+Las cadenas se decodifican una vez y se comparten entre registros.
+
+Es un formato opcional: la consola sigue usando ``movimientos.txt`` y los
+servicios ``data/movimientos_*.csv``. Este módulo convierte en ambos sentidos.
+
+Uso: python segmentos.py importar txt movimientos.txt movimientos.kwm
+     python segmentos.py exportar csv movimientos.kwm data
+     python segmentos.py info movimientos.kwm
+"""
+from __future__ import annotations
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import helpers
+from io_archivos import escribir_csv, leer_csv
+from movimientos import CAMPOS_MOVIMIENTO, a_fila, desde_fila
+from registros import Fecha, Movimiento
+
+MAGICO = b"KWMV"
+VERSION = 1
+# magico, versión, reservado, registros, usuarios, posición del índice de usuarios, posición de las cadenas
+ENCABEZADO = struct.Struct("<4sHHQQQQ")
+# usuario, fecha, tipo, concepto, centavos, saldo en centavos, marcas
+REGISTRO = struct.Struct("<IqIIqqH2x")
+# usuario, primer registro, cantidad
+USUARIO = struct.Struct("<IQQ")
+CANTIDAD = struct.Struct("<I")
+POSICION = struct.Struct("<Q")
+
+# Marcas de la fecha de un registro.
+FECHA_DIA = 1  # solo el día (DD/MM/AAAA del diario de la consola)
+FECHA_TEXTO = 2  # no se pudo interpretar: el campo fecha es el número de una cadena
+
+_EPOCA = datetime(1970, 1, 1)
+_ORDINAL_EPOCA = _EPOCA.toordinal()
+
+
+@lru_cache(maxsize=8192)
+def _dia(dias: int) -> date:
+    return date.fromordinal(_ORDINAL_EPOCA + dias)
+
+
+def _fecha_a_campos(fecha: Fecha, numero_cadena) -> Tuple[int, int]:
+    if isinstance(fecha, datetime):
+        delta = fecha - _EPOCA
+        return delta.days * 86400 + delta.seconds, 0
+    if isinstance(fecha, date):
+        return (fecha.toordinal() - _ORDINAL_EPOCA) * 86400, FECHA_DIA
+    return numero_cadena(fecha), FECHA_TEXTO
+
+
+class EscritorSegmento:
+    """Collect movements in memory (already packed) and write them as a segment."""
+
+    def __init__(self) -> None:
+        self._cadenas: Dict[str, int] = {}
+        self._usuarios: Dict[int, bytearray] = {}
+        self.cantidad = 0
+
+    def _numero(self, texto: str) -> int:
+        numero = self._cadenas.get(texto)
+        if numero is None:
+            numero = self._cadenas[texto] = len(self._cadenas)
+        return numero
+
+    def agregar(self, usuario: str, movimiento: Movimiento) -> None:
+        codigo = self._numero(usuario)
+        fecha, marcas = _fecha_a_campos(movimiento.fecha, self._numero)
+        bloque = self._usuarios.get(codigo)
+        if bloque is None:
+            bloque = self._usuarios[codigo] = bytearray()
+        bloque += REGISTRO.pack(
+            codigo,
+            fecha,
+            self._numero(movimiento.tipo),
+            self._numero(movimiento.concepto),
+            movimiento.centavos,
+            movimiento.saldo_centavos,
+            marcas,
+        )
+        self.cantidad += 1
+
+    def escribir(self, ruta: Path) -> None:
+        """Write the segment to *ruta* atomically (temporary file plus rename)."""
+        ruta = Path(ruta)
+        temporal = ruta.with_name(ruta.name + ".tmp")
+        cadenas = [texto.encode("utf-8") for texto in self._cadenas]
+        posicion_usuarios = ENCABEZADO.size + self.cantidad * REGISTRO.size
+        posicion_cadenas = posicion_usuarios + len(self._usuarios) * USUARIO.size
+        with temporal.open("wb") as archivo:
+            archivo.write(
+                ENCABEZADO.pack(
+                    MAGICO, VERSION, 0, self.cantidad, len(self._usuarios), posicion_usuarios, posicion_cadenas
+                )
+            )
+            for bloque in self._usuarios.values():
+                archivo.write(bloque)
+            inicio = 0
+            for codigo, bloque in self._usuarios.items():
+                cantidad = len(bloque) // REGISTRO.size
+                archivo.write(USUARIO.pack(codigo, inicio, cantidad))
+                inicio += cantidad
+            archivo.write(CANTIDAD.pack(len(cadenas)))
+            desplazamiento = 0
+            for texto in cadenas:
+                archivo.write(POSICION.pack(desplazamiento))
+                desplazamiento += len(texto)
+            archivo.write(POSICION.pack(desplazamiento))
+            for texto in cadenas:
+                archivo.write(texto)
+        os.replace(temporal, ruta)
+
+
+class SegmentoMovimientos:
+    """Read-only view of a movement segment mapped in memory."""
+
+    def __init__(self, ruta: Path) -> None:
+        self.ruta = Path(ruta)
+        with self.ruta.open("rb") as archivo:
+            if os.fstat(archivo.fileno()).st_size < ENCABEZADO.size:
+                raise ValueError(f"{self.ruta} no es un segmento de movimientos.")
+            self._mapa = mmap.mmap(archivo.fileno(), 0, access=mmap.ACCESS_READ)
+        self._vista = memoryview(self._mapa)
+        magico, version, _, cantidad, _, posicion_usuarios, posicion_cadenas = ENCABEZADO.unpack_from(self._vista)
+        if magico != MAGICO or version != VERSION:
+            self.cerrar()
+            raise ValueError(f"{self.ruta} no es un segmento de movimientos (versión {VERSION}).")
+        self._cantidad = cantidad
+        self._registros = self._vista[ENCABEZADO.size : posicion_usuarios]
+        (total_cadenas,) = CANTIDAD.unpack_from(self._vista, posicion_cadenas)
+        self._posiciones = posicion_cadenas + CANTIDAD.size
+        self._texto = self._posiciones + (total_cadenas + 1) * POSICION.size
+        self._cadenas: List[Optional[str]] = [None] * total_cadenas
+        self._usuarios: Dict[str, Tuple[int, int]] = {}
+        for codigo, inicio, total in USUARIO.iter_unpack(self._vista[posicion_usuarios:posicion_cadenas]):
+            self._usuarios[self.cadena(codigo)] = (inicio, total)
+
+    def __enter__(self) -> SegmentoMovimientos:
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.cerrar()
+
+    def __len__(self) -> int:
+        return self._cantidad
+
+    def cerrar(self) -> None:
+        try:
+            for vista in (getattr(self, "_registros", None), self._vista):
+                if vista is not None:
+                    vista.release()
+            self._mapa.close()
+        except BufferError:
+            # Un recorrido quedó a medias y todavía usa el mapa: se libera
+            # cuando ese iterador deje de existir.
+            pass
+
+    def cadena(self, numero: int) -> str:
+        """Return string *numero* of the table, decoding it on first use."""
+        texto = self._cadenas[numero]
+        if texto is None:
+            desde = self._posiciones + numero * POSICION.size
+            inicio, fin = struct.unpack_from("<QQ", self._vista, desde)
+            texto = self._cadenas[numero] = sys.intern(
+                str(self._vista[self._texto + inicio : self._texto + fin], "utf-8")
+            )
+        return texto
+
+    def usuarios(self) -> List[str]:
+        return list(self._usuarios)
+
+    def cantidad(self, usuario: str) -> int:
+        return self._usuarios.get(usuario, (0, 0))[1]
+
+    def vista_registros(self) -> memoryview:
+        """Return the records area without copying it (for ``numpy.frombuffer``)."""
+        return self._registros
+
+    def crudo(self, indice: int) -> Tuple[int, int, int, int, int, int, int]:
+        """Return the raw fields of record *indice* (string numbers, not text)."""
+        if not 0 <= indice < self._cantidad:
+            raise IndexError(indice)
+        return REGISTRO.unpack_from(self._registros, indice * REGISTRO.size)
+
+    def _movimiento(self, campos: Tuple[int, int, int, int, int, int, int]) -> Movimiento:
+        _, segundos, tipo, concepto, centavos, saldo, marcas = campos
+        if marcas & FECHA_TEXTO:
+            fecha: Fecha = self.cadena(segundos)
+        elif marcas & FECHA_DIA:
+            fecha = _dia(segundos // 86400)
+        else:
+            fecha = _EPOCA + timedelta(seconds=segundos)
+        return Movimiento(fecha, self.cadena(concepto), centavos, saldo, self.cadena(tipo))
+
+    def movimiento(self, indice: int) -> Tuple[str, Movimiento]:
+        """Return ``(usuario, movimiento)`` for record *indice*."""
+        campos = self.crudo(indice)
+        return self.cadena(campos[0]), self._movimiento(campos)
+
+    def _rango(self, desde: int, hasta: int) -> Iterator[Tuple[int, int, int, int, int, int, int]]:
+        # El corte de un memoryview no copia: iter_unpack lee directo del mapa.
+        return REGISTRO.iter_unpack(self._registros[desde * REGISTRO.size : hasta * REGISTRO.size])
+
+    def recorrer(self) -> Iterator[Tuple[str, Movimiento]]:
+        """Yield ``(usuario, movimiento)`` for every record, grouped by user."""
+        for campos in self._rango(0, self._cantidad):
+            yield self.cadena(campos[0]), self._movimiento(campos)
+
+    def movimientos_usuario(self, usuario: str, desde: int = 0, hasta: Optional[int] = None) -> List[Movimiento]:
+        """Return movements ``desde:hasta`` of *usuario*, oldest first."""
+        inicio, total = self._usuarios.get(usuario, (0, 0))
+        desde, hasta, _ = slice(desde, hasta).indices(total)
+        if desde >= hasta:
+            return []
+        return [self._movimiento(campos) for campos in self._rango(inicio + desde, inicio + hasta)]
+
+    def pagina(self, usuario: str, pagina: int, por_pagina: int) -> Tuple[List[Movimiento], bool]:
+        """Same contract as ``helpers.leer_pagina_movimientos``: newest first."""
+        total = self.cantidad(usuario)
+        fin = total - pagina * por_pagina
+        lista = self.movimientos_usuario(usuario, max(0, fin - por_pagina), max(0, fin))
+        lista.reverse()
+        return lista, fin - por_pagina > 0
+
+    def saldo_centavos(self, usuario: str) -> Optional[int]:
+        """Return the balance after the last movement of *usuario* (``None`` if none)."""
+        inicio, total = self._usuarios.get(usuario, (0, 0))
+        if not total:
+            return None
+        return self.crudo(inicio + total - 1)[5]
+
+
+# ---------------- Importar y exportar ----------------
+
+
+def importar_txt(origen: Path, destino: Path) -> int:
+    """Convert a journal ``usuario;fecha;concepto;$monto;$saldo`` into a segment."""
+    escritor = EscritorSegmento()
+    for usuario, movimiento in helpers.iterar_movimientos(str(origen)):
+        escritor.agregar(usuario, movimiento)
+    escritor.escribir(destino)
+    return escritor.cantidad
+
+
+def importar_csv(directorio: Path, destino: Path) -> int:
+    """Convert every ``movimientos_{usuario}.csv`` of *directorio* into a segment."""
+    escritor = EscritorSegmento()
+    for ruta in sorted(Path(directorio).glob("movimientos_*.csv")):
+        usuario = ruta.stem[len("movimientos_") :]
+        for fila in leer_csv(ruta):
+            escritor.agregar(usuario, desde_fila(fila))
+    escritor.escribir(destino)
+    return escritor.cantidad
+
+
+def exportar_txt(origen: Path, destino: Path) -> int:
+    """Write segment *origen* as a console journal at *destino*.
+
+    If *destino* is the console's ``movimientos.txt`` it is replaced through
+    ``helpers.reemplazar_movimientos`` so its index is rebuilt.
+    """
+    destino = Path(destino)
+    temporal = destino.with_name(destino.name + ".tmp")
+    with SegmentoMovimientos(origen) as segmento, temporal.open("w", encoding="utf-8") as archivo:
+        for usuario, movimiento in segmento.recorrer():
+            archivo.write(helpers.linea_movimiento(usuario, movimiento))
+        cantidad = len(segmento)
+    if destino.resolve() == Path(helpers.MOVIMIENTOS_ARCHIVO).resolve():
+        helpers.reemplazar_movimientos(str(temporal))
+    else:
+        os.replace(temporal, destino)
+    return cantidad
+
+
+def exportar_csv(origen: Path, directorio: Path) -> int:
+    """Write one ``movimientos_{usuario}.csv`` per user of segment *origen* into *directorio*."""
+    directorio = Path(directorio)
+    with SegmentoMovimientos(origen) as segmento:
+        for usuario in segmento.usuarios():
+            escribir_csv(
+                directorio / f"movimientos_{usuario}.csv",
+                CAMPOS_MOVIMIENTO,
+                (a_fila(movimiento) for movimiento in segmento.movimientos_usuario(usuario)),
+            )
+        return len(segmento)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convierte movimientos entre txt/CSV y segmentos binarios.")
+    acciones = parser.add_subparsers(dest="accion", required=True)
+    importar = acciones.add_parser("importar", help="txt (diario) o csv (carpeta data) a segmento")
+    importar.add_argument("formato", choices=["txt", "csv"])
+    importar.add_argument("origen", type=Path)
+    importar.add_argument("destino", type=Path)
+    exportar = acciones.add_parser("exportar", help="segmento a txt (diario) o csv (carpeta)")
+    exportar.add_argument("formato", choices=["txt", "csv"])
+    exportar.add_argument("origen", type=Path)
+    exportar.add_argument("destino", type=Path)
+    info = acciones.add_parser("info", help="resumen de un segmento")
+    info.add_argument("origen", type=Path)
+    argumentos = parser.parse_args()
+    if argumentos.accion == "info":
+        with SegmentoMovimientos(argumentos.origen) as segmento:
+            tamanio = argumentos.origen.stat().st_size
+            print(f"Movimientos: {len(segmento)} | Usuarios: {len(segmento.usuarios())} | Tamaño: {tamanio} bytes")
+        return
+    conversiones = {
+        ("importar", "txt"): importar_txt,
+        ("importar", "csv"): importar_csv,
+        ("exportar", "txt"): exportar_txt,
+        ("exportar", "csv"): exportar_csv,
+    }
+    cantidad = conversiones[argumentos.accion, argumentos.formato](argumentos.origen, argumentos.destino)
+    print(f"Movimientos convertidos: {cantidad} -> {argumentos.destino}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,150 @@
-"""Funciones de hashing y verificación de contraseñas."""
+"""Funciones de hashing y verificación de contraseñas.
+
+Los hashes llevan su formato y su costo, con sal propia y separados por ``$``:
+
+* ``scrypt$n=16384,r=8,p=1$<sal>$<clave>`` (el formato vigente por omisión);
+* ``pbkdf2_sha256$i=600000$<sal>$<clave>``;
+* 64 caracteres hexadecimales: el SHA-256 sin sal de versiones anteriores, que
+  solo se acepta al verificar.
+
+Sal y clave derivada van en base64. :func:`necesita_rehash` dice si un hash
+guardado no usa el algoritmo y el costo vigentes (:func:`configurar`), para
+reemplazarlo en el próximo login correcto, que es el único momento en que se
+conoce la contraseña.
+
+hashlib libera el GIL mientras deriva la clave, así que :class:`PoolClaves`
+verifica en hilos propios sin frenar el lazo del servidor ni a los hilos de
+archivos.
+"""
 from __future__ import annotations
 
+import base64
 import hashlib
+import hmac
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metricas import instrumentar
+
+LARGO_SAL = 16
+LARGO_CLAVE = 32
+HILOS_CLAVES = min(4, os.cpu_count() or 1)
+
+# Costos por omisión: unos 60 ms por hash en un núcleo actual.
+COSTOS: Dict[str, Dict[str, int]] = {
+    "scrypt": {"n": 2**14, "r": 8, "p": 1},
+    "pbkdf2_sha256": {"i": 600_000},
+}
+
+_vigente: Dict[str, object] = {"algoritmo": "scrypt", "costo": dict(COSTOS["scrypt"])}
+
+
+def _completar_costo(algoritmo: str, costo: Dict[str, int]) -> Dict[str, int]:
+    if algoritmo not in COSTOS:
+        raise ValueError(f"Algoritmo de contraseñas desconocido: {algoritmo}")
+    desconocidos = set(costo) - set(COSTOS[algoritmo])
+    if desconocidos:
+        raise ValueError(f"Parámetros inválidos para {algoritmo}: {', '.join(sorted(desconocidos))}")
+    return {**COSTOS[algoritmo], **costo}
+
+
+def configurar(algoritmo: str = "scrypt", **costo: int) -> None:
+    """Use *algoritmo* with *costo* (defaults from ``COSTOS``) for new hashes."""
+    _vigente["costo"] = _completar_costo(algoritmo, costo)
+    _vigente["algoritmo"] = algoritmo
+
+
+def _derivar(algoritmo: str, costo: Dict[str, int], password: str, sal: bytes) -> bytes:
+    clave = password.encode("utf-8")
+    if algoritmo == "scrypt":
+        n, r, p = costo["n"], costo["r"], costo["p"]
+        # Memoria que pide OpenSSL más un margen; el límite por omisión (32 MB) no alcanza desde n=2**15.
+        memoria = 128 * r * (n + p + 2) + 1024 * 1024
+        return hashlib.scrypt(clave, salt=sal, n=n, r=r, p=p, maxmem=memoria, dklen=LARGO_CLAVE)
+    return hashlib.pbkdf2_hmac("sha256", clave, sal, costo["i"], LARGO_CLAVE)
+
+
+def _codificar(datos: bytes) -> str:
+    return base64.b64encode(datos).decode("ascii")
 
 
-def hash_password(password: str) -> str:
-    """Return a SHA-256 hash for the provided *password*."""
-    digest = hashlib.sha256()
-    digest.update(password.encode("utf-8"))
-    return digest.hexdigest()
+def _separar(password_hash: str) -> Optional[Tuple[str, Dict[str, int], bytes, bytes]]:
+    partes = password_hash.split("$")
+    if len(partes) != 4 or partes[0] not in COSTOS:
+        return None
+    algoritmo, texto_costo, sal, clave = partes
+    try:
+        costo = {nombre: int(valor) for nombre, valor in (par.split("=", 1) for par in texto_costo.split(","))}
+        return algoritmo, costo, base64.b64decode(sal, validate=True), base64.b64decode(clave, validate=True)
+    except ValueError:
+        return None
 
 
+def _es_sha256(valor: str) -> bool:
+    return len(valor) == 64 and all(caracter in "0123456789abcdef" for caracter in valor)
+
+
+@instrumentar("seguridad.hash_password")
+def hash_password(password: str, algoritmo: Optional[str] = None, **costo: int) -> str:
+    """Return a salted hash of *password* with the configured (or given) algorithm and cost."""
+    if algoritmo is None:
+        algoritmo = str(_vigente["algoritmo"])
+        costo = {**_vigente["costo"], **costo}  # type: ignore[dict-item]
+    costo = _completar_costo(algoritmo, costo)
+    sal = os.urandom(LARGO_SAL)
+    clave = _derivar(algoritmo, costo, password, sal)
+    texto_costo = ",".join(f"{nombre}={valor}" for nombre, valor in costo.items())
+    return f"{algoritmo}${texto_costo}${_codificar(sal)}${_codificar(clave)}"
+
+
+@instrumentar("seguridad.verificar_password")
 def verificar_password(password: str, password_hash: str) -> bool:
-    """Validate a password against the stored hash."""
-    return hash_password(password) == password_hash
+    """Validate a password against the stored hash, whatever its format."""
+    if _es_sha256(password_hash):
+        calculado = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(calculado, password_hash)
+    partes = _separar(password_hash)
+    if partes is None:
+        return False
+    algoritmo, costo, sal, clave = partes
+    try:
+        return hmac.compare_digest(_derivar(algoritmo, costo, password, sal), clave)
+    except (KeyError, ValueError):
+        return False
+
+
+def necesita_rehash(password_hash: str) -> bool:
+    """Return ``True`` if *password_hash* does not use the current algorithm and cost."""
+    partes = _separar(password_hash)
+    if partes is None:
+        return True
+    algoritmo, costo, _, clave = partes
+    return algoritmo != _vigente["algoritmo"] or costo != _vigente["costo"] or len(clave) != LARGO_CLAVE
+
+
+def parece_hash(valor: str) -> bool:
+    """Return ``True`` if *valor* has the shape of a value produced by :func:`hash_password`."""
+    return _es_sha256(valor) or _separar(valor) is not None
+
+
+class PoolClaves:
+    """Worker threads that hash and verify passwords off the caller's thread."""
+
+    def __init__(self, hilos: int = HILOS_CLAVES) -> None:
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="claves")
+
+    def verificar(self, password: str, password_hash: str) -> "Future[bool]":
+        return self._ejecutor.submit(verificar_password, password, password_hash)
+
+    def hashear(self, password: str) -> "Future[str]":
+        return self._ejecutor.submit(hash_password, password)
+
+    def verificar_lote(self, pares: Iterable[Tuple[str, str]]) -> List[bool]:
+        """Verify every ``(password, password_hash)`` pair in parallel, keeping the order."""
+        pendientes = [self.verificar(password, password_hash) for password, password_hash in pares]
+        return [pendiente.result() for pendiente in pendientes]
+
+    def cerrar(self) -> None:
+        self._ejecutor.shutdown(wait=True)
+
@@ -1,8 +1,9 @@
 """Manejo del catálogo de servicios a pagar."""
 from __future__ import annotations
 
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional
 
+from catalogo import CatalogoServicios
 from io_archivos import escribir_csv, leer_csv, ruta_datos
 
 CAMPOS_SERVICIO = ["id", "nombre", "categoria", "monto"]
@@ -26,5 +27,17 @@ def cargar_servicios() -> List[Dict[str, str]]:
     return leer_csv(SERVICIOS_PATH)
 
 
-def obtener_servicio(servicios: List[Dict[str, str]], servicio_id: str) -> Optional[Dict[str, str]]:
+def catalogo_servicios(inicializar: bool = True) -> CatalogoServicios:
+    """Return the indexed catalog of ``servicios.csv``; it reloads when the file changes.
+
+    With ``inicializar=False`` nothing touches the disk until the first lookup.
+    """
+    if inicializar:
+        inicializar_catalogo()
+    return CatalogoServicios(SERVICIOS_PATH, leer_csv, clave="id")
+
+
+def obtener_servicio(servicios: Iterable[Dict[str, str]], servicio_id: str) -> Optional[Dict[str, str]]:
+    if isinstance(servicios, CatalogoServicios):
+        return servicios.obtener(servicio_id)
     return next((servicio for servicio in servicios if servicio.get("id") == servicio_id), None)
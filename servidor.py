@@ -0,0 +1,388 @@
+"""Servidor HTTP/JSON con asyncio para operar la billetera por red.
+
+Expone las operaciones de ``usuarios``, ``tarjetas``, ``movimientos`` y
+``servicios`` sin duplicar su lógica. El bucle de eventos solo atiende
+conexiones: toda lectura o escritura de archivos corre en un pool de hilos, y
+las operaciones sobre un mismo usuario se serializan con un ``asyncio.Lock``
+propio de ese usuario (que se descarta cuando nadie lo usa), de modo que las
+cuentas distintas avanzan en paralelo. Las contraseñas se verifican en otro
+pool (``seguridad.PoolClaves``) para que un pico de logins no ocupe los hilos
+de archivos; un usuario inexistente se verifica contra un hash ficticio para
+que el tiempo de respuesta no revele qué cuentas existen. Las sesiones vencen
+tras ``DURACION_SESION`` segundos sin uso.
+
+Rutas (las que requieren sesión esperan ``Authorization: Bearer <token>``):
+
+- ``POST /login`` con ``{"usuario", "password"}`` devuelve ``{"token"}``.
+- ``GET /saldo``
+- ``POST /depositos`` con ``{"monto"}``
+- ``POST /pagos`` con ``{"servicio_id", "tarjeta_id", "monto"?}``
+- ``GET /tarjetas``
+- ``GET /movimientos?pagina=0&por_pagina=20`` (más recientes primero)
+- ``GET /servicios?buscar=lu&categoria=Hogar&limite=20`` (filtros opcionales; el
+  catálogo se vuelve a leer solo si cambió el archivo)
+- ``GET /metricas``: llamadas, tiempo, bytes y filas de cada operación de
+  almacenamiento (``metricas``) y los contadores de la caché de lecturas.
+
+Uso: ``python servidor.py --puerto 8080``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import secrets
+import sys
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from http import HTTPStatus
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import metricas
+from io_archivos import estadisticas_cache
+from logger import registrar_evento
+from movimientos import a_fila, cargar_movimientos, registrar_movimiento
+from registros import Movimiento
+from seguridad import PoolClaves, necesita_rehash
+from servicios import catalogo_servicios, inicializar_catalogo
+from tarjetas import cargar_tarjetas, obtener_tarjeta
+from usuarios import Usuario, actualizar_saldo, cargar_usuarios, registrar_login
+
+HILOS_ARCHIVOS = 32
+TAMANIO_MAXIMO_CUERPO = 64 * 1024
+DURACION_SESION = 30 * 60
+INTERVALO_PURGA_SESIONES = 60
+
+
+class ErrorHTTP(Exception):
+    def __init__(self, estado: HTTPStatus, mensaje: str) -> None:
+        super().__init__(mensaje)
+        self.estado = estado
+        self.mensaje = mensaje
+
+
+class Peticion:
+    def __init__(self, metodo: str, ruta: str, encabezados: Dict[str, str], cuerpo: bytes) -> None:
+        partes = urlsplit(ruta)
+        self.metodo = metodo
+        self.ruta = partes.path
+        self.consulta = {clave: valores[-1] for clave, valores in parse_qs(partes.query).items()}
+        self.encabezados = encabezados
+        self.cuerpo = cuerpo
+
+    def json(self) -> Dict[str, Any]:
+        if not self.cuerpo:
+            return {}
+        try:
+            datos = json.loads(self.cuerpo)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "El cuerpo no es JSON válido.") from None
+        if not isinstance(datos, dict):
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Se esperaba un objeto JSON.")
+        return datos
+
+
+def _monto(valor: Any) -> float:
+    try:
+        monto = float(valor)
+    except (TypeError, ValueError):
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Monto inválido.") from None
+    # json.loads acepta NaN e Infinity, y float() "nan", "inf" o "1e309".
+    if not math.isfinite(monto):
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Monto inválido.")
+    if monto <= 0:
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "El monto debe ser positivo.")
+    return monto
+
+
+class ServidorBilletera:
+    """Serve wallet operations over HTTP/JSON from a single asyncio process."""
+
+    def __init__(self, hilos: int = HILOS_ARCHIVOS) -> None:
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="archivos")
+        self._claves = PoolClaves()
+        self._usuarios: Dict[str, Usuario] = {}
+        self._servicios = catalogo_servicios(inicializar=False)
+        self._movimientos: Dict[str, List[Movimiento]] = {}
+        # token -> (usuario, vencimiento según time.monotonic()).
+        self._sesiones: Dict[str, Tuple[str, float]] = {}
+        self._ultima_purga = time.monotonic()
+        self._bloqueos: Dict[str, asyncio.Lock] = {}
+        self._usos_bloqueo: Dict[str, int] = defaultdict(int)
+        self._hash_ficticio = ""
+        # El WAL de usuarios es compartido por todas las cuentas.
+        self._bloqueo_wal = threading.Lock()
+        self._rutas: Dict[Tuple[str, str], Callable[[Peticion], Awaitable[Any]]] = {
+            ("POST", "/login"): self._login,
+            ("GET", "/saldo"): self._saldo,
+            ("POST", "/depositos"): self._deposito,
+            ("POST", "/pagos"): self._pago,
+            ("GET", "/tarjetas"): self._tarjetas,
+            ("GET", "/movimientos"): self._listar_movimientos,
+            ("GET", "/servicios"): self._listar_servicios,
+            ("GET", "/metricas"): self._metricas,
+        }
+
+    async def _en_hilo(self, funcion: Callable[..., Any], *argumentos: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._ejecutor, partial(funcion, *argumentos))
+
+    async def iniciar(self, host: str, puerto: int) -> asyncio.AbstractServer:
+        """Load the shared data and start listening on *host*:*puerto*."""
+        self._usuarios = await self._en_hilo(cargar_usuarios)
+        await self._en_hilo(inicializar_catalogo)
+        self._hash_ficticio = await asyncio.wrap_future(self._claves.hashear(secrets.token_hex(16)))
+        return await asyncio.start_server(self._atender, host, puerto, limit=TAMANIO_MAXIMO_CUERPO)
+
+    def cerrar(self) -> None:
+        self._claves.cerrar()
+        self._ejecutor.shutdown(wait=True)
+
+    # ---------------- Protocolo ----------------
+
+    async def _leer_peticion(self, lector: asyncio.StreamReader) -> Optional[Peticion]:
+        linea = await lector.readline()
+        if not linea:
+            return None
+        try:
+            metodo, ruta, _ = linea.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Línea de petición inválida.") from None
+        encabezados: Dict[str, str] = {}
+        while True:
+            linea = await lector.readline()
+            if linea in (b"\r\n", b"\n", b""):
+                break
+            clave, _, valor = linea.decode("latin-1").partition(":")
+            encabezados[clave.strip().lower()] = valor.strip()
+        try:
+            largo = int(encabezados.get("content-length", "0"))
+        except ValueError:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Content-Length inválido.") from None
+        if largo < 0:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Content-Length inválido.")
+        if largo > TAMANIO_MAXIMO_CUERPO:
+            raise ErrorHTTP(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Cuerpo demasiado grande.")
+        cuerpo = await lector.readexactly(largo) if largo else b""
+        return Peticion(metodo.upper(), ruta, encabezados, cuerpo)
+
+    @staticmethod
+    async def _responder(escritor: asyncio.StreamWriter, estado: HTTPStatus, datos: Any, mantener: bool) -> None:
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        encabezado = (
+            f"HTTP/1.1 {estado.value} {estado.phrase}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n"
+        )
+        escritor.write(encabezado.encode("latin-1") + cuerpo)
+        await escritor.drain()
+
+    async def _despachar(self, peticion: Peticion) -> Any:
+        manejador = self._rutas.get((peticion.metodo, peticion.ruta))
+        if manejador is None:
+            raise ErrorHTTP(HTTPStatus.NOT_FOUND, "Ruta inexistente.")
+        try:
+            return await manejador(peticion)
+        except ErrorHTTP:
+            raise
+        except Exception as error:
+            # Un error inesperado de una operación responde 500 en lugar de
+            # cortar la conexión sin respuesta.
+            traceback.print_exc(file=sys.stderr)
+            registrar_evento("error_servidor", f"{peticion.metodo} {peticion.ruta};{error!r}")
+            raise ErrorHTTP(HTTPStatus.INTERNAL_SERVER_ERROR, "Error interno del servidor.") from None
+
+    async def _atender(self, lector: asyncio.StreamReader, escritor: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                peticion = None
+                try:
+                    peticion = await self._leer_peticion(lector)
+                    if peticion is None:
+                        break
+                    estado, datos = HTTPStatus.OK, await self._despachar(peticion)
+                except ErrorHTTP as error:
+                    estado, datos = error.estado, {"error": error.mensaje}
+                mantener = peticion is not None and peticion.encabezados.get("connection", "").lower() != "close"
+                await self._responder(escritor, estado, datos, mantener)
+                if not mantener:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            escritor.close()
+
+    def _usuario_de(self, peticion: Peticion) -> str:
+        autorizacion = peticion.encabezados.get("authorization", "")
+        token = autorizacion[7:] if autorizacion.lower().startswith("bearer ") else ""
+        sesion = self._sesiones.get(token)
+        ahora = time.monotonic()
+        if sesion is None or sesion[1] <= ahora:
+            self._sesiones.pop(token, None)
+            raise ErrorHTTP(HTTPStatus.UNAUTHORIZED, "Sesión inválida.")
+        self._sesiones[token] = (sesion[0], ahora + DURACION_SESION)
+        return sesion[0]
+
+    def _purgar_sesiones(self) -> None:
+        ahora = time.monotonic()
+        if ahora - self._ultima_purga < INTERVALO_PURGA_SESIONES:
+            return
+        self._ultima_purga = ahora
+        for token in [token for token, (_, vence) in self._sesiones.items() if vence <= ahora]:
+            del self._sesiones[token]
+
+    @asynccontextmanager
+    async def _bloqueo_usuario(self, usuario: str) -> AsyncIterator[None]:
+        # Todo corre en el bucle de eventos: el contador no necesita otro bloqueo.
+        bloqueo = self._bloqueos.get(usuario)
+        if bloqueo is None:
+            bloqueo = self._bloqueos[usuario] = asyncio.Lock()
+        self._usos_bloqueo[usuario] += 1
+        try:
+            async with bloqueo:
+                yield
+        finally:
+            self._usos_bloqueo[usuario] -= 1
+            if not self._usos_bloqueo[usuario]:
+                del self._usos_bloqueo[usuario]
+                del self._bloqueos[usuario]
+
+    # ---------------- Operaciones ----------------
+
+    async def _login(self, peticion: Peticion) -> Dict[str, Any]:
+        datos = peticion.json()
+        nombre = str(datos.get("usuario", ""))
+        password = str(datos.get("password", ""))
+        usuario = self._usuarios.get(nombre)
+        password_hash = usuario.password_hash if usuario is not None else self._hash_ficticio
+        valido = await asyncio.wrap_future(self._claves.verificar(password, password_hash)) and usuario is not None
+        nuevo_hash = None
+        if valido and necesita_rehash(usuario.password_hash):
+            nuevo_hash = await asyncio.wrap_future(self._claves.hashear(password))
+        usuario = await self._en_hilo(self._registrar_login, nombre, valido, nuevo_hash)
+        if usuario is None:
+            raise ErrorHTTP(HTTPStatus.UNAUTHORIZED, "Datos incorrectos.")
+        self._purgar_sesiones()
+        token = secrets.token_hex(16)
+        self._sesiones[token] = (nombre, time.monotonic() + DURACION_SESION)
+        return {"token": token}
+
+    async def _saldo(self, peticion: Peticion) -> Dict[str, Any]:
+        usuario = self._usuario_de(peticion)
+        return {"usuario": usuario, "saldo": round(self._usuarios[usuario].saldo, 2)}
+
+    async def _movimientos_de(self, usuario: str) -> List[Movimiento]:
+        # Se llama con el bloqueo del usuario tomado.
+        if usuario not in self._movimientos:
+            self._movimientos[usuario] = await self._en_hilo(cargar_movimientos, usuario)
+        return self._movimientos[usuario]
+
+    def _registrar_login(self, nombre: str, valido: bool, nuevo_hash: Optional[str]) -> Optional[Usuario]:
+        with self._bloqueo_wal:
+            return registrar_login(self._usuarios, nombre, valido, nuevo_hash)
+
+    def _aplicar(self, usuario: str, movimientos: List[Movimiento], tipo: str, descripcion: str, monto: float) -> float:
+        saldo = self._usuarios[usuario].saldo + monto
+        with self._bloqueo_wal:
+            actualizar_saldo(self._usuarios, usuario, saldo)
+        registrar_movimiento(usuario, movimientos, tipo, descripcion, abs(monto), saldo)
+        return saldo
+
+    async def _deposito(self, peticion: Peticion) -> Dict[str, Any]:
+        usuario = self._usuario_de(peticion)
+        monto = _monto(peticion.json().get("monto"))
+        async with self._bloqueo_usuario(usuario):
+            movimientos = await self._movimientos_de(usuario)
+            saldo = await self._en_hilo(self._aplicar, usuario, movimientos, "Ingreso", "Ingreso de dinero", monto)
+        return {"saldo": round(saldo, 2)}
+
+    async def _pago(self, peticion: Peticion) -> Dict[str, Any]:
+        usuario = self._usuario_de(peticion)
+        datos = peticion.json()
+        # El catálogo puede hacer os.stat y releer su archivo: fuera del lazo.
+        servicio = await self._en_hilo(self._servicios.obtener, str(datos.get("servicio_id", "")))
+        if servicio is None:
+            raise ErrorHTTP(HTTPStatus.NOT_FOUND, "Servicio inexistente.")
+        monto = _monto(datos.get("monto", servicio.get("monto", "0")))
+        async with self._bloqueo_usuario(usuario):
+            tarjetas = await self._en_hilo(cargar_tarjetas, usuario)
+            if obtener_tarjeta(tarjetas, str(datos.get("tarjeta_id", ""))) is None:
+                raise ErrorHTTP(HTTPStatus.NOT_FOUND, "Tarjeta no encontrada.")
+            if monto > self._usuarios[usuario].saldo:
+                raise ErrorHTTP(HTTPStatus.CONFLICT, "Saldo insuficiente.")
+            movimientos = await self._movimientos_de(usuario)
+            saldo = await self._en_hilo(
+                self._aplicar, usuario, movimientos, "Pago servicio", servicio.get("nombre", ""), -monto
+            )
+        return {"saldo": round(saldo, 2)}
+
+    async def _tarjetas(self, peticion: Peticion) -> Dict[str, Any]:
+        usuario = self._usuario_de(peticion)
+        tarjetas = await self._en_hilo(cargar_tarjetas, usuario)
+        for tarjeta in tarjetas:
+            numero = tarjeta.get("numero", "")
+            tarjeta["numero"] = "****" + numero[-4:] if len(numero) >= 4 else numero
+        return {"tarjetas": tarjetas}
+
+    async def _listar_movimientos(self, peticion: Peticion) -> Dict[str, Any]:
+        usuario = self._usuario_de(peticion)
+        try:
+            pagina = max(0, int(peticion.consulta.get("pagina", "0")))
+            por_pagina = min(200, max(1, int(peticion.consulta.get("por_pagina", "20"))))
+        except ValueError:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Paginación inválida.") from None
+        async with self._bloqueo_usuario(usuario):
+            movimientos = await self._movimientos_de(usuario)
+            fin = len(movimientos) - pagina * por_pagina
+            pagina_actual = movimientos[max(0, fin - por_pagina) : max(0, fin)]
+        return {"movimientos": [a_fila(movimiento) for movimiento in reversed(pagina_actual)], "hay_siguiente": fin - por_pagina > 0}
+
+    async def _listar_servicios(self, peticion: Peticion) -> Dict[str, Any]:
+        texto = peticion.consulta.get("buscar")
+        categoria = peticion.consulta.get("categoria")
+        if texto is None and categoria is None:
+            return {"servicios": await self._en_hilo(self._servicios.todos)}
+        if texto is None:
+            return {"servicios": await self._en_hilo(self._servicios.por_categoria, categoria)}
+        try:
+            limite = min(200, max(1, int(peticion.consulta.get("limite", "20"))))
+        except ValueError:
+            raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Límite inválido.") from None
+        return {"servicios": await self._en_hilo(self._servicios.buscar, texto, limite, categoria)}
+
+    async def _metricas(self, peticion: Peticion) -> Dict[str, Any]:
+        return {"operaciones": metricas.instantanea(), "cache_lecturas": estadisticas_cache()}
+
+
+async def _servir(host: str, puerto: int, hilos: int) -> None:
+    servidor = ServidorBilletera(hilos)
+    escucha = await servidor.iniciar(host, puerto)
+    print(f"Kiwillet escuchando en http://{host}:{puerto}")
+    try:
+        async with escucha:
+            await escucha.serve_forever()
+    finally:
+        servidor.cerrar()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor HTTP/JSON de la billetera.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8080)
+    parser.add_argument("--hilos", type=int, default=HILOS_ARCHIVOS, help="hilos para la E/S de archivos")
+    argumentos = parser.parse_args()
+    try:
+        asyncio.run(_servir(argumentos.host, argumentos.puerto, argumentos.hilos))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Confirmación agrupada (group commit) de operaciones de saldo.
+
+Una operación de la billetera cambia el saldo de un usuario y registra el
+movimiento que lo explica. :class:`CommitGrupal` recibe esas operaciones desde
+cualquier hilo y las persiste con una sola llamada a
+``almacen.aplicar_operaciones``: una escritura y un fsync por archivo (o una
+transacción SQLite) por grupo en lugar de dos escrituras por operación. Una
+operación que llega sola se confirma enseguida; solo cuando hay otras en
+cola se espera hasta ``intervalo`` segundos (o hasta completar
+``tamanio_lote``) para sumar las que se superponen. Las que llegan mientras
+se escribe un grupo forman el siguiente.
+"""
+from __future__ import annotations
+
+import math
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import bloqueos
+import registros
+from registros import Movimiento
+
+INTERVALO_COMMIT = 0.005
+TAMANIO_LOTE = 256
+
+
+@dataclass
+class Transaccion:
+    usuario: str
+    datos_usuario: Dict[str, Any]
+    movimiento: Movimiento
+    confirmada: threading.Event = field(default_factory=threading.Event)
+    error: Optional[BaseException] = None
+
+
+class CommitGrupal:
+    """Background committer that shares one flush among concurrent transactions."""
+
+    def __init__(self, almacen: Any, intervalo: float = INTERVALO_COMMIT, tamanio_lote: int = TAMANIO_LOTE) -> None:
+        self._almacen = almacen
+        self._intervalo = intervalo
+        self._tamanio_lote = max(1, tamanio_lote)
+        self._cola: "queue.Queue[Optional[Transaccion]]" = queue.Queue()
+        self._hilo = threading.Thread(target=self._trabajar, name="commit-grupal", daemon=True)
+        self._hilo.start()
+
+    def confirmar(
+        self,
+        usuarios: Dict[str, Dict[str, Any]],
+        movimientos: Dict[str, List[Movimiento]],
+        usuario: str,
+        movimiento: Movimiento,
+    ) -> None:
+        """Stage the user's current record and *movimiento*, and block until both are persisted."""
+        movimientos.setdefault(usuario, []).append(movimiento)
+        transaccion = Transaccion(usuario, dict(usuarios[usuario]), movimiento)
+        self._cola.put(transaccion)
+        transaccion.confirmada.wait()
+        if transaccion.error is not None:
+            raise transaccion.error
+
+    def cerrar(self) -> None:
+        """Flush pending transactions and stop the background thread."""
+        self._cola.put(None)
+        self._hilo.join()
+
+    def _juntar_lote(self, primera: Transaccion) -> Tuple[List[Transaccion], bool]:
+        lote = [primera]
+        limite = time.monotonic() + self._intervalo
+        while len(lote) < self._tamanio_lote:
+            restante = limite - time.monotonic()
+            try:
+                # Sin otras en cola no hay con qué agrupar: no se espera.
+                if len(lote) > 1 and restante > 0:
+                    siguiente = self._cola.get(timeout=restante)
+                else:
+                    siguiente = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if siguiente is None:
+                return lote, True
+            lote.append(siguiente)
+        return lote, False
+
+    def _trabajar(self) -> None:
+        terminar = False
+        while not terminar:
+            primera = self._cola.get()
+            if primera is None:
+                break
+            lote, terminar = self._juntar_lote(primera)
+            try:
+                self._almacen.aplicar_operaciones(
+                    [(transaccion.usuario, transaccion.datos_usuario, transaccion.movimiento) for transaccion in lote]
+                )
+            except Exception as error:  # se informa a cada hilo que esperaba su confirmación
+                for transaccion in lote:
+                    transaccion.error = error
+            for transaccion in lote:
+                transaccion.confirmada.set()
+
+
+def mover_saldo(
+    almacen: Any,
+    confirmador: CommitGrupal,
+    usuarios: Dict[str, Dict[str, Any]],
+    movimientos: Dict[str, List[Movimiento]],
+    usuario: str,
+    monto: float,
+    concepto: str,
+    fecha: str,
+) -> Optional[float]:
+    """Add *monto* (negative for payments) to the balance and record the movement.
+
+    The user's lock is held while the balance is refreshed from storage,
+    updated and committed, so concurrent processes never overwrite each
+    other's changes. Returns the new balance, or ``None`` if funds are short;
+    raises ``ValueError`` if *monto* is not finite.
+    """
+    if not math.isfinite(monto):
+        raise ValueError(f"Monto inválido: {monto}")
+    with bloqueos.bloquear_usuario(usuario):
+        almacen.refrescar_usuario(usuarios, usuario)
+        saldo = usuarios[usuario]["saldo"] + monto
+        if saldo < 0:
+            return None
+        # El movimiento se arma antes de tocar el saldo en memoria, para que
+        # un error al convertirlo deje al usuario como estaba.
+        movimiento = Movimiento(
+            registros.fecha_desde_texto(fecha),
+            concepto,
+            registros.a_centavos(abs(monto)),
+            registros.a_centavos(saldo),
+        )
+        usuarios[usuario]["saldo"] = saldo
+        confirmador.confirmar(usuarios, movimientos, usuario, movimiento)
+    return saldo
@@ -1,14 +1,18 @@
 """Gestión de usuarios de la aplicación Kiwillet."""
 from __future__ import annotations
 
+import json
 from dataclasses import dataclass
-from typing import Dict, Optional
+from typing import Any, Dict, Iterator, Optional
 
-from io_archivos import escribir_json, leer_json, ruta_datos
+from io_archivos import asegurar_directorio, escribir_json, leer_json, ruta_datos
 from logger import registrar_evento
-from seguridad import hash_password, verificar_password
+from metricas import medir
+from seguridad import hash_password, necesita_rehash, verificar_password
 
 USUARIOS_PATH = ruta_datos("usuarios.json")
+USUARIOS_WAL_PATH = ruta_datos("usuarios.wal")
+WAL_MAXIMO_BYTES = 256 * 1024
 
 
 @dataclass
@@ -25,23 +29,68 @@ class Usuario:
         }
 
 
+def _aplicar_entrada(usuarios: Dict[str, Usuario], entrada: Dict[str, Any]) -> None:
+    nombre = entrada.get("usuario", "")
+    if not nombre:
+        return
+    usuarios[nombre] = Usuario(
+        nombre=nombre,
+        password_hash=entrada.get("password_hash", ""),
+        saldo=float(entrada.get("saldo", 0.0)),
+    )
+
+
+def _leer_wal() -> Iterator[Dict[str, Any]]:
+    if not USUARIOS_WAL_PATH.exists():
+        return
+    with USUARIOS_WAL_PATH.open("r", encoding="utf-8") as archivo:
+        for linea in archivo:
+            try:
+                yield json.loads(linea)
+            except json.JSONDecodeError:
+                # Una entrada cortada por una caída se descarta.
+                continue
+
+
 def cargar_usuarios() -> Dict[str, Usuario]:
-    datos = leer_json(USUARIOS_PATH, default=[])
     usuarios: Dict[str, Usuario] = {}
-    for entrada in datos:
-        nombre = entrada.get("usuario", "")
-        if not nombre:
-            continue
-        usuarios[nombre] = Usuario(
-            nombre=nombre,
-            password_hash=entrada.get("password_hash", ""),
-            saldo=float(entrada.get("saldo", 0.0)),
-        )
+    for entrada in leer_json(USUARIOS_PATH, default=[]):
+        _aplicar_entrada(usuarios, entrada)
+    for entrada in _leer_wal():
+        _aplicar_entrada(usuarios, entrada)
     return usuarios
 
 
 def guardar_usuarios(usuarios: Dict[str, Usuario]) -> None:
-    escribir_json(USUARIOS_PATH, [usuario.to_dict() for usuario in usuarios.values()])
+    """Write a full compact snapshot of *usuarios* and empty the WAL."""
+    # La instantánea reemplaza a la anterior ya en disco (fsync + os.replace);
+    # el WAL se vacía solo después, así que una caída deja una de las dos.
+    escribir_json(USUARIOS_PATH, [usuario.to_dict() for usuario in usuarios.values()], indent=None, sincronizar=True)
+    USUARIOS_WAL_PATH.write_text("", encoding="utf-8")
+
+
+def compactar_usuarios() -> Dict[str, Usuario]:
+    """Fold the WAL into a new snapshot built from what is on disk."""
+    if USUARIOS_PATH.exists() and leer_json(USUARIOS_PATH, default=None) is None:
+        # Una instantánea ilegible no se pisa ni se vacía el WAL: se perderían
+        # los usuarios que solo están en ella.
+        registrar_evento("compactacion_omitida", str(USUARIOS_PATH))
+        return cargar_usuarios()
+    usuarios = cargar_usuarios()
+    guardar_usuarios(usuarios)
+    return usuarios
+
+
+def _registrar_cambio(usuario: Usuario) -> None:
+    asegurar_directorio(USUARIOS_WAL_PATH.parent)
+    with medir("usuarios.registrar_cambio") as medicion:
+        linea = json.dumps(usuario.to_dict(), ensure_ascii=False) + "\n"
+        with USUARIOS_WAL_PATH.open("a", encoding="utf-8") as archivo:
+            archivo.write(linea)
+        medicion.bytes = len(linea)
+        medicion.filas = 1
+    if USUARIOS_WAL_PATH.stat().st_size > WAL_MAXIMO_BYTES:
+        compactar_usuarios()
 
 
 def crear_usuario(usuarios: Dict[str, Usuario], nombre: str, password: str) -> bool:
@@ -49,21 +98,32 @@ def crear_usuario(usuarios: Dict[str, Usuario], nombre: str, password: str) -> b
         return False
     usuario = Usuario(nombre=nombre, password_hash=hash_password(password), saldo=0.0)
     usuarios[nombre] = usuario
-    guardar_usuarios(usuarios)
+    _registrar_cambio(usuario)
     registrar_evento("alta_usuario", nombre)
     return True
 
 
 def autenticar_usuario(usuarios: Dict[str, Usuario], nombre: str, password: str) -> Optional[Usuario]:
     usuario = usuarios.get(nombre)
-    if usuario is None:
+    valido = usuario is not None and verificar_password(password, usuario.password_hash)
+    nuevo_hash = hash_password(password) if valido and necesita_rehash(usuario.password_hash) else None
+    return registrar_login(usuarios, nombre, valido, nuevo_hash)
+
+
+def registrar_login(
+    usuarios: Dict[str, Usuario], nombre: str, valido: bool, nuevo_hash: Optional[str] = None
+) -> Optional[Usuario]:
+    """Log a login already verified by the caller and store *nuevo_hash* if the old one was outdated."""
+    usuario = usuarios.get(nombre)
+    if usuario is None or not valido:
         registrar_evento("login_fallido", nombre)
         return None
-    if verificar_password(password, usuario.password_hash):
-        registrar_evento("login_exitoso", nombre)
-        return usuario
-    registrar_evento("login_fallido", nombre)
-    return None
+    if nuevo_hash is not None:
+        usuario.password_hash = nuevo_hash
+        _registrar_cambio(usuario)
+        registrar_evento("rehash_password", nombre)
+    registrar_evento("login_exitoso", nombre)
+    return usuario
 
 
 def cambiar_contrasena(usuarios: Dict[str, Usuario], nombre: str, nueva_password: str) -> bool:
@@ -71,7 +131,7 @@ def cambiar_contrasena(usuarios: Dict[str, Usuario], nombre: str, nueva_password
     if usuario is None:
         return False
     usuario.password_hash = hash_password(nueva_password)
-    guardar_usuarios(usuarios)
+    _registrar_cambio(usuario)
     registrar_evento("cambio_password", nombre)
     return True
 
@@ -81,4 +141,4 @@ def actualizar_saldo(usuarios: Dict[str, Usuario], nombre: str, saldo: float) ->
     if usuario is None:
         return
     usuario.saldo = saldo
-    guardar_usuarios(usuarios)
+    _registrar_cambio(usuario)